@@ -0,0 +1,127 @@
+import argparse
+import functools
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+import resource_registry
+
+# What a booking needs done, worked out without any upstream call: the doors that get a passcode,
+# the passcode window and what the message says. pipeline.py runs the plans. Plans only depend on the
+# resource and the slot, so they are cached per registry snapshot and resource, and per window
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Passcodes open this long before the booking starts; cancellations look passcodes up by the same window
+ACCESS_LEAD = timedelta(minutes=15)
+MESSAGE_TIMEZONE = pytz.timezone('Europe/Helsinki')
+# Entries per cache; two weeks of quarter-hour slots in the usual durations fit
+PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE', '8192'))
+
+
+class Window:
+    __slots__ = ('starts_ms', 'ends_ms', 'valid_from', 'valid_to')
+
+    def __init__(self, starts_ms, ends_ms, valid_from, valid_to):
+        # epoch ms as Sciener stores them, and local times as the coworker message shows them
+        self.starts_ms = starts_ms
+        self.ends_ms = ends_ms
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+
+    def __repr__(self):
+        return f'Window({self.valid_from}..{self.valid_to})'
+
+
+class AccessPlan:
+    __slots__ = ('resource_id', 'doors', 'window')
+
+    def __init__(self, resource_id, doors, window):
+        self.resource_id = resource_id
+        # ((lock_mac, door_name), ...): the booked door first, then the main doors its class opens
+        self.doors = doors
+        self.window = window
+
+    @property
+    def lock_macs(self):
+        return [lock_mac for lock_mac, _ in self.doors]
+
+    def __repr__(self):
+        return f'AccessPlan({self.resource_id}, {self.lock_macs}, {self.window})'
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def doors(registry, resource_id):
+    # keyed by the snapshot itself, so a reloaded registry never gets a stale plan
+    lock_mac = registry.resource_to_lock.get(resource_id)
+    resource_class = registry.resource_class(resource_id)
+    if not lock_mac or resource_class is None:
+        return ()
+    macs = (lock_mac,) + registry.main_doors[resource_class]
+    return tuple((mac, registry.door_name(mac)) for mac in macs)
+
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def window(from_time, to_time):
+    # bookings start on the quarter hour, so most slots repeat across resources and days
+    starts = datetime.strptime(from_time, TIME_FORMAT).replace(tzinfo=pytz.utc) - ACCESS_LEAD
+    ends = datetime.strptime(to_time, TIME_FORMAT).replace(tzinfo=pytz.utc)
+    return Window(round(starts.timestamp() * 1000), round(ends.timestamp() * 1000),
+                  starts.astimezone(MESSAGE_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'),
+                  ends.astimezone(MESSAGE_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def plan(job, registry=None):
+    registry = registry or resource_registry.current()
+    return AccessPlan(job.resource_id, doors(registry, job.resource_id), window(job.from_time, job.to_time))
+
+
+def cache_info():
+    return {'doors': doors.cache_info()._asdict(), 'windows': window.cache_info()._asdict()}
+
+
+def clear_cache():
+    doors.cache_clear()
+    window.cache_clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Dry run: plan generated bookings without calling any upstream '
+                                                 'and report the planner throughput')
+    parser.add_argument('--bookings', type=int, default=10000)
+    parser.add_argument('--mix', default='single=0.5,case1=0.2,case2=0.3', help='resource class weights')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # only the dry run needs the generator and the job record
+    import booking_generator
+    from booking_job import BookingJob
+    generator = booking_generator.BookingGenerator(booking_generator.parse_mix(args.mix), 60, cancel_share=0,
+                                                   duplicate_rate=0, seed=args.seed)
+    jobs = []
+    for event in generator.arrivals(time.time()):
+        jobs.extend(BookingJob.from_nexudus(booking) for booking in event['payload'])
+        if len(jobs) >= args.bookings:
+            break
+    jobs = jobs[:args.bookings]
+    registry = resource_registry.current()
+
+    clear_cache()
+    result = {'bookings': len(jobs)}
+    for run in ('cold', 'warm'):
+        before = window.cache_info().hits
+        started = time.perf_counter()
+        plans = [plan(job, registry) for job in jobs]
+        elapsed = time.perf_counter() - started
+        result[run] = {'plans_per_s': round(len(jobs) / elapsed) if elapsed else None,
+                       'window_hit_rate': round((window.cache_info().hits - before) / len(jobs), 3) if jobs else None}
+    result['doors'] = sum(len(p.doors) for p in plans)
+    # resources without a lock or a class in resources.json
+    result['unplanned'] = sum(1 for p in plans if not p.doors)
+    result['cache'] = cache_info()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import access_plan
+import execution
+import gateway_health
+import intake
+import lock_index
+
+# Under load, bookings that start far enough ahead wait in the delayed job queue, so the ones
+# about to start keep their latency. Imminent bookings are always admitted
+ADMISSION_IMMINENT_MINUTES = float(os.environ.get('ADMISSION_IMMINENT_MINUTES', '180'))
+# Jobs queued or running in this web worker (pool jobs or live booking processes), plus the intake ring
+ADMISSION_MAX_BACKLOG = int(os.environ.get('ADMISSION_MAX_BACKLOG', '20'))
+ADMISSION_DEFER_SECONDS = float(os.environ.get('ADMISSION_DEFER_SECONDS', '600'))
+ADMISSION_MIN_DEFER_SECONDS = float(os.environ.get('ADMISSION_MIN_DEFER_SECONDS', '30'))
+
+BACKLOG, SATURATED = 'backlog', 'saturated'
+
+
+def minutes_to_start(booking, now=None):
+    # From FromTime rather than the payload's MinutesToStart, which is stale once a booking has waited
+    starts = datetime.strptime(booking.from_time, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    return (starts.timestamp() - (now or time.time())) / 60
+
+
+def backlog():
+    return execution.pending() + intake.ring().size
+
+
+def saturated_gateway(booking):
+    for mac in access_plan.plan(booking).lock_macs:
+        lock_id = lock_index.lookup(mac)
+        if lock_id and gateway_health.state(lock_id) == 'saturated':
+            return lock_id
+    return None
+
+
+def check(booking):
+    # None to admit now, else (reason, seconds to wait before the booking is looked at again)
+    minutes = minutes_to_start(booking)
+    if minutes <= ADMISSION_IMMINENT_MINUTES:
+        return None
+    if backlog() >= ADMISSION_MAX_BACKLOG:
+        reason = BACKLOG
+    elif saturated_gateway(booking):
+        reason = SATURATED
+    else:
+        return None
+    # back in time to be provisioned before it turns imminent, whatever the load is then
+    until_imminent = max((minutes - ADMISSION_IMMINENT_MINUTES) * 60, ADMISSION_MIN_DEFER_SECONDS)
+    return reason, min(ADMISSION_DEFER_SECONDS, until_imminent)
+
+
+def status():
+    return {'backlog': backlog(), 'max_backlog': ADMISSION_MAX_BACKLOG,
+            'imminent_minutes': ADMISSION_IMMINENT_MINUTES, 'defer_seconds': ADMISSION_DEFER_SECONDS}
@@ -0,0 +1,40 @@
+# Canned Sciener/Nexudus replies, for the in-process fixtures and for cold_start.py's fresh interpreter.
+# Imports nothing from the service, so it does not skew what cold_start.py measures
+
+
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def passcode_page(lock_id, count=20, start_ms=1725508800000):
+    return {'list': [{'keyboardPwdId': i, 'lockId': lock_id, 'startDate': start_ms + i * 60000,
+                      'endDate': start_ms + i * 60000 + 3600000} for i in range(count)]}
+
+
+def request_for(locks=()):
+    # A stand-in for requests.request, which upstream_http sends everything through; locks is the
+    # v3/lock/list answer
+    def post(url, data=None, **kwargs):
+        if url.endswith('oauth2/token') or url.endswith('api/token'):
+            return StubResponse({'access_token': 'a', 'refresh_token': 'r', 'expires_in': 3600, 'uid': 1})
+        if url.endswith('keyboardPwd/add'):
+            return StubResponse({'keyboardPwdId': 1})
+        return StubResponse({})
+
+    def get(url, params=None, **kwargs):
+        if url.endswith('listKeyboardPwd'):
+            return StubResponse(passcode_page(params['lockId']) if params['pageNo'] == 1 else {'list': []})
+        if url.endswith('lock/list'):
+            return StubResponse({'list': list(locks) if params['pageNo'] == 1 else [], 'pages': 1})
+        return StubResponse({'list': []})
+
+    def request(method, url, params=None, data=None, **kwargs):
+        return get(url, params=params, **kwargs) if method == 'GET' else post(url, data=data, **kwargs)
+
+    return request
@@ -0,0 +1,61 @@
+# One booking in a fresh interpreter, the way a booking process or a restarted dyno meets its first
+# webhook. Prints one JSON line with the import, warm-up and first-booking times in ms.
+#
+#   STATE_DIR=/tmp/bench python benchmarks/cold_start.py [--entry booking_worker] [--warm-up]
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import canned_upstream  # noqa: E402
+
+BOOKING = {
+    'ResourceId': 1415109087, 'ResourceName': '6 Pax Meeting Room #4', 'CoworkerId': 1417691430,
+    'CoworkerFullName': 'eg with plan', 'FromTime': '2024-09-05T06:00:00Z', 'ToTime': '2024-09-05T07:00:00Z',
+    'Tentative': False, 'Online': True, 'CancelIfNotPaid': False, 'CoworkerInvoicePaid': False,
+    'InvoiceDate': None, 'BookingNumber': 165,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time from import to the first provisioned booking')
+    parser.add_argument('--entry', default='booking_worker', help='module a worker imports first')
+    parser.add_argument('--warm-up', action='store_true', help='run booking_worker.warm_up() before the booking')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    importlib.import_module(args.entry)
+    imported = time.perf_counter()
+
+    import booking_ledger
+    import booking_worker
+    import pipeline
+    import resource_registry
+    import requests
+    from booking_job import BookingJob
+    locks = [{'lockMac': mac, 'lockId': 9000000 + i}
+             for i, mac in enumerate(sorted(booking_worker.door_macs(resource_registry.current())))]
+    requests.request = canned_upstream.request_for(locks)
+
+    if args.warm_up:
+        booking_worker.warm_up()
+    warmed = time.perf_counter()
+
+    # a booking no earlier run has claimed
+    booking = BookingJob.from_nexudus(dict(BOOKING, Id=time.time_ns() // 1000))
+    pipeline.handle_request(booking)
+    provisioned = time.perf_counter()
+
+    print(json.dumps({
+        'entry': args.entry, 'import_ms': round((imported - started) * 1000, 1),
+        'warm_up_ms': round((warmed - imported) * 1000, 1), 'first_booking_ms': round((provisioned - warmed) * 1000, 1),
+        'provisioned': booking_ledger.is_provisioned(booking),
+    }))
+
+
+if __name__ == '__main__':
+    main()
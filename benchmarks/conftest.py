@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('pytest_benchmark')
+
+os.environ.setdefault('STATE_DIR', tempfile.mkdtemp(prefix='smartlock-bench-'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# the upstream rate limits would have the benchmarks wait out real token refills
+os.environ.setdefault('UPSTREAM_RATE_LIMITS', '')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import canned_upstream  # noqa: E402
+import main_updated_Final as service  # noqa: E402
+import pipeline  # noqa: E402
+
+
+@pytest.fixture
+def stub_upstream(monkeypatch):
+    # Canned Sciener/Nexudus replies so only the pipeline's own CPU work is measured
+    monkeypatch.setattr(pipeline.requests, 'request', canned_upstream.request_for())
+    monkeypatch.setattr(pipeline.time, 'sleep', lambda seconds: None)
+    return pipeline
+
+
+@pytest.fixture
+def web_app(stub_upstream):
+    return service
@@ -0,0 +1,33 @@
+# Restart cost: each round is a fresh interpreter, so these time imports and first-use loading
+# rather than steady-state CPU work. cold_start.py's JSON breakdown lands in extra_info.
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLD_START = os.path.join(ROOT, 'benchmarks', 'cold_start.py')
+# the shared rate limiter would throttle later rounds on what earlier ones spent
+ENV = dict(os.environ, UPSTREAM_RATE_LIMITS='')
+
+
+@pytest.mark.parametrize('entry', ['booking_worker', 'main_updated_Final'])
+def test_worker_startup(benchmark, entry):
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', f'import {entry}'],),
+                       kwargs={'check': True, 'cwd': ROOT, 'env': ENV}, rounds=5)
+
+
+@pytest.mark.parametrize('warm_up', [False, True], ids=['cold', 'warm'])
+def test_time_to_first_provision(benchmark, warm_up):
+    runs = []
+
+    def boot():
+        out = subprocess.run([sys.executable, COLD_START] + (['--warm-up'] if warm_up else []), check=True,
+                             cwd=ROOT, env=ENV, capture_output=True, text=True).stdout
+        runs.append(json.loads(out.splitlines()[-1]))
+
+    benchmark.pedantic(boot, rounds=5)
+    assert all(run['provisioned'] for run in runs)
+    benchmark.extra_info.update(runs[-1])
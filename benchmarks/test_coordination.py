@@ -0,0 +1,97 @@
+# The redis coordination backend against an in-process stand-in for the server, so leases, contention
+# and expiry are checked without a redis install. Expiry runs on the stand-in's own clock.
+import fnmatch
+import os
+import sys
+import types
+
+import pytest
+
+import coordination
+
+
+class RedisStandIn:
+    # The commands RedisBackend sends: SET NX PX, GET, DEL, SCAN and its two owner-checked scripts
+    def __init__(self):
+        self.now = 1000.0
+        self.values = {}
+
+    def _live(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires <= self.now:
+            del self.values[key]
+            return None
+        return value
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self._live(key) is not None:
+            return None
+        self.values[key] = (value, self.now + px / 1000 if px else None)
+        return True
+
+    def get(self, key):
+        return self._live(key)
+
+    def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.values) if fnmatch.fnmatchcase(key, pattern) and self._live(key) is not None]
+
+    def eval(self, script, numkeys, key, owner, *args):
+        if self._live(key) != owner:
+            return 0
+        if "'pexpire'" in script:
+            self.values[key] = (owner, self.now + int(args[0]) / 1000)
+            return 1
+        if "'del'" in script:
+            return self.delete(key)
+        raise NotImplementedError(script)
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = RedisStandIn()
+    module = types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url, decode_responses: server))
+    monkeypatch.setitem(sys.modules, 'redis', module)
+    monkeypatch.setattr(coordination, '_backends', {os.getpid(): coordination.RedisBackend('redis://stand-in')})
+    return server
+
+
+def test_lock_acquire_and_release(redis_server):
+    with coordination.lock('booking:1', ttl=30):
+        assert list(coordination.status()['leases']) == ['booking:1']
+    assert coordination.status()['leases'] == {}
+
+
+def test_lock_contention(redis_server):
+    backend = coordination.backend()
+    assert backend.acquire('gateway:7', 'dyno-a', 30)
+    with pytest.raises(coordination.LockBusy):
+        with coordination.lock('gateway:7', ttl=30, wait=0):
+            pass
+    # only the owner renews or releases the lease
+    assert backend.acquire('gateway:7', 'dyno-a', 30)
+    backend.release('gateway:7', 'dyno-b')
+    assert coordination.status()['leases'] == {'gateway:7': 'dyno-a'}
+
+
+def test_lock_expiry(redis_server):
+    backend = coordination.backend()
+    assert backend.acquire('booking:2', 'dyno-a', 30)
+    redis_server.now += 29
+    assert not backend.acquire('booking:2', 'dyno-b', 30)
+    redis_server.now += 2
+    assert backend.acquire('booking:2', 'dyno-b', 30)
+    # the old owner finishing late must not release the lease that moved on
+    backend.release('booking:2', 'dyno-a')
+    assert coordination.status()['leases'] == {'booking:2': 'dyno-b'}
+
+
+def test_leader_and_cache_expiry(redis_server):
+    assert coordination.is_leader('parked-drainer', 15)
+    assert not coordination.backend().acquire('leader:parked-drainer', 'other-dyno', 15)
+    coordination.remember('token:sciener', {'access_token': 'a'}, 60)
+    assert coordination.cached('token:sciener') == {'access_token': 'a'}
+    redis_server.now += 61
+    assert coordination.cached('token:sciener') is None
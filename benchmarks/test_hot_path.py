@@ -0,0 +1,120 @@
+# CPU-bound parts of a booking with upstream calls stubbed out.
+#
+#   python -m pytest benchmarks --benchmark-autosave --benchmark-storage=benchmarks/results
+#   python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:15% \
+#       --benchmark-storage=benchmarks/results
+#
+# Saved runs are keyed by commit, so each change can be compared with the previous one.
+import itertools
+import json
+import pickle
+from datetime import datetime, timezone
+
+import access_plan
+import booking_generator
+import booking_job
+import intake
+import resource_registry
+from booking_job import BookingJob
+
+FROM_TIME = '2024-09-05T06:00:00Z'
+TO_TIME = '2024-09-05T07:00:00Z'
+
+BOOKING = {
+    'ResourceId': 1415109087, 'ResourceName': '6 Pax Meeting Room #4', 'CoworkerId': 1417691430,
+    'CoworkerFullName': 'eg with plan', 'FromTime': FROM_TIME, 'ToTime': TO_TIME, 'Tentative': False,
+    'Online': True, 'CancelIfNotPaid': False, 'CoworkerInvoicePaid': False, 'InvoiceDate': None,
+    'BookingNumber': 165, 'Id': 1433529150,
+}
+
+
+def test_booking_window(benchmark):
+    # parsing the slot, the lead and the message times, bypassing the window cache
+    benchmark(access_plan.window.__wrapped__, FROM_TIME, TO_TIME)
+
+
+def test_resource_doors(benchmark):
+    # the class lookup and door list for every resource, bypassing the door cache
+    registry = resource_registry.current()
+    resource_ids = list(registry.resources) + [1]
+    benchmark(lambda: [access_plan.doors.__wrapped__(registry, resource_id) for resource_id in resource_ids])
+
+
+def test_generate_passcode_payload(benchmark, stub_upstream):
+    benchmark(stub_upstream.generate_passcode, 9000001, access_plan.window(FROM_TIME, TO_TIME), 'eg with plan')
+
+
+def test_send_message_body(benchmark, stub_upstream):
+    plan = access_plan.plan(BookingJob.from_nexudus(BOOKING))
+    benchmark(stub_upstream.send_message, 1417691430, [123456, 234567, 345678], 'eg with plan', plan,
+              '6 Pax Meeting Room #4', 165)
+
+
+def test_find_passcode_scan(benchmark, stub_upstream):
+    # the match is the last entry of a full page, so every entry's timestamps are compared
+    benchmark(stub_upstream.find_passcode, 9000001, access_plan.window('2024-09-05T04:34:00Z', '2024-09-05T05:19:00Z'))
+
+
+def test_handle_request_case2(benchmark, stub_upstream, monkeypatch):
+    lock_ids = {mac: 9000000 + i for i, mac in enumerate(resource_registry.current().door_names)}
+    monkeypatch.setattr(stub_upstream, 'get_lock_id_by_mac', lambda mac: lock_ids.get(mac))
+    # a booking Id no round has seen, or the ledger claim turns every round after the first into a dedupe skip
+    ids = itertools.count(BOOKING['Id'])
+    benchmark.pedantic(stub_upstream.handle_request, rounds=200,
+                       setup=lambda: ((BookingJob.from_nexudus(dict(BOOKING, Id=next(ids))),), {}))
+
+
+def test_plan_booking(benchmark):
+    # the planner alone, caches warm as they are after the first booking of a slot
+    job = BookingJob.from_nexudus(BOOKING)
+    benchmark(access_plan.plan, job)
+
+
+def test_plan_booking_cold(benchmark):
+    job = BookingJob.from_nexudus(BOOKING)
+    benchmark.pedantic(access_plan.plan, args=(job,), setup=access_plan.clear_cache, rounds=2000)
+
+
+def test_booking_webhook_ack(benchmark, web_app, monkeypatch):
+    # what Nexudus waits for: the handler up to the ring append, not the dispatch behind it
+    ring = intake.Ring(16)
+    monkeypatch.setattr(web_app.intake, 'ring', lambda: ring)
+    # whatever the host's cgroup reports, the webhook must be taken for there to be an ack to time
+    monkeypatch.setattr(web_app.memory_guard, 'accepting', lambda: True)
+    body = json.dumps([BOOKING, dict(BOOKING, Id=BOOKING['Id'] + 1)]).encode()
+
+    def ack():
+        with web_app.app.test_request_context('/booking-webhook', method='POST', data=body,
+                                               content_type='application/json'):
+            web_app.booking_webhook()
+        ring.take()
+
+    benchmark(ack)
+
+
+def generated_booking():
+    generator = booking_generator.BookingGenerator(booking_generator.parse_mix('case2=1'), 60, seed=1)
+    return generator.booking(datetime(2024, 9, 5, 5, tzinfo=timezone.utc), BOOKING['ResourceId'],
+                             (BOOKING['CoworkerId'], BOOKING['CoworkerFullName']),
+                             datetime(2024, 9, 5, 6, tzinfo=timezone.utc), 60)
+
+
+def test_pickle_booking_payload(benchmark):
+    # what process mode used to send each booking process: the whole webhook payload
+    booking = generated_booking()
+    benchmark(lambda: pickle.loads(pickle.dumps((booking, None))))
+
+
+def test_pickle_booking_job(benchmark):
+    job = BookingJob.from_nexudus(generated_booking())
+    benchmark(lambda: pickle.loads(pickle.dumps((job, None))))
+
+
+def test_queue_booking_payload(benchmark):
+    booking = generated_booking()
+    benchmark(lambda: json.loads(json.dumps(booking)))
+
+
+def test_queue_booking_job(benchmark):
+    job = BookingJob.from_nexudus(generated_booking())
+    benchmark(lambda: booking_job.load(json.loads(json.dumps(job.astuple()))))
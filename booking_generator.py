@@ -0,0 +1,184 @@
+import argparse
+import heapq
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import resource_registry
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+RESOURCE_CLASSES = {name: sorted(ids) for name, ids in resource_registry.current().classes.items()}
+
+# Fields Nexudus sends with every booking that the generator does not vary
+BOOKING_TEMPLATE = {
+    'ResourceAllocation': 6, 'ResourceHideInCalendar': False, 'ResourceNoReturnPolicy': None,
+    'ResourceNoReturnPolicyAllResources': None, 'ResourceNoReturnPolicyAllUsers': None,
+    'ResourceResourceTypeId': 1415128073, 'ResourceResourceTypeName': 'Meeting Room',
+    'FloorPlanDeskId': None, 'FloorPlanDeskName': None, 'CoworkerCoworkerType': 'Individual',
+    'CoworkerBillingName': None, 'CoworkerCompanyName': None, 'CoworkerTeamNames': None,
+    'ExtraServiceId': None, 'ExtraServiceName': None, 'Notes': None, 'InternalNotes': None,
+    'ChargeNow': False, 'InvoiceNow': False, 'InvoiceThisCoworker': False, 'DoNotUseBookingCredit': False,
+    'PurchaseOrder': None, 'DiscountCode': None, 'Tentative': False, 'Online': True,
+    'TeamsAtTheTimeOfBooking': None, 'TariffAtTheTimeOfBooking': 'Team Member',
+    'RepeatSeriesUniqueId': None, 'RepeatBooking': False, 'Repeats': 0, 'WhichBookingsToUpdate': 0,
+    'RepeatEvery': None, 'RepeatUntil': None, 'RepeatOnMondays': False, 'RepeatOnTuesdays': False,
+    'RepeatOnWednesdays': False, 'RepeatOnThursdays': False, 'RepeatOnFridays': False,
+    'RepeatOnSaturdays': False, 'RepeatOnSundays': False, 'OverridePrice': None, 'Invoiced': False,
+    'InvoiceDate': None, 'CoworkerInvoiceId': None, 'CoworkerInvoiceNumber': None,
+    'CoworkerInvoicePaid': False, 'CoworkerInvoiceVoid': False, 'CoworkerInvoiceCreditNote': False,
+    'CoworkerExtraServiceIds': None, 'CoworkerExtraServicePrice': None,
+    'CoworkerExtraServiceCurrencyCode': None, 'CoworkerExtraServiceChargePeriod': None,
+    'CoworkerExtraServiceTotalUses': None, 'IncludeZoomInvite': False, 'CheckedInAt': None,
+    'CancelIfNotPaid': False, 'CancelIfNotCheckedIn': False, 'MaxOccupancy': None,
+    'LastMinutePriceAdjustment': None, 'DynamicPriceAdjustment': None, 'PriceFactorLastMinute': None,
+    'PriceFactorDemand': None, 'OverrideResourceLimits': False, 'DisableConfirmation': False,
+    'SkipGoogleCalendarUpdate': False, 'EstimatedCost': 20.0, 'EstimatedCostWithProducts': None,
+    'EstimagedCost': 20.0, 'EstimatedProductCost': None, 'ChargedExtraServices': None,
+    'BookingProducts': [], 'BookingVisitors': [], 'EstimatedExtraService': None, 'Invoice': None,
+    'AvailableCredit': 0.0, 'IsEvent': False, 'IsTour': False, 'DiscountAmount': None,
+    'UpdatedBy': 'generator@example.com', 'IsNew': False, 'SystemId': None,
+    'LocalizationDetails': None, 'CustomFields': None,
+}
+
+DURATIONS_MINUTES = (30, 60, 60, 90, 120, 180)
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in RESOURCE_CLASSES:
+            raise ValueError(f'Unknown resource class {name!r}, expected one of {", ".join(RESOURCE_CLASSES)}')
+        mix[name] = float(weight)
+    return mix
+
+
+def iso(dt):
+    return dt.strftime(TIME_FORMAT)
+
+
+def resource_name(resource_id):
+    entry = resource_registry.current().resources.get(resource_id)
+    return entry.get('name', f'Resource {resource_id}') if entry else f'Resource {resource_id}'
+
+
+class BookingGenerator:
+    def __init__(self, mix, rate_per_min, recurring_share=0.1, cancel_share=0.1, duplicate_rate=0.02,
+                 same_day_share=0.4, max_days_ahead=14, seed=None):
+        self.random = random.Random(seed)
+        self.classes = list(mix)
+        self.weights = [mix[name] for name in self.classes]
+        self.rate_per_min = rate_per_min
+        self.recurring_share = recurring_share
+        self.cancel_share = cancel_share
+        self.duplicate_rate = duplicate_rate
+        self.same_day_share = same_day_share
+        self.max_days_ahead = max_days_ahead
+        self.booking_number = 1000
+        self.booking_id = 1500000000
+        self.coworkers = [(1417000000 + i, f'Load Test {i}') for i in range(200)]
+
+    def booking(self, now, resource_id, coworker, from_time, duration, series=None):
+        self.booking_number += 1
+        self.booking_id += 1
+        created = now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        booking = dict(BOOKING_TEMPLATE)
+        booking.update({
+            'ResourceId': resource_id,
+            'ResourceName': resource_name(resource_id),
+            'CoworkerId': coworker[0],
+            'CoworkerFullName': coworker[1],
+            'FromTime': iso(from_time),
+            'ToTime': iso(from_time + timedelta(minutes=duration)),
+            'BookingNumber': self.booking_number,
+            'Id': self.booking_id,
+            'MinutesToStart': int((from_time - now).total_seconds() // 60),
+            'UniqueId': str(uuid.UUID(int=self.random.getrandbits(128))),
+            'CreatedOn': created,
+            'UpdatedOn': created,
+            'ToStringText': f'{resource_name(resource_id)} (#{self.booking_number})',
+        })
+        if series:
+            booking.update({'RepeatSeriesUniqueId': series, 'RepeatBooking': True, 'Repeats': 2, 'RepeatEvery': 1})
+        return booking
+
+    def start_time(self, now):
+        if self.random.random() < self.same_day_share:
+            minutes = self.random.uniform(10, 240)
+        else:
+            minutes = self.random.uniform(240, self.max_days_ahead * 24 * 60)
+        start = now + timedelta(minutes=minutes)
+        # Nexudus slots start on the quarter hour
+        return start.replace(minute=start.minute - start.minute % 15, second=0, microsecond=0) + timedelta(minutes=15)
+
+    def arrivals(self, start):
+        # Webhook events as {'at', 'path', 'payload'}, ordered by 'at' (epoch seconds)
+        pending = []
+        at = start
+        sequence = 0
+        while True:
+            at += self.random.expovariate(self.rate_per_min / 60)
+            while pending and pending[0][0] <= at:
+                yield heapq.heappop(pending)[2]
+            now = datetime.fromtimestamp(at, tz=timezone.utc)
+            resource_class = self.random.choices(self.classes, self.weights)[0]
+            resource_id = self.random.choice(RESOURCE_CLASSES[resource_class])
+            coworker = self.random.choice(self.coworkers)
+            from_time = self.start_time(now)
+            duration = self.random.choice(DURATIONS_MINUTES)
+            if self.random.random() < self.recurring_share:
+                series = str(uuid.UUID(int=self.random.getrandbits(128)))
+                payload = [self.booking(now, resource_id, coworker, from_time + timedelta(weeks=week), duration, series)
+                           for week in range(self.random.randint(2, 8))]
+            else:
+                payload = [self.booking(now, resource_id, coworker, from_time, duration)]
+            event = {'at': at, 'path': '/booking-webhook', 'payload': payload}
+            yield event
+
+            if self.random.random() < self.duplicate_rate:
+                sequence += 1
+                duplicate_at = at + self.random.uniform(0.1, 5)
+                heapq.heappush(pending, (duplicate_at, sequence, dict(event, at=duplicate_at)))
+            for booking in payload:
+                if self.random.random() < self.cancel_share:
+                    sequence += 1
+                    # most cancellations come soon after booking, always before the start
+                    lead = (datetime.strptime(booking['FromTime'], TIME_FORMAT).replace(tzinfo=timezone.utc) - now).total_seconds()
+                    cancel_at = at + min(self.random.expovariate(1 / 1800), max(lead - 60, 1))
+                    heapq.heappush(pending, (cancel_at, sequence, {
+                        'at': cancel_at, 'path': '/booking-cancelled', 'payload': [booking]}))
+            # cancellations scheduled beyond the end of the run are simply never emitted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Emit Nexudus-shaped booking/cancellation webhooks as JSON lines')
+    parser.add_argument('--mix', default='single=0.5,case1=0.2,case2=0.3', help='resource class weights')
+    parser.add_argument('--rate', type=float, default=6.0, help='mean booking webhooks per minute (Poisson)')
+    parser.add_argument('--recurring-share', type=float, default=0.1)
+    parser.add_argument('--cancel-share', type=float, default=0.1)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--same-day-share', type=float, default=0.4, help='bookings starting within 4 hours')
+    parser.add_argument('--count', type=int, default=100, help='events to emit, 0 = unbounded')
+    parser.add_argument('--realtime', action='store_true', help='emit each event at its arrival time')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    generator = BookingGenerator(parse_mix(args.mix), args.rate, args.recurring_share, args.cancel_share,
+                                 args.duplicate_rate, args.same_day_share, seed=args.seed)
+    for n, event in enumerate(generator.arrivals(time.time())):
+        if args.count and n >= args.count:
+            break
+        if args.realtime:
+            delay = event['at'] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sys.stdout.write(json.dumps(event) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# What a booking or cancel job needs from a Nexudus booking, taken once at intake. The webhook
+# payload carries ~80 fields (BookingProducts, LocalizationDetails, ...); the job queue, the ledger
+# and booking processes carry this record instead
+import json
+
+
+class BookingJob:
+    __slots__ = ('booking_id', 'booking_number', 'resource_id', 'resource_name', 'coworker_id', 'coworker_name',
+                 'from_time', 'to_time', 'tentative', 'online', 'cancel_if_not_paid', 'invoice_paid')
+
+    def __init__(self, booking_id, booking_number, resource_id, resource_name, coworker_id, coworker_name,
+                 from_time, to_time, tentative=False, online=False, cancel_if_not_paid=False, invoice_paid=False):
+        self.booking_id = booking_id
+        self.booking_number = booking_number
+        self.resource_id = resource_id
+        self.resource_name = resource_name
+        self.coworker_id = coworker_id
+        self.coworker_name = coworker_name
+        self.from_time = from_time
+        self.to_time = to_time
+        self.tentative = tentative
+        self.online = online
+        self.cancel_if_not_paid = cancel_if_not_paid
+        self.invoice_paid = invoice_paid
+
+    @classmethod
+    def from_nexudus(cls, booking):
+        return cls(booking.get('Id'), booking.get('BookingNumber'), booking.get('ResourceId'),
+                   booking.get('ResourceName'), booking.get('CoworkerId'), booking.get('CoworkerFullName'),
+                   booking.get('FromTime'), booking.get('ToTime'), bool(booking.get('Tentative')),
+                   bool(booking.get('Online')), bool(booking.get('CancelIfNotPaid')),
+                   bool(booking.get('CoworkerInvoicePaid')))
+
+    def astuple(self):
+        # what the job queue and the ledger store, as a JSON array
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __reduce__(self):
+        # pickled to booking processes as the bare tuple
+        return BookingJob, self.astuple()
+
+    def moved(self, resource_id, from_time, to_time):
+        # the same booking in another slot
+        job = BookingJob(*self.astuple())
+        job.resource_id, job.from_time, job.to_time = resource_id, from_time, to_time
+        return job
+
+    def as_nexudus(self):
+        # the webhook payload fields this record came from, for replaying it
+        return {'Id': self.booking_id, 'BookingNumber': self.booking_number, 'ResourceId': self.resource_id,
+                'ResourceName': self.resource_name, 'CoworkerId': self.coworker_id,
+                'CoworkerFullName': self.coworker_name, 'FromTime': self.from_time, 'ToTime': self.to_time,
+                'Tentative': self.tentative, 'Online': self.online, 'CancelIfNotPaid': self.cancel_if_not_paid,
+                'CoworkerInvoicePaid': self.invoice_paid}
+
+    def __str__(self):
+        # as the job queue stores it; the 'received' log events carry this for replay_bench.py
+        return json.dumps(self.astuple())
+
+    def __repr__(self):
+        return (f'BookingJob({self.booking_id}, resource={self.resource_id}, '
+                f'{self.from_time}..{self.to_time})')
+
+
+def load(payload):
+    # From the job queue or the ledger: the stored tuple, or a Nexudus payload (a list of them for a
+    # cancellation) queued before the record existed
+    if isinstance(payload, dict):
+        return BookingJob.from_nexudus(payload)
+    if payload and isinstance(payload[0], dict):
+        return BookingJob.from_nexudus(payload[0])
+    return BookingJob(*payload)
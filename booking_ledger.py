@@ -0,0 +1,230 @@
+import json
+import os
+import time
+
+import booking_job
+import state_db
+
+# What has been provisioned for which booking slot, shared by the webhook processes and the
+# pull job (preprovision.py) so a booking is provisioned once whichever path sees it first
+LEDGER_CLAIM_TIMEOUT = float(os.environ.get('LEDGER_CLAIM_TIMEOUT', '900'))
+LEDGER_RETENTION_DAYS = float(os.environ.get('LEDGER_RETENTION_DAYS', '30'))
+
+PROVISIONING, PROVISIONED, DEFERRED, SUSPENDED = 'provisioning', 'provisioned', 'deferred', 'suspended'
+CANCELLING, CANCELLED = 'cancelling', 'cancelled'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    booking_id INTEGER PRIMARY KEY,
+    resource_id INTEGER,
+    from_time TEXT NOT NULL,
+    to_time TEXT NOT NULL,
+    state TEXT NOT NULL,
+    source TEXT,
+    passcodes TEXT,
+    payload TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_state ON bookings (state, from_time);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _db():
+    return state_db.connect('booking_ledger', SCHEMA)
+
+
+def _same_slot(row, booking):
+    return (row['resource_id'] == booking.resource_id and row['from_time'] == booking.from_time
+            and row['to_time'] == booking.to_time)
+
+
+def get(booking_id):
+    row = _db().execute('SELECT * FROM bookings WHERE booking_id = ?', (booking_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def is_provisioned(booking):
+    row = _db().execute('SELECT * FROM bookings WHERE booking_id = ?', (booking.booking_id,)).fetchone()
+    return row is not None and row['state'] == PROVISIONED and _same_slot(row, booking)
+
+
+def is_cancelled(booking):
+    # A cancellation for this slot has started or finished
+    row = _db().execute('SELECT * FROM bookings WHERE booking_id = ?', (booking.booking_id,)).fetchone()
+    return row is not None and row['state'] in (CANCELLING, CANCELLED) and _same_slot(row, booking)
+
+
+def _put(db, booking, state, source, passcodes=None, payload=None):
+    db.execute('INSERT OR REPLACE INTO bookings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+        booking.booking_id, booking.resource_id, booking.from_time, booking.to_time, state, source,
+        json.dumps(passcodes) if passcodes is not None else None,
+        json.dumps(payload.astuple()) if payload is not None else None, time.time()))
+
+
+def claim(booking, source):
+    # True if the caller should provision this booking now. False when the same slot is already
+    # provisioned, or another process claimed it recently and may still be working on it
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT * FROM bookings WHERE booking_id = ?', (booking.booking_id,)).fetchone()
+        if row is not None and _same_slot(row, booking):
+            if row['state'] == PROVISIONED:
+                db.execute('COMMIT')
+                return False
+            if row['state'] == PROVISIONING and time.time() - row['updated'] < LEDGER_CLAIM_TIMEOUT:
+                db.execute('COMMIT')
+                return False
+        # passcodes already issued for this slot are kept, so a resumed attempt does not issue them twice
+        progress = json.loads(row['passcodes']) if row is not None and _same_slot(row, booking) \
+            and row['state'] in (PROVISIONING, SUSPENDED) and row['passcodes'] else None
+        # the payload lets reconcile.py finish the job if this process dies half-way
+        _put(db, booking, PROVISIONING, source, passcodes=progress, payload=booking)
+        db.execute('COMMIT')
+        return True
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def checkpoint(booking, lock_mac, passcode):
+    # One door done; progress is kept per lock MAC while the booking is being provisioned
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT passcodes FROM bookings WHERE booking_id = ? AND state = ?',
+                         (booking.booking_id, PROVISIONING)).fetchone()
+        if row is not None:
+            progress = json.loads(row['passcodes'] or '{}')
+            progress[lock_mac] = passcode
+            db.execute('UPDATE bookings SET passcodes = ?, updated = ? WHERE booking_id = ?',
+                       (json.dumps(progress), time.time(), booking.booking_id))
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def progress(booking):
+    row = _db().execute('SELECT passcodes FROM bookings WHERE booking_id = ? AND state = ?',
+                        (booking.booking_id, PROVISIONING)).fetchone()
+    return json.loads(row['passcodes']) if row is not None and row['passcodes'] else {}
+
+
+def suspend(booking):
+    # Requeued: keep the doors done so far for the next attempt
+    _db().execute('UPDATE bookings SET state = ?, updated = ? WHERE booking_id = ? AND state = ?',
+                  (SUSPENDED, time.time(), booking.booking_id, PROVISIONING))
+
+
+def reissue(booking, kept):
+    # Some doors lost their passcode: the next claim resumes from the ones still on their locks
+    # and issues only the rest
+    _put(_db(), booking, SUSPENDED, 'reconcile', passcodes=kept, payload=booking)
+
+
+def by_door(passcodes, lock_macs):
+    # A provisioned row records its passcodes in plan order, a claimed or suspended one per lock MAC
+    if isinstance(passcodes, dict):
+        return passcodes
+    return {lock_mac: passcode for lock_mac, passcode in zip(lock_macs, passcodes or []) if passcode is not None}
+
+
+def provisioned(booking, source, passcodes):
+    _put(_db(), booking, PROVISIONED, source, passcodes=passcodes)
+
+
+def release(booking):
+    # Provisioning failed: give up the claim so the next webhook retry or pull run tries again. Doors that
+    # already got a passcode stay recorded as a suspended row, so that attempt does not issue them twice
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('UPDATE bookings SET state = ?, updated = ? '
+                   'WHERE booking_id = ? AND state = ? AND passcodes IS NOT NULL',
+                   (SUSPENDED, time.time(), booking.booking_id, PROVISIONING))
+        db.execute('DELETE FROM bookings WHERE booking_id = ? AND state = ?', (booking.booking_id, PROVISIONING))
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def forget(booking):
+    _db().execute('DELETE FROM bookings WHERE booking_id = ?', (booking.booking_id,))
+
+
+def defer(booking, source):
+    # True if the booking is now left to the pull job or the delayed queue. A booking that is claimed,
+    # suspended with doors done, provisioned or being cancelled keeps its row and is not deferred
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT state FROM bookings WHERE booking_id = ?', (booking.booking_id,)).fetchone()
+        if row is not None and row['state'] not in (DEFERRED, CANCELLED):
+            db.execute('COMMIT')
+            return False
+        _put(db, booking, DEFERRED, source, payload=booking)
+        db.execute('COMMIT')
+        return True
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def cancelling(booking):
+    # Returns the passcodes recorded for this slot, which the cancellation deletes; a retried cancellation
+    # still has them
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT * FROM bookings WHERE booking_id = ?', (booking.booking_id,)).fetchone()
+        recorded = json.loads(row['passcodes']) if row is not None and _same_slot(row, booking) \
+            and row['passcodes'] else None
+        _put(db, booking, CANCELLING, 'webhook', passcodes=recorded, payload=booking)
+        db.execute('COMMIT')
+        return recorded
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def cancelled(booking):
+    _db().execute('UPDATE bookings SET state = ?, payload = NULL, updated = ? WHERE booking_id = ?',
+                  (CANCELLED, time.time(), booking.booking_id))
+
+
+def stuck(older_than=None):
+    # Claims and cancellations whose process died before finishing, oldest first
+    cutoff = time.time() - (LEDGER_CLAIM_TIMEOUT if older_than is None else older_than)
+    rows = _db().execute('SELECT * FROM bookings WHERE state IN (?, ?) AND updated < ? ORDER BY updated',
+                         (PROVISIONING, CANCELLING, cutoff))
+    return [dict(row, payload=booking_job.load(json.loads(row['payload']))) for row in rows if row['payload']]
+
+
+def watermark(name):
+    row = _db().execute('SELECT value FROM watermarks WHERE name = ?', (name,)).fetchone()
+    return row['value'] if row else None
+
+
+def set_watermark(name, value):
+    _db().execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?)', (name, value))
+
+
+def deferred():
+    rows = _db().execute('SELECT payload FROM bookings WHERE state = ? ORDER BY from_time', (DEFERRED,))
+    return [booking_job.load(json.loads(row['payload'])) for row in rows]
+
+
+def prune(now=None):
+    # Bookings that ended more than LEDGER_RETENTION_DAYS ago
+    cutoff = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime((now or time.time()) - LEDGER_RETENTION_DAYS * 86400))
+    return _db().execute('DELETE FROM bookings WHERE to_time < ?', (cutoff,)).rowcount
+
+
+def counts():
+    return {row['state']: row['n'] for row in _db().execute('SELECT state, COUNT(*) AS n FROM bookings GROUP BY state')}
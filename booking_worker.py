@@ -0,0 +1,67 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import access_plan
+import booking_ledger
+import job_queue
+import lock_index
+import pipeline
+import resource_registry
+import structured_logging
+import upstream_http
+from structured_logging import log_event
+
+# Entry point for processes that only run bookings: booking processes (forked from a server that
+# imported just this module, see execution.py) and the pull, reconcile and sync jobs. Loads the
+# clients and the pipeline, never Flask or the web app
+structured_logging.configure()
+
+# Seconds the warm-up may spend fetching tokens that no other worker has cached yet
+WARM_UP_DEADLINE = float(os.environ.get('WARM_UP_DEADLINE', '10'))
+
+logger = logging.getLogger(__name__)
+
+
+def door_macs(registry):
+    macs = set(registry.resource_to_lock.values())
+    for doors in registry.main_doors.values():
+        macs.update(doors)
+    return macs
+
+
+def warm_up():
+    # What the first booking after a restart would otherwise load on its critical path: the routing
+    # table, the lock index, both tokens, the state databases and the tz data for the access plans
+    started = time.monotonic()
+    registry = resource_registry.load()
+    macs = door_macs(registry)
+    indexed = sum(1 for mac in macs if lock_index.lookup(mac))
+    booking_ledger.counts()
+    job_queue.counts()
+    access_plan.window('2024-09-05T06:00:00Z', '2024-09-05T07:00:00Z')
+    tokens = False
+    try:
+        # from the coordination backend, or fetched once for every worker when none is cached
+        with upstream_http.deadline(WARM_UP_DEADLINE):
+            pipeline.get_access_token()
+            pipeline.get_nexudus_access_token()
+        tokens = True
+    except Exception as e:
+        logger.warning(f"Warm-up left the tokens to the first booking: {e}")
+    latency_ms = round((time.monotonic() - started) * 1000)
+    log_event(logger, 'warm_up', "Warmed up: %d/%d doors in the lock index, tokens %s", indexed, len(macs),
+              'ready' if tokens else 'not ready', latency_ms=latency_ms)
+    return {'doors': len(macs), 'indexed': indexed, 'tokens': tokens, 'latency_ms': latency_ms}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load what a booking process needs and report how long it took')
+    parser.parse_args(argv)
+    print(json.dumps(warm_up(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
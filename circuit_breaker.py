@@ -0,0 +1,114 @@
+import os
+import time
+
+import state_db
+
+# Breaker state is shared by every booking process on the dyno, so one process's failures
+# stop the others from queueing up behind a dead upstream
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', '30'))
+# A half-open trial call that has not reported back after this long is presumed lost
+BREAKER_PROBE_TIMEOUT = float(os.environ.get('BREAKER_PROBE_TIMEOUT', '60'))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS breakers (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    opened_at REAL NOT NULL DEFAULT 0,
+    probe_at REAL NOT NULL DEFAULT 0,
+    trips INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _db():
+    return state_db.connect('circuit_breaker', SCHEMA)
+
+
+def allow(name):
+    # False while open; after BREAKER_RESET_TIMEOUT lets a single trial call through (half-open)
+    db = _db()
+    row = db.execute('SELECT * FROM breakers WHERE name = ?', (name,)).fetchone()
+    if row is None or row['state'] == CLOSED:
+        return True
+    now = time.time()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT * FROM breakers WHERE name = ?', (name,)).fetchone()
+        if row['state'] == CLOSED:
+            allowed = True
+        elif row['state'] == OPEN and now - row['opened_at'] >= BREAKER_RESET_TIMEOUT:
+            db.execute('UPDATE breakers SET state = ?, probe_at = ? WHERE name = ?', (HALF_OPEN, now, name))
+            allowed = True
+        elif row['state'] == HALF_OPEN and now - row['probe_at'] >= BREAKER_PROBE_TIMEOUT:
+            db.execute('UPDATE breakers SET probe_at = ? WHERE name = ?', (now, name))
+            allowed = True
+        else:
+            allowed = False
+        db.execute('COMMIT')
+        return allowed
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def success(name):
+    db = _db()
+    row = db.execute('SELECT state, failures FROM breakers WHERE name = ?', (name,)).fetchone()
+    if row is not None and (row['state'] != CLOSED or row['failures']):
+        db.execute('UPDATE breakers SET state = ?, failures = 0 WHERE name = ?', (CLOSED, name))
+
+
+def failure(name):
+    # Returns True when this failure opened the breaker
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT * FROM breakers WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            db.execute('INSERT INTO breakers (name, state) VALUES (?, ?)', (name, CLOSED))
+            row = {'state': CLOSED, 'failures': 0}
+        failures = row['failures'] + 1
+        trip = row['state'] == HALF_OPEN or (row['state'] == CLOSED and failures >= BREAKER_FAILURE_THRESHOLD)
+        if trip:
+            db.execute('UPDATE breakers SET state = ?, failures = ?, opened_at = ?, trips = trips + 1 WHERE name = ?',
+                       (OPEN, failures, now, name))
+        else:
+            db.execute('UPDATE breakers SET failures = ? WHERE name = ?', (failures, name))
+        db.execute('COMMIT')
+        return trip
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def ready(name):
+    # Whether a call would be let through now, without taking the half-open trial slot
+    row = _db().execute('SELECT * FROM breakers WHERE name = ?', (name,)).fetchone()
+    if row is None or row['state'] == CLOSED:
+        return CLOSED
+    now = time.time()
+    if row['state'] == OPEN and now - row['opened_at'] >= BREAKER_RESET_TIMEOUT:
+        return HALF_OPEN
+    if row['state'] == HALF_OPEN and now - row['probe_at'] >= BREAKER_PROBE_TIMEOUT:
+        return HALF_OPEN
+    return None
+
+
+def all_states():
+    now = time.time()
+    return {row['name']: {'state': row['state'], 'failures': row['failures'], 'trips': row['trips'],
+                          'retry_in': max(round(row['opened_at'] + BREAKER_RESET_TIMEOUT - now, 1), 0)
+                          if row['state'] == OPEN else 0}
+            for row in _db().execute('SELECT * FROM breakers ORDER BY name')}
+
+
+def reset(name=None):
+    if name:
+        _db().execute('DELETE FROM breakers WHERE name = ?', (name,))
+    else:
+        _db().execute('DELETE FROM breakers')
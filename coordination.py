@@ -0,0 +1,220 @@
+import contextlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import state_db
+
+# Leases, locks and a shared cache for everything that must happen once across processes:
+# one booking process per booking, one command per gateway, one token refresh, one leader.
+#   memory  in-process only (a single worker, tests)
+#   sqlite  every process on the host (the default; one dyno)
+#   redis   every process on every dyno, COORDINATION_URL or REDIS_URL
+COORDINATION_BACKEND = os.environ.get('COORDINATION_BACKEND', 'sqlite')
+COORDINATION_URL = os.environ.get('COORDINATION_URL') or os.environ.get('REDIS_URL')
+COORDINATION_PREFIX = os.environ.get('COORDINATION_PREFIX', 'tthotel:')
+# How often a waiting caller looks at a held lock again
+COORDINATION_POLL_INTERVAL = float(os.environ.get('COORDINATION_POLL_INTERVAL', '0.1'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class LockBusy(Exception):
+    def __init__(self, name):
+        super().__init__(f'{name} is held by another worker')
+        self.name = name
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.leases = {}
+        self.values = {}
+
+    def acquire(self, name, owner, ttl):
+        # Takes the lease, or renews it for its current owner
+        now = time.time()
+        with self.mutex:
+            held = self.leases.get(name)
+            if held and held[0] != owner and held[1] > now:
+                return False
+            self.leases[name] = (owner, now + ttl)
+            return True
+
+    def release(self, name, owner):
+        with self.mutex:
+            if self.leases.get(name, (None,))[0] == owner:
+                del self.leases[name]
+
+    def get(self, key):
+        with self.mutex:
+            value, expires = self.values.get(key, (None, 0))
+            return value if expires > time.time() else None
+
+    def set(self, key, value, ttl):
+        with self.mutex:
+            self.values[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self.mutex:
+            self.values.pop(key, None)
+
+    def holders(self):
+        now = time.time()
+        with self.mutex:
+            return {name: owner for name, (owner, expires) in self.leases.items() if expires > now}
+
+
+class SqliteBackend:
+    def _db(self):
+        return state_db.connect('coordination', SCHEMA)
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        cursor = self._db().execute(
+            'INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, '
+            'expires = excluded.expires WHERE leases.owner = excluded.owner OR leases.expires <= ?',
+            (name, owner, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def release(self, name, owner):
+        self._db().execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def get(self, key):
+        row = self._db().execute('SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def set(self, key, value, ttl):
+        self._db().execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, json.dumps(value), time.time() + ttl))
+
+    def delete(self, key):
+        self._db().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def holders(self):
+        rows = self._db().execute('SELECT name, owner FROM leases WHERE expires > ?', (time.time(),))
+        return {row['name']: row['owner'] for row in rows}
+
+
+class RedisBackend:
+    # Owner checks run server-side so a lease that expired and moved on is never released by its old owner
+    RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def acquire(self, name, owner, ttl):
+        key = f'{COORDINATION_PREFIX}lease:{name}'
+        ms = max(int(ttl * 1000), 1)
+        if self.client.set(key, owner, nx=True, px=ms):
+            return True
+        return bool(self.client.eval(self.RENEW, 1, key, owner, ms))
+
+    def release(self, name, owner):
+        self.client.eval(self.RELEASE, 1, f'{COORDINATION_PREFIX}lease:{name}', owner)
+
+    def get(self, key):
+        value = self.client.get(f'{COORDINATION_PREFIX}cache:{key}')
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(f'{COORDINATION_PREFIX}cache:{key}', json.dumps(value), px=max(int(ttl * 1000), 1))
+
+    def delete(self, key):
+        self.client.delete(f'{COORDINATION_PREFIX}cache:{key}')
+
+    def holders(self):
+        prefix = f'{COORDINATION_PREFIX}lease:'
+        return {key[len(prefix):]: self.client.get(key) for key in self.client.scan_iter(f'{prefix}*')}
+
+
+_backends = {}
+
+
+def backend():
+    # One per process; a forked child opens its own connection
+    pid = os.getpid()
+    if pid not in _backends:
+        if COORDINATION_BACKEND == 'memory':
+            _backends[pid] = MemoryBackend()
+        elif COORDINATION_BACKEND == 'sqlite':
+            _backends[pid] = SqliteBackend()
+        elif COORDINATION_BACKEND == 'redis':
+            if not COORDINATION_URL:
+                raise RuntimeError('COORDINATION_BACKEND=redis needs COORDINATION_URL or REDIS_URL')
+            _backends[pid] = RedisBackend(COORDINATION_URL)
+        else:
+            raise ValueError(f'Unknown COORDINATION_BACKEND: {COORDINATION_BACKEND}')
+    return _backends[pid]
+
+
+def process_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+@contextlib.contextmanager
+def lock(name, ttl, wait=0, sleep=time.sleep):
+    # Held for the block or ttl seconds, whichever ends first; ttl must outlast the work it guards.
+    # Raises LockBusy when it cannot be had within wait; sleep may give up earlier by raising
+    owner = f'{process_owner()}:{uuid.uuid4().hex[:8]}'
+    gives_up = time.monotonic() + wait
+    while not backend().acquire(name, owner, ttl):
+        if time.monotonic() >= gives_up:
+            raise LockBusy(name)
+        sleep(COORDINATION_POLL_INTERVAL * random.uniform(0.5, 1.5))
+    try:
+        yield
+    finally:
+        backend().release(name, owner)
+
+
+def is_leader(role, ttl):
+    # True while this process holds the role; call again well within ttl to keep it
+    return backend().acquire(f'leader:{role}', process_owner(), ttl)
+
+
+def cached(key):
+    return backend().get(key)
+
+
+def remember(key, value, ttl):
+    backend().set(key, value, ttl)
+
+
+def forget(key):
+    backend().delete(key)
+
+
+def single_flight(key, compute, wait, sleep=time.sleep):
+    # Shared value, computed by one worker at a time; compute() returns (value, ttl).
+    # Everyone else waits for the lock and then finds the fresh value in the cache
+    value = backend().get(key)
+    if value is not None:
+        return value
+    with lock(f'refresh:{key}', ttl=wait, wait=wait, sleep=sleep):
+        value = backend().get(key)
+        if value is None:
+            value, ttl = compute()
+            if ttl > 0:
+                backend().set(key, value, ttl)
+    return value
+
+
+def status():
+    return {'backend': COORDINATION_BACKEND, 'owner': process_owner(), 'leases': backend().holders()}
@@ -0,0 +1,125 @@
+import contextvars
+import multiprocessing as mp
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import upstream_http
+
+# Where booking and cancel jobs run.
+#   process  a forked process per job (sync gunicorn workers)
+#   thread   a bounded pool inside the web worker; under gevent the pool's threads are greenlets and
+#            requests, sockets and sleeps are cooperative, so one small worker holds many upstream calls
+# Unset, the mode follows the worker: thread when gevent has patched the process, process otherwise
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE')
+# Jobs running at once in thread mode; the rest wait in the pool's queue
+EXECUTION_MAX_JOBS = int(os.environ.get('EXECUTION_MAX_JOBS', '100'))
+# How process mode starts booking processes. forkserver forks them from a small server that imported
+# only booking_worker.py, so they carry neither Flask nor the web worker's threads, locks and intake
+# ring; fork copies the whole web worker
+EXECUTION_START_METHOD = os.environ.get('EXECUTION_START_METHOD', 'forkserver')
+# Seconds jobs in flight get after SIGTERM to finish or hand themselves back; Heroku kills at 30
+SHUTDOWN_GRACE = float(os.environ.get('SHUTDOWN_GRACE', '20'))
+
+PROCESS, THREAD = 'process', 'thread'
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pending = {'jobs': 0}
+
+
+def cooperative():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def mode():
+    # Decided per call, not at import: gunicorn patches a gevent worker after forking it
+    if EXECUTION_MODE:
+        return EXECUTION_MODE
+    return THREAD if cooperative() else PROCESS
+
+
+def _pool():
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools[pid] = ThreadPoolExecutor(max_workers=EXECUTION_MAX_JOBS, thread_name_prefix='job')
+        return _pools[pid]
+
+
+def _context():
+    context = mp.get_context(EXECUTION_START_METHOD)
+    if EXECUTION_START_METHOD == 'forkserver':
+        context.set_forkserver_preload(['booking_worker'])
+    return context
+
+
+def prestart():
+    # At web worker boot, so the first booking does not wait for the forkserver to import the pipeline
+    if mode() == PROCESS and EXECUTION_START_METHOD == 'forkserver':
+        from multiprocessing import forkserver
+        _context()
+        forkserver.ensure_running()
+
+
+def _on_sigterm(signum, frame):
+    upstream_http.begin_shutdown(SHUTDOWN_GRACE)
+
+
+def _in_process(target, args):
+    # Already loaded when the forkserver preloaded it; its preload is skipped silently when the
+    # server starts outside the app directory
+    import booking_worker  # noqa: F401
+    # Heroku signals every process on the dyno; a booking process winds down instead of dying mid-chain
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    target(*args)
+
+
+def submit(target, args, logger):
+    if mode() == PROCESS:
+        _context().Process(target=_in_process, args=(target, args)).start()
+        return
+
+    def run():
+        try:
+            # a fresh context per job, as a forked process would have; tracing state arrives in args
+            contextvars.Context().run(target, *args)
+        except Exception:
+            logger.exception("Job %s failed", target.__name__)
+        finally:
+            with _pools_lock:
+                _pending['jobs'] -= 1
+
+    with _pools_lock:
+        _pending['jobs'] += 1
+    _pool().submit(run)
+
+
+def pending():
+    # booking processes still running, or jobs queued and running in this worker's pool
+    if mode() == PROCESS:
+        return len(mp.active_children())
+    return _pending['jobs']
+
+
+def drain(timeout):
+    # Waits for this worker's jobs to finish or park; returns how many are still running.
+    # Booking processes are told too, in case only this worker is stopping and not the dyno
+    if mode() == PROCESS:
+        for child in mp.active_children():
+            os.kill(child.pid, signal.SIGTERM)
+    ends = time.monotonic() + timeout
+    while pending() and time.monotonic() < ends:
+        time.sleep(0.1)
+    return pending()
+
+
+def status():
+    return {'mode': mode(), 'start_method': EXECUTION_START_METHOD, 'cooperative': cooperative(),
+            'max_jobs': EXECUTION_MAX_JOBS, 'pending': pending()}
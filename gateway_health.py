@@ -0,0 +1,131 @@
+import os
+import time
+
+import state_db
+
+# Rolling statistics decay with this half-life, so they follow current gateway load
+HEALTH_HALF_LIFE = float(os.environ.get('GATEWAY_HEALTH_HALF_LIFE', '300'))
+HEALTH_MIN_SAMPLES = float(os.environ.get('GATEWAY_HEALTH_MIN_SAMPLES', '3'))
+SATURATED_BUSY_RATE = float(os.environ.get('GATEWAY_SATURATED_BUSY_RATE', '0.5'))
+HEALTHY_SUCCESS_RATE = float(os.environ.get('GATEWAY_HEALTHY_SUCCESS_RATE', '0.9'))
+MAX_HOLD_OFF = float(os.environ.get('GATEWAY_MAX_HOLD_OFF', '60'))
+
+OK, BUSY, ERROR = 'ok', 'busy', 'error'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gateway_stats (
+    lock_id INTEGER PRIMARY KEY,
+    updated REAL NOT NULL,
+    attempts REAL NOT NULL DEFAULT 0,
+    successes REAL NOT NULL DEFAULT 0,
+    busy REAL NOT NULL DEFAULT 0,
+    errors REAL NOT NULL DEFAULT 0,
+    latency_ms REAL,
+    busy_until REAL NOT NULL DEFAULT 0,
+    total_attempts INTEGER NOT NULL DEFAULT 0,
+    total_busy INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _db():
+    return state_db.connect('gateway_health', SCHEMA)
+
+
+def _decay(now, updated):
+    return 0.5 ** (max(now - updated, 0) / HEALTH_HALF_LIFE)
+
+
+def record(lock_id, outcome, latency_ms=None, backoff=0):
+    # outcome is OK, BUSY or ERROR; backoff is how long the caller will wait after a busy reply
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute('SELECT * FROM gateway_stats WHERE lock_id = ?', (lock_id,)).fetchone()
+        if row is None:
+            row = {'updated': now, 'attempts': 0, 'successes': 0, 'busy': 0, 'errors': 0, 'latency_ms': None,
+                   'busy_until': 0, 'total_attempts': 0, 'total_busy': 0}
+        factor = _decay(now, row['updated'])
+        latency = row['latency_ms']
+        if latency_ms is not None:
+            latency = latency_ms if latency is None else latency + 0.2 * (latency_ms - latency)
+        busy_until = max(row['busy_until'], now + backoff) if outcome == BUSY else row['busy_until']
+        if outcome == OK:
+            busy_until = 0
+        db.execute('INSERT OR REPLACE INTO gateway_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            lock_id, now,
+            row['attempts'] * factor + 1,
+            row['successes'] * factor + (outcome == OK),
+            row['busy'] * factor + (outcome == BUSY),
+            row['errors'] * factor + (outcome == ERROR),
+            latency, busy_until,
+            row['total_attempts'] + 1,
+            row['total_busy'] + (outcome == BUSY),
+        ))
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+
+def _summary(row, now):
+    factor = _decay(now, row['updated'])
+    attempts = row['attempts'] * factor
+    return {
+        'lock_id': row['lock_id'],
+        'samples': round(attempts, 2),
+        'success_rate': round(row['successes'] * factor / attempts, 3) if attempts else None,
+        'busy_rate': round(row['busy'] * factor / attempts, 3) if attempts else None,
+        'error_rate': round(row['errors'] * factor / attempts, 3) if attempts else None,
+        'latency_ms': round(row['latency_ms']) if row['latency_ms'] is not None else None,
+        'busy_for_s': round(max(row['busy_until'] - now, 0), 1),
+        'total_attempts': row['total_attempts'],
+        'total_busy': row['total_busy'],
+        'state': _state(attempts, row['successes'] * factor, row['busy'] * factor),
+    }
+
+
+def _state(attempts, successes, busy):
+    if round(attempts) < HEALTH_MIN_SAMPLES:
+        return 'unknown'
+    if busy / attempts >= SATURATED_BUSY_RATE:
+        return 'saturated'
+    if successes / attempts >= HEALTHY_SUCCESS_RATE:
+        return 'healthy'
+    return 'degraded'
+
+
+def stats(lock_id):
+    row = _db().execute('SELECT * FROM gateway_stats WHERE lock_id = ?', (lock_id,)).fetchone()
+    if row is None:
+        return None
+    return _summary(row, time.time())
+
+
+def all_stats():
+    now = time.time()
+    return [_summary(row, now) for row in _db().execute('SELECT * FROM gateway_stats ORDER BY lock_id')]
+
+
+def state(lock_id):
+    summary = stats(lock_id)
+    return summary['state'] if summary else 'unknown'
+
+
+def retry_policy(lock_id, max_retries, retry_delay):
+    # Returns (attempts, first delay, backoff multiplier) for a passcode add on this gateway
+    current = state(lock_id)
+    if current == 'saturated':
+        return max(2, max_retries - 2), retry_delay * 2, 3
+    if current == 'healthy':
+        return max_retries + 2, max(1, retry_delay / 5), 2
+    return max_retries, retry_delay, 2
+
+
+def hold_off(lock_id):
+    # Seconds to wait before touching a gateway another booking has just found busy
+    summary = stats(lock_id)
+    if summary is None:
+        return 0
+    return min(summary['busy_for_s'], MAX_HOLD_OFF)
@@ -0,0 +1,40 @@
+import os
+import sys
+
+# Picked up from the working directory by `gunicorn main:app` (gunicorn >= 20).
+# With gevent installed each worker is one small process holding many webhooks and booking jobs as
+# greenlets (see execution.py); without it gunicorn falls back to sync workers that fork per job.
+try:
+    import gevent  # noqa: F401
+    _default_worker_class = 'gevent'
+except ImportError:
+    _default_worker_class = 'sync'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', _default_worker_class)
+# Open connections per gevent worker; booking jobs are capped separately by EXECUTION_MAX_JOBS
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '200'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+# Heroku sends SIGKILL 30 s after SIGTERM
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '25'))
+# The app is imported in each worker after gevent has patched it, never in the master
+preload_app = False
+
+
+def _service(worker):
+    # the app module, whatever name the start command imported it under
+    return sys.modules[worker.wsgi.import_name]
+
+
+def post_worker_init(worker):
+    # caches warm before the first webhook; work parked by the last shutdown resumes without waiting for one
+    service = _service(worker)
+    service.warm_up()
+    service.start_background()
+
+
+def worker_exit(server, worker):
+    # in-flight bookings finish or checkpoint and park within SHUTDOWN_GRACE, see shutdown()
+    if getattr(worker, 'wsgi', None) is not None:
+        _service(worker).shutdown()
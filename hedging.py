@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import state_db
+
+# Hedged GETs: when an idempotent read has not answered by the endpoint's recent
+# HEDGE_PERCENTILE latency, a second identical request is sent and the first answer wins.
+# Off unless the endpoint is listed in UPSTREAM_HEDGE_ENDPOINTS
+HEDGE_ENDPOINTS = frozenset(e for e in os.environ.get('UPSTREAM_HEDGE_ENDPOINTS', '').split(',') if e)
+HEDGE_PERCENTILE = float(os.environ.get('UPSTREAM_HEDGE_PERCENTILE', '0.95'))
+HEDGE_MIN_DELAY = float(os.environ.get('UPSTREAM_HEDGE_MIN_DELAY', '0.05'))
+# Share of recent calls allowed to hedge; one hedge per call at most, so load never doubles
+HEDGE_MAX_SHARE = float(os.environ.get('UPSTREAM_HEDGE_MAX_SHARE', '0.1'))
+HEDGE_WINDOW = int(os.environ.get('UPSTREAM_HEDGE_WINDOW', '500'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('UPSTREAM_HEDGE_MIN_SAMPLES', '50'))
+HEDGE_CACHE_SECONDS = float(os.environ.get('UPSTREAM_HEDGE_CACHE_SECONDS', '10'))
+
+# primary_ms is what the call would have taken unhedged (the first request always runs to the
+# end), effective_ms what the caller waited; comparing the two shows what hedging buys
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    endpoint TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    at REAL NOT NULL,
+    primary_ms REAL,
+    effective_ms REAL NOT NULL,
+    hedged INTEGER NOT NULL,
+    hedge_won INTEGER NOT NULL,
+    PRIMARY KEY (endpoint, slot)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    endpoint TEXT PRIMARY KEY,
+    calls INTEGER NOT NULL
+);
+"""
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _db():
+    return state_db.connect('hedging', SCHEMA)
+
+
+def enabled(method, endpoint):
+    return method == 'GET' and endpoint in HEDGE_ENDPOINTS
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+
+def _window(endpoint):
+    rows = _db().execute('SELECT primary_ms, effective_ms, hedged, hedge_won FROM samples WHERE endpoint = ?',
+                         (endpoint,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def policy(endpoint):
+    # (hedge delay in seconds or None, hedge allowed); cached briefly, the window moves slowly
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(endpoint)
+        if cached and now - cached[0] < HEDGE_CACHE_SECONDS:
+            return cached[1]
+    window = _window(endpoint)
+    primaries = [s['primary_ms'] for s in window if s['primary_ms'] is not None]
+    delay = None
+    if len(primaries) >= HEDGE_MIN_SAMPLES:
+        delay = max(percentile(primaries, HEDGE_PERCENTILE) / 1000, HEDGE_MIN_DELAY)
+    allowed = not window or sum(s['hedged'] for s in window) / len(window) < HEDGE_MAX_SHARE
+    with _cache_lock:
+        _cache[endpoint] = (now, (delay, allowed))
+    return delay, allowed
+
+
+def record(endpoint, primary_ms, effective_ms, hedged, hedge_won):
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('INSERT INTO counters VALUES (?, 1) ON CONFLICT(endpoint) DO UPDATE SET calls = calls + 1',
+                   (endpoint,))
+        calls = db.execute('SELECT calls FROM counters WHERE endpoint = ?', (endpoint,)).fetchone()['calls']
+        db.execute('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (endpoint, calls % HEDGE_WINDOW, time.time(), primary_ms, effective_ms, int(hedged), int(hedge_won)))
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    if hedged:
+        # count our own hedge at once, other processes catch up when their cache expires
+        with _cache_lock:
+            _cache.pop(endpoint, None)
+
+
+def request(endpoint, method, url, may_hedge=None, **kwargs):
+    # requests.request() with at most one hedge; both requests are identical idempotent GETs.
+    # may_hedge() is asked at the moment of hedging, so a rate-limited upstream can refuse it
+    delay, allowed = policy(endpoint)
+    results = queue.Queue()
+    started = time.monotonic()
+    lock = threading.Lock()
+    outcome = {'primary_ms': None, 'effective_ms': None, 'hedge_won': False}
+
+    def attempt(n):
+        try:
+            response, error = requests.request(method, url, **kwargs), None
+        except requests.RequestException as e:
+            response, error = None, e
+        elapsed = (time.monotonic() - started) * 1000
+        results.put((n, response, error, elapsed))
+        if n == 0:
+            with lock:
+                outcome['primary_ms'] = elapsed
+                late = outcome['hedge_won']
+            if late:
+                # the caller has moved on; the primary's time still feeds the percentile and the metrics
+                record(endpoint, elapsed, outcome['effective_ms'], True, True)
+
+    threading.Thread(target=attempt, args=(0,), daemon=True).start()
+    hedged = False
+    try:
+        first = results.get(timeout=delay) if delay is not None and allowed else results.get()
+    except queue.Empty:
+        if may_hedge is None or may_hedge():
+            hedged = True
+            threading.Thread(target=attempt, args=(1,), daemon=True).start()
+        first = results.get()
+        if hedged and first[2] is not None:
+            # a failed answer only counts if the other request fails too
+            first = results.get()
+
+    n, response, error, elapsed = first
+    with lock:
+        outcome.update(effective_ms=elapsed, hedge_won=n == 1)
+        primary_ms = outcome['primary_ms']
+    if n == 0 or primary_ms is not None:
+        record(endpoint, primary_ms, elapsed, hedged, n == 1)
+    if error is not None:
+        raise error
+    return response
+
+
+def stats():
+    out = {}
+    for endpoint in sorted({row['endpoint'] for row in _db().execute('SELECT DISTINCT endpoint FROM samples')}):
+        window = _window(endpoint)
+        primaries = [s['primary_ms'] for s in window if s['primary_ms'] is not None]
+        effective = [s['effective_ms'] for s in window]
+        hedged = sum(s['hedged'] for s in window)
+        p99_primary, p99_effective = percentile(primaries, 0.99), percentile(effective, 0.99)
+        delay = policy(endpoint)[0]
+        out[endpoint] = {
+            'samples': len(window),
+            'hedge_rate': round(hedged / len(window), 3),
+            'hedge_win_rate': round(sum(s['hedge_won'] for s in window) / hedged, 3) if hedged else None,
+            'unhedged_ms': {f'p{int(p * 100)}': round(percentile(primaries, p), 1) if primaries else None
+                            for p in (0.5, 0.95, 0.99)},
+            'effective_ms': {f'p{int(p * 100)}': round(percentile(effective, p), 1) for p in (0.5, 0.95, 0.99)},
+            'p99_saved_ms': round(p99_primary - p99_effective, 1) if p99_primary is not None else None,
+            'hedge_delay_ms': round(delay * 1000, 1) if delay else None,
+        }
+    return out
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+# Webhooks are acknowledged once their raw body is in this ring; a consumer thread in the same
+# worker parses and dispatches them, so the ack never waits for a fork or for queued work
+INTAKE_RING_SIZE = int(os.environ.get('INTAKE_RING_SIZE', '4096'))
+
+
+class Ring:
+    # Fixed-capacity FIFO; slots are allocated once and reused
+    def __init__(self, capacity):
+        self.slots = [None] * capacity
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.dropped = 0
+        self.taken = 0
+        self.ready = threading.Condition(threading.Lock())
+
+    def put(self, item):
+        # False when full; the caller decides where the item goes instead
+        with self.ready:
+            if self.size == self.capacity:
+                self.dropped += 1
+                return False
+            self.slots[(self.head + self.size) % self.capacity] = item
+            self.size += 1
+            self.ready.notify()
+            return True
+
+    def take(self):
+        with self.ready:
+            while not self.size:
+                self.ready.wait()
+            item, self.slots[self.head] = self.slots[self.head], None
+            self.head = (self.head + 1) % self.capacity
+            self.size -= 1
+            self.taken += 1
+            return item
+
+    def drain(self):
+        # Everything still waiting, without blocking
+        with self.ready:
+            items = [self.slots[(self.head + i) % self.capacity] for i in range(self.size)]
+            self.slots = [None] * self.capacity
+            self.head = self.size = 0
+            return items
+
+
+_rings = {}
+_rings_lock = threading.Lock()
+
+
+def ring():
+    # One per web worker; a ring inherited through fork belongs to the parent
+    pid = os.getpid()
+    if pid not in _rings:
+        with _rings_lock:
+            if pid not in _rings:
+                _rings[pid] = Ring(INTAKE_RING_SIZE)
+    return _rings[pid]
+
+
+def accept(kind, body, request_id):
+    return ring().put((kind, body, request_id, time.monotonic()))
+
+
+def take():
+    # (kind, body, request_id, seconds spent in the ring)
+    kind, body, request_id, queued_at = ring().take()
+    return kind, body, request_id, time.monotonic() - queued_at
+
+
+def drain():
+    # [(kind, body, request_id, queued_at)]
+    return ring().drain()
+
+
+def status():
+    current = ring()
+    return {'capacity': current.capacity, 'depth': current.size, 'taken': current.taken,
+            'overflowed': current.dropped}
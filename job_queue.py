@@ -0,0 +1,75 @@
+import json
+import os
+import time
+
+import state_db
+
+# Durable work the web worker hands back to its booking processes later, e.g. bookings parked
+# while an upstream circuit is open
+JOB_CLAIM_TIMEOUT = float(os.environ.get('JOB_CLAIM_TIMEOUT', '300'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    reason TEXT,
+    not_before REAL NOT NULL,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (not_before);
+"""
+
+
+def _db():
+    return state_db.connect('job_queue', SCHEMA)
+
+
+def put(kind, payload, reason=None, delay=0):
+    now = time.time()
+    cursor = _db().execute('INSERT INTO jobs (kind, payload, reason, not_before, created) VALUES (?, ?, ?, ?, ?)',
+                           (kind, json.dumps(payload), reason, now + delay, now))
+    return cursor.lastrowid
+
+
+def claim(reason=None, limit=10):
+    # Due jobs, oldest first; a claimed job comes back if it is neither done nor released in time
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        query = 'SELECT * FROM jobs WHERE not_before <= ? AND claimed_until <= ?'
+        args = [now, now]
+        if reason is not None:
+            query += ' AND reason IS ?'
+            args.append(reason)
+        rows = db.execute(query + ' ORDER BY not_before, id LIMIT ?', args + [limit]).fetchall()
+        db.executemany('UPDATE jobs SET claimed_until = ?, attempts = attempts + 1 WHERE id = ?',
+                       [(now + JOB_CLAIM_TIMEOUT, row['id']) for row in rows])
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+    return [dict(row, payload=json.loads(row['payload'])) for row in rows]
+
+
+def done(job_id):
+    _db().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+def release(job_id, delay=0):
+    _db().execute('UPDATE jobs SET claimed_until = 0, not_before = ? WHERE id = ?', (time.time() + delay, job_id))
+
+
+def waiting_reasons():
+    # Reasons with at least one due, unclaimed job
+    now = time.time()
+    return [row['reason'] for row in _db().execute(
+        'SELECT DISTINCT reason FROM jobs WHERE not_before <= ? AND claimed_until <= ?', (now, now))]
+
+
+def counts():
+    return {row['reason'] or '': {'jobs': row['n'], 'oldest_s': round(time.time() - row['oldest'], 1)}
+            for row in _db().execute('SELECT reason, COUNT(*) AS n, MIN(created) AS oldest FROM jobs GROUP BY reason')}
@@ -0,0 +1,52 @@
+import time
+
+import state_db
+
+# Sciener lock MAC -> lockId, persisted so a booking process never pages through lock/list
+# for a lock the service has already seen
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locks (
+    lock_mac TEXT PRIMARY KEY,
+    lock_id INTEGER NOT NULL,
+    alias TEXT,
+    seen REAL NOT NULL
+);
+"""
+
+
+def _db():
+    return state_db.connect('lock_index', SCHEMA)
+
+
+def lookup(lock_mac):
+    row = _db().execute('SELECT lock_id FROM locks WHERE lock_mac = ?', (lock_mac,)).fetchone()
+    return row['lock_id'] if row else None
+
+
+def store(locks):
+    # locks as returned by v3/lock/list
+    now = time.time()
+    _db().executemany('INSERT OR REPLACE INTO locks VALUES (?, ?, ?, ?)',
+                      [(lock['lockMac'], lock['lockId'], lock.get('lockAlias'), now)
+                       for lock in locks if lock.get('lockMac') and lock.get('lockId')])
+
+
+def replace_all(locks):
+    # A full lock/list scan: drop locks that were removed or re-paired under a new lockId
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('DELETE FROM locks')
+        store(locks)
+        db.execute('COMMIT')
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def forget(lock_mac):
+    _db().execute('DELETE FROM locks WHERE lock_mac = ?', (lock_mac,))
+
+
+def entries():
+    return [dict(row) for row in _db().execute('SELECT * FROM locks ORDER BY lock_mac')]
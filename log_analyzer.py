@@ -0,0 +1,242 @@
+import argparse
+import bisect
+import json
+import re
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+# Heroku drain line: "<ts> <source>[<dyno>]: <message>"
+LINE_RE = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?[+-]\d\d:\d\d) ([\w.-]+)\[([^\]]+)\]: ?(.*)')
+ROUTER_FIELD_RE = re.compile(r'(\w+)=("[^"]*"|\S+)')
+LOCK_ID_RE = re.compile(r"'lockId': (\d+)")
+ERRCODE_RE = re.compile(r"'errcode': (-?\d+)")
+RETRY_RE = re.compile(r'Retry due to error code (-?\d+)')
+
+BOOKING_PATHS = ('/booking-webhook',)
+# Unmatched webhooks older than this are dropped so memory stays bounded
+OPEN_BOOKING_TTL = 3600
+MAX_OPEN_BOOKINGS = 1000
+
+
+class LatencyHistogram:
+    # Fixed log-spaced buckets (1 ms .. ~1 h) so percentiles cost constant memory
+    BOUNDS = [round(1.25 ** i, 3) for i in range(70)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value_ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, value_ms)] += 1
+        self.count += 1
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.BOUNDS[i] if i < len(self.BOUNDS) else self.max, self.max)
+        return self.max
+
+
+class Bucket:
+    __slots__ = ('attempts', 'successes', 'busy', 'errcode_1', 'retries', 'router_errors', 'latency')
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.busy = 0
+        self.errcode_1 = 0
+        self.retries = 0
+        self.router_errors = {}
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'busy_rate': round(self.busy / self.attempts, 3) if self.attempts else None,
+            'errcode_1_rate': round(self.errcode_1 / self.attempts, 3) if self.attempts else None,
+            'retries': self.retries,
+            'router_errors': dict(self.router_errors),
+            'provisioned': self.latency.count,
+            'latency_p50_ms': self.latency.percentile(0.5),
+            'latency_p95_ms': self.latency.percentile(0.95),
+            'latency_max_ms': self.latency.max if self.latency.count else None,
+        }
+
+
+class OpenBooking:
+    __slots__ = ('started', 'hour', 'locks')
+
+    def __init__(self, started, hour):
+        self.started = started
+        self.hour = hour
+        self.locks = []
+
+
+class Analyzer:
+    def __init__(self):
+        self.buckets = {}
+        # request_id -> OpenBooking, oldest first
+        self.open = OrderedDict()
+        self.unmatched = 0
+
+    def bucket(self, hour, lock):
+        key = (hour, lock)
+        if key not in self.buckets:
+            self.buckets[key] = Bucket()
+        return self.buckets[key]
+
+    def feed(self, line):
+        match = LINE_RE.search(line.rstrip('\n').rstrip('\\'))
+        if not match:
+            return
+        ts_text, source, dyno, message = match.groups()
+        ts = datetime.fromisoformat(ts_text).timestamp()
+        hour = ts_text[:13]
+        message = message.replace('\\{', '{').replace('\\}', '}')
+        if source == 'heroku' and dyno == 'router':
+            self.on_router(ts, hour, message)
+        elif source == 'app':
+            if message.startswith('{'):
+                self.on_json(ts, hour, message)
+            else:
+                self.on_text(ts, hour, message)
+
+    def expire(self, now):
+        while self.open:
+            request_id, booking = next(iter(self.open.items()))
+            if now - booking.started < OPEN_BOOKING_TTL and len(self.open) <= MAX_OPEN_BOOKINGS:
+                break
+            self.open.popitem(last=False)
+            self.unmatched += 1
+
+    def on_router(self, ts, hour, message):
+        fields = {k: v.strip('"') for k, v in ROUTER_FIELD_RE.findall(message)}
+        code = fields.get('code')
+        if code in ('H12', 'H15'):
+            errors = self.bucket(hour, '-').router_errors
+            errors[code] = errors.get(code, 0) + 1
+        if fields.get('path') in BOOKING_PATHS and fields.get('at') == 'info':
+            self.open[fields.get('request_id')] = OpenBooking(ts, hour)
+        self.expire(ts)
+
+    def booking_for(self, request_id=None):
+        if request_id is not None:
+            return self.open.get(request_id)
+        if not self.open:
+            return None
+        return next(reversed(self.open.values()))
+
+    def record_attempt(self, booking, hour, lock, errcode):
+        bucket = self.bucket(booking.hour if booking else hour, lock)
+        bucket.attempts += 1
+        if errcode in (None, 0):
+            bucket.successes += 1
+        elif errcode == -3003:
+            bucket.busy += 1
+        elif errcode == 1:
+            bucket.errcode_1 += 1
+        if booking is not None and lock not in booking.locks:
+            booking.locks.append(lock)
+
+    def record_retry(self, booking, hour, lock):
+        self.bucket(booking.hour if booking else hour, lock).retries += 1
+
+    def complete(self, request_id, booking, ts):
+        if booking is None:
+            return
+        latency_ms = (ts - booking.started) * 1000
+        for lock in booking.locks or ['-']:
+            self.bucket(booking.hour, lock).latency.add(latency_ms)
+        self.open.pop(request_id, None)
+
+    def on_text(self, ts, hour, message):
+        # Legacy plain-text lines carry no request id: attempts are attributed to the
+        # newest open webhook, completions close the oldest one
+        if 'generate_passcode response:' in message:
+            lock = LOCK_ID_RE.search(message)
+            errcode = ERRCODE_RE.search(message.split(' for data:')[0])
+            self.record_attempt(self.booking_for(), hour, int(lock.group(1)) if lock else '-',
+                                int(errcode.group(1)) if errcode else None)
+        elif RETRY_RE.search(message):
+            booking = self.booking_for()
+            lock = booking.locks[-1] if booking and booking.locks else '-'
+            self.record_retry(booking, hour, lock)
+        elif 'Successfully added coworker message' in message and self.open:
+            request_id = next(iter(self.open))
+            self.complete(request_id, self.open[request_id], ts)
+
+    def on_json(self, ts, hour, message):
+        try:
+            record = json.loads(message)
+        except ValueError:
+            return
+        stage = record.get('stage')
+        request_id = record.get('request_id')
+        booking = self.booking_for(request_id) if request_id else None
+        if stage == 'passcode_add':
+            self.record_attempt(booking, hour, record.get('lock', '-'), record.get('errcode'))
+        elif stage == 'passcode_retry':
+            self.record_retry(booking, hour, record.get('lock', '-'))
+        elif stage == 'provisioned':
+            self.complete(request_id, booking, ts)
+
+    def report(self):
+        return [dict(hour=hour, lock=lock, **bucket.to_dict())
+                for (hour, lock), bucket in sorted(self.buckets.items(), key=lambda item: (item[0][0], str(item[0][1])))]
+
+
+def fmt(value, spec):
+    if value is None:
+        return format('-', spec.split('.')[0])
+    return format(value, spec)
+
+
+def print_table(rows, out):
+    header = f"{'hour':13} {'lock':>10} {'att':>5} {'ok':>5} {'-3003':>6} {'err1':>6} {'retry':>5} " \
+             f"{'prov':>5} {'p50ms':>8} {'p95ms':>8} {'maxms':>8} router"
+    print(header, file=out)
+    for row in rows:
+        router = ','.join(f'{k}={v}' for k, v in row['router_errors'].items()) or '-'
+        print(f"{row['hour']:13} {str(row['lock']):>10} {row['attempts']:>5} {row['successes']:>5} "
+              f"{fmt(row['busy_rate'], '>6.3f')} {fmt(row['errcode_1_rate'], '>6.3f')} {row['retries']:>5} "
+              f"{row['provisioned']:>5} {fmt(row['latency_p50_ms'], '>8.0f')} {fmt(row['latency_p95_ms'], '>8.0f')} "
+              f"{fmt(row['latency_max_ms'], '>8.0f')} {router}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-lock, per-hour integration metrics from Heroku log dumps')
+    parser.add_argument('paths', nargs='*', default=['-'], help="log files, '-' for stdin")
+    parser.add_argument('--json', action='store_true', help='emit JSON lines instead of a table')
+    args = parser.parse_args(argv)
+
+    analyzer = Analyzer()
+    for path in args.paths:
+        f = sys.stdin if path == '-' else open(path, errors='replace')
+        try:
+            for line in f:
+                analyzer.feed(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    rows = analyzer.report()
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print_table(rows, sys.stdout)
+        if analyzer.open or analyzer.unmatched:
+            print(f'\n{len(analyzer.open) + analyzer.unmatched} webhook(s) without a provisioning completion', file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
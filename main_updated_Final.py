@@ -1,629 +1,242 @@
 from flask import Flask, request, jsonify
 import requests
-import os, pathlib
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+import os
 import time
-import pytz
-import random
 import uuid, logging
-import multiprocessing as mp
-
-app_path = pathlib.Path(os.path.abspath(__file__)).parent
-load_dotenv(app_path / '.env')
-logging.basicConfig(level=logging.INFO)
+import json
+import threading
+import admission
+import booking_job
+import booking_ledger
+import booking_worker
+import circuit_breaker
+import coordination
+import execution
+import gateway_health
+import hedging
+import intake
+import job_queue
+import lock_index
+import memory_guard
+import nexudus_sync
+import pipeline
+import rate_limiter
+import resource_registry
+import structured_logging
+import tracing
+import upstream_http
+from booking_job import BookingJob
+from structured_logging import log_event
+
+structured_logging.configure()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 
-# note: main doors do not have a resouce associated with them
-resource_to_lock_mapping = {
-    1414843560:	"EC:75:5D:81:64:FF", # Fidiou 8pax
-    1415117567:	"B1:48:81:51:79:B5", # Fidiou 6pax L
-    1415117471:	"FA:37:8F:4B:3C:81", # Fidiou 6pax R
-    1414925968:	"D7:2C:71:36:9C:C5", # Fidiou 3pax
-    1414944050:	"54:6C:1D:21:CE:CE", # Fidiou Podcast Room
-    1414957789: "D6:DB:F1:2E:24:54", # Fidiou Sleeping Pod
-    1415105546: "34:C5:61:01:94:AE", # Patmou Meditation
-    1415083399: "34:C5:61:01:94:AE", # Patmou Massage Chair
-    1415083298:	"67:6C:FF:02:84:82", # Patmou Podcast
-    1415083300:	"92:E8:46:4D:50:12", # Patmou Collaboration Room
-    1415079490:	"F9:73:37:A9:E1:E5", # Patmou MR3
-    1415109087:	"96:3A:98:2D:24:18", # Patmou MR4
-    1415109088:	"A0:FD:E4:9F:9A:14", # Patmou MR5
-    1415083396:	"FE:74:91:79:FB:F2", # Patmou Board Room
- #   1415108987: "0D:A9:BA:99:28:F6", # Test lock 6pax
- #   1415111440: "16:D7:E6:DD:23:34", # Test lock 8pax
-
-}
-
-my_session = {'modified': None, 'nexudus_modified': False, 'access_token': '', 'refresh_token': ''}
-
-
-class Config:
-    CLIENT_ID = os.environ.get('CLIENT_ID')
-    CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
-    USERNAME = os.environ.get('SCIENER_USERNAME')
-    PASSWORD = os.environ.get('SCIENER_PASSWORD')
-    PASSCODE_LENGTH = os.environ.get('PASSCODE_LENGTH')
-    NEXUDUS_USERNAME = os.environ.get('NEXUDUS_USERNAME')
-    NEXUDUS_PASSWORD = os.environ.get('NEXUDUS_PASSWORD')
-    NEXUDUS_CUSTOM_FIELD_NAME = os.environ.get('NEXUDUS_CUSTOM_FIELD_NAME')
-
-
-app.config.from_object(Config)
+# Booking, cancellation and the upstream clients live in pipeline.py; this module is the web side:
+# webhook intake, dispatch, parked-job draining and the admin endpoints
 
-base_url = "https://euapi.sciener.com/"
 
+class Config(pipeline.Config):
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    PARKED_POLL_INTERVAL = float(os.environ.get('PARKED_POLL_INTERVAL', '5'))
+    PARKED_BATCH_SIZE = int(os.environ.get('PARKED_BATCH_SIZE', '5'))
 
-def get_access_token():
-    if 'expires_at' in my_session and my_session['expires_at'].replace(tzinfo=pytz.utc) > datetime.now(tz=pytz.utc):
-        return my_session['access_token']
-    elif my_session['modified']:
-        return refresh_token()
-    else:
-        return get_token()
 
+app.config.from_object(Config)
+pipeline.config = app.config
 
-def get_token():
-    url = f'{base_url}oauth2/token'
-    data = {
-        'clientId': app.config['CLIENT_ID'],
-        'clientSecret': app.config['CLIENT_SECRET'],
-        'username': app.config['USERNAME'],
-        'password': app.config['PASSWORD'],
-    }
 
-    response = requests.post(url, data=data)
-    token_data = response.json()
+def drain_parked():
+    # Runs in each web worker; hands parked work back to booking processes once its breaker allows.
+    # A half-open breaker gets one job as its trial call, a closed one gets a batch
+    while True:
+        time.sleep(app.config['PARKED_POLL_INTERVAL'])
+        if upstream_http.shutting_down():
+            return
+        try:
+            # one drainer for all workers sharing the coordination backend; the lease lapses if it dies
+            if not coordination.is_leader('parked-drainer', app.config['PARKED_POLL_INTERVAL'] * 3):
+                continue
+            for breaker in job_queue.waiting_reasons():
+                # an endpoint breaker is only worth probing once its upstream-wide breaker allows calls too
+                readiness = [circuit_breaker.ready(name) for name in {breaker, breaker.partition(':')[0]}]
+                if None in readiness:
+                    continue
+                limit = 1 if circuit_breaker.HALF_OPEN in readiness else app.config['PARKED_BATCH_SIZE']
+                for job in job_queue.claim(breaker, limit):
+                    trace_token = tracing.start_trace(f"parked-{job['id']}")
+                    try:
+                        handler = pipeline.PARKED_HANDLERS[job['kind']]
+                        data = booking_job.load(job['payload'])
+                        # only admission deferrals are re-admitted; work parked behind a breaker already had its turn
+                        if job['reason'] != 'admission' or admitted(handler, data):
+                            dispatch(handler, data)
+                    finally:
+                        tracing.end_trace(trace_token)
+                    # the booking process parks it again if the upstream is still down
+                    job_queue.done(job['id'])
+        except Exception as e:
+            app.logger.error(f"Draining parked jobs failed: {e}")
 
-    app.logger.info(f"token_data: {token_data}")
 
-    if 'access_token' in token_data:
-        my_session['access_token'] = token_data['access_token']
-        my_session['refresh_token'] = token_data['refresh_token']
-        my_session['expires_at'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
-        my_session['uid'] = token_data['uid']
+def warm_up():
+    # At worker boot (gunicorn.conf.py), before the first webhook
+    execution.prestart()
+    booking_worker.warm_up()
 
-    return token_data['access_token']
 
+_background_pid = None
 
-def refresh_token():
-    url = f'{base_url}oauth2/token'
 
-    data = {
-        'clientId': app.config['CLIENT_ID'],
-        'clientSecret': app.config['CLIENT_SECRET'],
-        'grant_type': 'refresh_token',
-        'refresh_token': my_session.get('refresh_token')
-    }
+def start_background():
+    # The intake consumer and the parked-job drainer, once per web worker after gunicorn forks it.
+    # gunicorn.conf.py calls this at worker boot, so work parked by the last shutdown resumes at once
+    global _background_pid
+    if _background_pid != os.getpid():
+        _background_pid = os.getpid()
+        threading.Thread(target=consume_intake, name='intake-consumer', daemon=True).start()
+        threading.Thread(target=drain_parked, name='parked-drainer', daemon=True).start()
 
-    response = requests.post(url, data=data)
-    token_data = response.json()
 
-    if 'access_token' in token_data:
-        my_session['access_token'] = token_data['access_token']
-        my_session['expires_at'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
-        my_session['modified'] = True
+@app.before_request
+def start_background_threads():
+    # for servers without the gunicorn hook (flask run)
+    start_background()
 
-    return my_session['access_token']
 
+def shutdown(grace=None):
+    # Called as the worker exits (gunicorn.conf.py). Nothing new starts; webhooks still in the intake
+    # ring go to the job queue; jobs in flight get grace seconds to finish, and otherwise hand
+    # themselves back at their next upstream call or wait with the doors done so far checkpointed
+    grace = execution.SHUTDOWN_GRACE if grace is None else grace
+    upstream_http.begin_shutdown(grace)
+    handed_back = sum(queue_jobs(kind, body, 'shutdown') for kind, body, rid, queued_at in intake.drain())
+    still_running = execution.drain(grace + 2)
+    log_event(app.logger, 'shutdown', "Shutdown: %d queued jobs handed back, %d jobs still running",
+              handed_back, still_running, level=logging.WARNING)
+    return still_running
 
-def get_lock_id_by_mac(lock_mac):
-    if not lock_mac:
-        return None
 
-    page_no = 1
-    found_lock = None
+def incoming_request_id():
+    # Heroku's router request_id, so router lines and app lines share one id
+    return request.headers.get('X-Request-Id') or str(uuid.uuid4())
 
-    url = f'{base_url}v3/lock/list'
 
-    while True:
-        params = {
-            'clientId': app.config['CLIENT_ID'],
-            'accessToken': get_access_token(),
-            'pageNo': page_no,
-            'pageSize': 20,
-            'date': int(time.time() * 1000)
-        }
-        response = requests.get(url, params=params)
-        response_data = response.json()
-
-        # Check each lock in the current page
-        if 'list' not in response_data or not response_data['list']:
-            app.logger.warning(f"No locks found on page {page_no}")
-            break
-
-        for lock in response_data['list']:
-            app.logger.info(f"Checking lock: {lock}")
-            if lock.get('lockMac') == lock_mac:
-                found_lock = lock
-                break
-
-        if found_lock:
-            app.logger.info(f"Found lock with lock_mac: {lock_mac}, lock_id: {found_lock['lockId']}")
-            break
-
-        page_no += 1
-
-    if found_lock:
-        return found_lock['lockId']
-    else:
-        app.logger.warning(f"Can't get lockId, lockMac address is probably wrong: {lock_mac}")
+def over_memory_budget():
+    if memory_guard.accepting():
         return None
+    app.logger.warning("Rejecting webhook, dyno memory above high watermark: %s", memory_guard.status())
+    return jsonify({'error': 'Busy, retry later'}), 503, {'Retry-After': '60'}
 
 
-def list_passcodes(lock_id, page_no):
-    url = f"{base_url}v3/lock/listKeyboardPwd"
-    params = {
-        'clientId': app.config['CLIENT_ID'],
-        'accessToken': get_access_token(),
-        'lockId': lock_id,
-        'date': int(time.time() * 1000),
-        'pageNo': page_no,
-        'pageSize': 20  # Adjust pageSize according to expected number of passcodes
-    }
-    response = requests.get(url, params=params)
-    response_data = response.json()
-
-    return response_data
-
-
-def delete_passcode(lock_id, keyboard_pwd_id):
-    current_time = int(time.time() * 1000)
-
-    # API request to delete a passcode
-    url = f"{base_url}v3/keyboardPwd/delete"
-    data = {
-        'clientId': app.config['CLIENT_ID'],
-        'accessToken': get_access_token(),
-        'lockId': lock_id,
-        'keyboardPwdId': keyboard_pwd_id,
-        'deleteType': 2,  # Assuming deletion via Wi-Fi or gateway
-        'date': current_time
-    }
-    response = requests.post(url, data=data)
-    if response.status_code == 200:
+def admitted(handler, data):
+    # Under load a booking that is not about to start goes to the delayed queue instead of a worker;
+    # cancellations always run
+    if handler is not pipeline.handle_request:
         return True
-    else:
-        return False
-
-def generate_passcode(lock_id, start_date, end_date, coworker_name, max_retries=5, retry_delay=10):
-    if not lock_id or not start_date or not end_date:
-        app.logger.warning(f"Missing parameters for passcode generation: lock_id={lock_id}, start_date={start_date}, end_date={end_date}")
-        return None
-    attempt = 1
-    current_retry_delay = retry_delay
-    while attempt <= max_retries:
-        
-        try:
-            passcode = random.randint(100000, 999999)
-            url = f'{base_url}v3/keyboardPwd/add'
-             # Convert start_date and end_date to datetime objects if they are not already
-            if isinstance(start_date, str):
-                selected_date_time = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
-            else:
-                selected_date_time = start_date
-
-            start_date = selected_date_time - timedelta(minutes=15)
-
-            if isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
-            else:
-                end_date = end_date
-
-            reservation_date = datetime.now(tz=pytz.utc)
-            app.logger.info(f"Selected datetime: {selected_date_time}, adjusted start_date: {start_date}, end_date: {end_date}")
-            data = {
-                'clientId': app.config['CLIENT_ID'],
-                'accessToken': get_access_token(),
-                'lockId': lock_id,
-                'keyboardPwd': passcode,
-                'keyboardPwdName': coworker_name,
-                'startDate': round(start_date.timestamp() * 1000),
-                'endDate': round(end_date.timestamp() * 1000),
-                'addType': 2,
-                'date': round(reservation_date.timestamp() * 1000),
-            }
-            app.logger.info(f"Data payload for passcode generation: {data}")
-            response = requests.post(url, data=data)
-            response_data = response.json()
-            app.logger.info(f"generate_passcode response: {response_data} for data: {data}")
-            if 'keyboardPwdId' in response_data:
-                return passcode
-            #elif response_data.get('errmsg') == 'The gateway is busy. Please try again later.':
-            elif response_data.get('errcode') in [-3003, 1]:
-                app.logger.warning(f"Retry due to error code {response_data.get('errcode')}, Attempt {attempt}/{max_retries}. Retrying in {current_retry_delay} seconds...")
-                time.sleep(current_retry_delay)
-                current_retry_delay *= 2
-                attempt += 1
-            else:
-                app.logger.warning(f"Failed generating passcode: {response_data}. Start date: {start_date}, End date: {end_date}, Reservation date: {reservation_date}")
-                return None
-        except requests.RequestException as e:
-            # Handle network-related exceptions
-            app.logger.error(f"Network exception during passcode generation: {e}")
-            time.sleep(current_retry_delay)
-            current_retry_delay *= 2
-            attempt += 1    
-        except Exception as e:
-            app.logger.error(f"Exception during passcode generation: {e}")
-            return None
-    app.logger.error(f"Failed to generate passcode after {max_retries} attempts due to gateway being busy.")
-    return None
-
-# Define the mapping of MAC addresses to door names
-door_names = {
-    "EC:75:5D:81:64:FF": "Fidiou 8pax",
-    "B1:48:81:51:79:B5": "Fidiou 6pax L",
-    "FA:37:8F:4B:3C:81": "Fidiou 6pax R",
-    "D7:2C:71:36:9C:C5": "Fidiou 3pax",
-    "54:6C:1D:21:CE:CE": "Fidiou Podcast Room",
-    "D6:DB:F1:2E:24:54": "Fidiou Sleeping Pod",
-    "FD:64:42:39:E5:54": "Fidiou Wellness Entrance",
-    "67:6C:FF:02:84:82": "Patmou Podcast",
-    "92:E8:46:4D:50:12": "Patmou BreakRoom",
-    "F9:73:37:A9:E1:E5": "Patmou MR3",
-    "96:3A:98:2D:24:18": "Patmou MR4",
-    "A0:FD:E4:9F:9A:14": "Patmou MR5",
-    "FE:74:91:79:FB:F2": "Patmou 12pax",
-    "E0:61:DA:79:64:45": "Patmou Staircase Access",
-    "EE:4F:8C:5A:BE:97": "Patmou Lower Ground Floor Entrance",
-#
-# The following two are in the same space, hence the same MAC address for the lock
-#
-    "34:C5:61:01:94:AE": "Patmou Meditation Room",
-    "34:C5:61:01:94:AE": "Patmou Massage Room",
-#
-# Test locks
-#    "0D:A9:BA:99:28:F6": "6 pax secondary", #test secondary 6pax
-#    "16:D7:E6:DD:23:34": "8 pax secondary", #test secondary 8pax
-#    "C2:DA:2B:DC:32:7D": "Main Door 1", # Main Door 1
-#    "C6:4A:85:44:B0:A8": "Main Door 2", # Main Door 2
-    
-    
-}
-
-
-def send_message(coworker_id, passcodes, coworker_name, lock_macs, from_time, to_time, resource_name, booking_number):
-    # from_time_eet = datetime.strptime(from_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc).astimezone(
-    #     pytz.timezone('Europe/Helsinki')).strftime("%Y-%m-%d %H:%M:%S")
-    # to_time_eet = datetime.strptime(to_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc).astimezone(
-    #     pytz.timezone('Europe/Helsinki')).strftime("%Y-%m-%d %H:%M:%S")
-
-    # # Format the passcode information with door names instead of MAC addresses
-    # passcode_info = '\n'.join([f'{door_names.get(lock_macs[i], "Unknown Door")}: {passcodes[i]}' for i in range(len(passcodes))])
-    from_time_dt = datetime.strptime(from_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
-    to_time_dt = datetime.strptime(to_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
-    
-    # Add 15 minutes to the from_time
-    from_time_dt_adjusted = from_time_dt - timedelta(minutes=15)
-
-    # Convert both times to EET timezone
-    from_time_eet = from_time_dt_adjusted.astimezone(pytz.timezone('Europe/Helsinki')).strftime("%Y-%m-%d %H:%M:%S")
-    to_time_eet = to_time_dt.astimezone(pytz.timezone('Europe/Helsinki')).strftime("%Y-%m-%d %H:%M:%S")
-
-    # Format the passcode information with door names instead of MAC addresses
-    #passcode_info = ' \n'.join([f'{door_names.get(lock_macs[i], "Unknown Door")}: {passcodes[i]}' for i in range(len(passcodes) - 1, -1, -1)])
-    # added a hashtag after passcode
-    passcode_info = ' \n '.join([f'{door_names.get(lock_macs[i], "Unknown Door")}: {passcodes[i]} #' for i in range(len(passcodes) - 1, -1, -1)])
-
-    url = f'https://spaces.nexudus.com/api/spaces/coworkermessages'
-
-    data = {
-        'CoworkerId': coworker_id,
-        'Subject': f'Passcode for your Booking for {resource_name} - #{booking_number}',
-        'Body': (f'<!DOCTYPE html>'
-                 f'<html>'
-                 f'<head>'
-                 f'<style>'
-                 f'body {{ font-family: Arial, sans-serif; }}'
-                 f'p {{ margin: 0; padding: 5px 0; }}'
-                 f'.passcode-info {{ font-weight: bold; white-space: pre-line; }}'
-                 f'</style>'
-                 f'</head>'
-                 f'<body>'
-                 f'<p>Hello {coworker_name},</p>'
-                 f'<p>Here are your access passcodes:</p>'
-                 f'<p class="passcode-info">{passcode_info} </p>'
-                 f'<p>Valid From: {from_time_eet}</p>'
-                 f'<p>Valid To: {to_time_eet}</p>'
-                 f'<p>Thank you,</p>'
-                 f'<p>Your ViOS Team</p>'
-                 f'<p><img src="https://cdn.shopify.com/s/files/1/0526/4670/7372/files/passcode-unlock_480x480.gif?v=1642520983" alt="Your GIF"></p>'
-                 f'</body>'
-                 f'</html>')
-    }
-
-    headers = {
-        'Authorization': 'Bearer ' + get_nexudus_access_token()
-    }
-
-    response = requests.post(url, headers=headers, data=data)
-    message_data = response.json()
-
-    if response.status_code == 200:
+    try:
+        decision = admission.check(data)
+    except (KeyError, ValueError) as e:
+        app.logger.warning(f"Admission check skipped: {e}")
         return True
-
-    app.logger.warning(f'Failed adding coworker message to {coworker_name}')
+    if decision is None:
+        return True
+    reason, delay = decision
+    # a booking the ledger already holds (claimed, part-issued or provisioned) runs now: its claim dedupes or
+    # resumes it, where deferring would drop that progress
+    if not booking_ledger.defer(data, 'admission'):
+        return True
+    job_queue.put('provision', data.astuple(), reason='admission', delay=delay)
+    log_event(app.logger, 'deferred', "Booking deferred %.0fs under load (%s)", delay, reason,
+              level=logging.WARNING, booking_id=data.booking_id, reason=reason)
     return False
 
-# Define specific door IDs
-single_passcode_door_ids = [
-    1414843560,  # Fidiou 8pax
-    1415117567,  # Fidiou 6pax L
-    1415117471, # Fidiou 6pax R
-    1414925968, # Fidiou 3pax
-    1414837599, # Fidiou 10 pax roof top
-#    1415108987, # Test 6pax
-#    1415111440, # Test 8pax 
-]
-
-secondary_door_passcodes_ids_case1 = [ 1414944050, # Fidiou Podcast Room
-                                       1414957789, # Fidiou Sleeping Pod
-				    # The above are the only cases of secondary doors with one main door to pass
-                                    #   1415108987, # Test1 6pax
-                                    #   1415111440, # Test2 8pax
-                                       
-                                      ]
-
-# the assumption is that the following may be made available to non-residents, hence passcode to two main doors
-secondary_door_passcodes_ids_case2 = [ 1415083298, # Patmou Podcast
-                                      1415083300, # Patmou Collaboration Room
-                                      1415079490, # Patmou MR3
-                                      1415109087, # Patmou MR4
-                                      1415109088, # Patmou MR5
-                                      1415083396, # Patmou Board Room
-                                      1415105546, # Patmou Meditation
-                                      1415083399, # Patmou Massage Chair
-                                     # 1415108987, # Test 6 pax resource as secondary
-                                     # 1415111440, # Test 8pax resource as secondary
-                                    
-                                      ]
-
-def handle_request(data):
-    resource_id = data['ResourceId']
-    app.logger.info(f"test Requested Resource id {resource_id}")
-     
-    from_time = data['FromTime']
-    app.logger.info(f"from_time data: {from_time}")
-    to_time = data['ToTime']
-    coworker_name = data['CoworkerFullName']
-
-    if resource_id is None:
-        app.logger.warning("ResourceId missing")
-        return jsonify({'error': 'ResourceId missing'}), 400
-
-    contacts_booking = data['CancelIfNotPaid']
-    tentative = data['Tentative']
-    online = data['Online']
-
-    app.logger.info(f"handle_request data: {data}")
-
-    if tentative:
-        app.logger.warning("Generating passcode is cancelled because the booking is not yet confirmed.")
-        return
-
-    if contacts_booking:
-        invoice_paid = data['CoworkerInvoicePaid']
-        if not invoice_paid and online:
-            app.logger.warning("Generating passcode is cancelled because the booking from contacts is not yet paid.")
-            return
-        if not invoice_paid and data['InvoiceDate'] is None:
-            invoice_paid = True
-
-    lock_mac = resource_to_lock_mapping.get(resource_id)                                           
-    lock_id = get_lock_id_by_mac(lock_mac)
-
-
-    if not lock_id:
-        app.logger.warning("No lock id")
-        return
-
-    passcodes = []
-    lock_macs = []
-
-    # Check if the resource ID is in the list of specific door IDs
-    if resource_id in single_passcode_door_ids:
-        # Generate a single passcode for the specific door
-        app.logger.info(f"Single Resource id {resource_id}")
-        
-        single_passcode = generate_passcode(lock_id, from_time, to_time, coworker_name)
-        app.logger.info(f"Generated single passcode for specific door: {single_passcode}")
-        passcodes.append(single_passcode)
-        lock_macs.append(lock_mac)
-    elif resource_id in secondary_door_passcodes_ids_case1:
-            app.logger.info(f"Requested Secondary door Resource id {resource_id}")
-            requested_door_passcode = generate_passcode(lock_id, from_time, to_time, coworker_name)
-            app.logger.info(f"Generated passcode for requested secondary door: {requested_door_passcode}")
-            passcodes.append(requested_door_passcode)
-            lock_macs.append(lock_mac)
-
-            wellness_door_mac = "FD:64:42:39:E5:54"  # Replace with the actual fidiou wellness door MAC
-            wellness_door_id = get_lock_id_by_mac(wellness_door_mac)
-            
-            # Issue passcode for the main door
-            wellness_door_passcode = generate_passcode(wellness_door_id, from_time, to_time, coworker_name)
-            app.logger.info(f"Generated passcode for main door: {wellness_door_passcode}")
-            passcodes.append(wellness_door_passcode)
-            lock_macs.append(wellness_door_mac)
-    elif resource_id in secondary_door_passcodes_ids_case2:
-            app.logger.info(f"Requested Secondary door Resource id {resource_id}")
-            requested_door_passcode = generate_passcode(lock_id, from_time, to_time, coworker_name)
-            app.logger.info(f"Generated passcode for requested secondary door 1: {requested_door_passcode}")
-            passcodes.append(requested_door_passcode)
-            lock_macs.append(lock_mac)
-
-           # Issue passcode for main door 1 - one main door too many?
-        #    lower_gf_entrance_door_mac = "0D:A9:BA:99:28:F6"  # Replace with the actual main door MAC
-        #    lower_gf_entrance_door_id = get_lock_id_by_mac(lower_gf_entrance_door_mac)
-        #    lower_gf_entrance_passcode = generate_passcode(lower_gf_entrance_door_id, from_time, to_time, coworker_name)
-        #    app.logger.info(f"Generated passcode for Lower GF: {lower_gf_entrance_passcode}")
-        #    passcodes.append(lower_gf_entrance_passcode)
-        #    lock_macs.append(lower_gf_entrance_door_mac)
-            
-   
-            # Issue passcode for a main door 2
-            main_door_2_mac = "EE:4F:8C:5A:BE:97"  # Replace with the actual main door MAC - Patmou LGF Lobby
-            main_door_2_door_id = get_lock_id_by_mac(main_door_2_mac)
-            app.logger.info(f"Requested Main door 2 Resource id {main_door_2_door_id}")
-            main_door_2_passcode = generate_passcode(main_door_2_door_id, from_time, to_time, coworker_name)
-            app.logger.info(f"Generated passcode for Main door 2: {main_door_2_passcode}")
-            passcodes.append(main_door_2_passcode)
-            lock_macs.append(main_door_2_mac)
-
-            # Issue passcode for main door 1
-            main_door_1_mac = "E0:61:DA:79:64:45"  # Replace with the actual Patmou staircase door MAC
-            main_door_1_door_id = get_lock_id_by_mac(main_door_1_mac)
-            app.logger.info(f"Requested Main door 1 Resource id {main_door_1_mac}")
-            main_door_1_passcode = generate_passcode(main_door_1_door_id, from_time, to_time, coworker_name)
-            app.logger.info(f"Generated passcode for main door 1: {main_door_1_passcode}")
-            passcodes.append(main_door_1_passcode)
-            lock_macs.append(main_door_1_mac) # Issue passcode for the actual main door 
-
-        
-        
-    else:
-         app.logger.info(f"Invalid Input value")
-        
-
-        
-            
-
-    coworker_id = data['CoworkerId']
-
-    if send_message(coworker_id, passcodes, coworker_name, lock_macs, from_time, to_time,
-                    data["ResourceName"], data["BookingNumber"]):
-        app.logger.info(f"Successfully added coworker message {coworker_name}, {passcodes}")
-
-def handle_cancel_request(data):
-    resource_id = data[0]['ResourceId']
-    from_time_str = data[0]['FromTime']
-
-    app.logger.info(f"Cancel request data timee: {from_time_str}")
-
-    # Convert 'FromTime' string to a datetime object
-    from_time_dt = datetime.strptime(from_time_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
-    
-    # Subtract 15 minutes
-    from_time_adjusted = from_time_dt - timedelta(minutes=15)
-
-    from_time = from_time_adjusted.strftime("%Y-%m-%dT%H:%M:%SZ")
-    
-    # Log the adjusted time
-    app.logger.info(f"Adjusted request data timee: {from_time}")
-    
-    to_time = data[0]['ToTime']
-
-    if resource_id is None:
-        app.logger.warning("ResourceId missing")
-        return jsonify({'error': 'ResourceId missing'}), 400
-
-    app.logger.info(f"Cancel request data: {data}")
-
-    
-
-    # List of all locks for the resource_id
-    lock_ids_to_cancel = []
-    
-    if resource_id in single_passcode_door_ids:
-        lock_mac = resource_to_lock_mapping.get(resource_id)
-        lock_id = get_lock_id_by_mac(lock_mac)
-        # Generate a single passcode for the specific door
-        app.logger.info(f"Single Lock id to be deleted: {lock_id}")
-        lock_ids_to_cancel.append(lock_id)
-    elif resource_id in secondary_door_passcodes_ids_case1:
-        lock_mac = resource_to_lock_mapping.get(resource_id)
-        lock_id = get_lock_id_by_mac(lock_mac)
-        app.logger.info(f"Requested Secondary door Lock id {lock_id}")
-        lock_ids_to_cancel.append(lock_id)
-        wellness_door_mac = "FD:64:42:39:E5:54"  # Replace with the actual main door MAC
-        wellness_door_id = get_lock_id_by_mac(wellness_door_mac)
-        app.logger.info(f"Requested Secondary door  Lock id {wellness_door_id}")
-        lock_ids_to_cancel.append(wellness_door_id)
-    elif resource_id in secondary_door_passcodes_ids_case2:
-        lock_mac = resource_to_lock_mapping.get(resource_id)
-        lock_id = get_lock_id_by_mac(lock_mac)
-        app.logger.info(f"Requested Secondary door Lock id {lock_id}")
-        lock_ids_to_cancel.append(lock_id)
-      #  lower_gf_entrance_door_mac = "0D:A9:BA:99:28:F6"  # Replace with the actual main door MAC
-      #  lower_gf_entrance_door_id = get_lock_id_by_mac(lower_gf_entrance_door_mac)
-      #  app.logger.info(f"Lower GF door Lock id {lower_gf_entrance_door_id}")
-      #  lock_ids_to_cancel.append(lower_gf_entrance_door_id)
-        
-        main_door_1_mac = "E0:61:DA:79:64:45"  # Replace with the actual main door MAC
-        main_door_1_door_id = get_lock_id_by_mac(main_door_1_mac)
-        app.logger.info(f"Main Door 1 Lock id {main_door_1_door_id}")
-        lock_ids_to_cancel.append(main_door_1_door_id)
-        main_door_2_mac = "EE:4F:8C:5A:BE:97"  # Replace with the actual main door MAC
-        main_door_2_door_id = get_lock_id_by_mac(main_door_2_mac)
-        app.logger.info(f"Main door 2 Lock id {main_door_2_door_id}")
-        lock_ids_to_cancel.append(main_door_2_door_id)
-    
-    else:
-         app.logger.info(f"Invalid Resource ID")
-          
-    print(f"lock ids to cancel {lock_ids_to_cancel}")
-
-    for lock_id_to_cancel in lock_ids_to_cancel:
-        print(f'id {lock_id_to_cancel}')
-        passcode = find_passcode(lock_id_to_cancel, from_time, to_time)
-       
-
-        if passcode:
-            if delete_passcode(lock_id=lock_id_to_cancel, keyboard_pwd_id=passcode['keyboardPwdId']):
-                app.logger.info(f'Success deleting passcode on lock on lock {lock_id_to_cancel} for resource {resource_id}.')
-            else:
-                app.logger.warning(f'Failed deleting passcode on lock on lock {lock_id_to_cancel} for resource {resource_id}.')
-        else:
-            app.logger.warning(f'Passcode not found on lock on lock {lock_id_to_cancel} for resource {resource_id}.')
 
+def dispatch(target, data):
+    # a forked process per job under sync workers, a pooled greenlet or thread under gevent (see execution.py)
+    with tracing.span('dispatch', target=target.__name__, mode=execution.mode()):
+        execution.submit(target, (data, tracing.current_context()), app.logger)
 
-@app.route('/booking-webhook', methods=['POST'])
-def booking_webhook():
-    datas = request.get_json()
-    rid = None
 
-    if not datas:
-        app.logger.warning("Invalid booking data")
-        return jsonify({'error': 'Invalid data'}), 200
-
-    if isinstance(datas, list) and len(datas) > 0:
-        for data in datas:
-            rid = str(uuid.uuid4())[:12]
-            process = mp.Process(target=handle_request, args=(data,))
-            process.start()
-    elif isinstance(datas, dict):
-        rid = str(uuid.uuid4())[:12]
-        process = mp.Process(target=handle_request, args=(datas,))
-        process.start()
+EMPTY_BODIES = (b'', b'null', b'[]', b'{}')
+
 
+def jobs_from(kind, body):
+    # (handler, BookingJob) for each job a webhook body carries; the rest of the payload is dropped here
+    datas = json.loads(body)
+    if isinstance(datas, dict):
+        datas = [datas]
+    datas = [data for data in datas or [] if isinstance(data, dict)]
+    if kind == 'cancel':
+        return [(pipeline.handle_cancel_request, BookingJob.from_nexudus(datas[0]))] if datas else []
+    return [(pipeline.handle_request, BookingJob.from_nexudus(data)) for data in datas]
+
+
+def accept_webhook(kind, invalid_status):
+    # The ack path: a syntax check, no job building, no dispatch, just the raw body into the intake ring
+    rid = incoming_request_id()
+    body = request.get_data()
+    if body.strip() in EMPTY_BODIES:
+        app.logger.warning("Invalid booking data")
+        return jsonify({'error': 'Invalid data'}), invalid_status
+    try:
+        # only a well-formed body is acked; the job fields are still read off the ack path
+        json.loads(body)
+    except ValueError:
+        app.logger.warning("Malformed booking data")
+        return jsonify({'error': 'Invalid JSON'}), 400
+
+    rejected = over_memory_budget()
+    if rejected:
+        return rejected
+
+    if upstream_http.shutting_down():
+        # the worker is stopping; the next one picks the work up from the job queue
+        queue_jobs(kind, body, 'shutdown')
+    elif not intake.accept(kind, body, rid):
+        # ring full: keep the work in the durable job queue, drained like parked jobs
+        log_event(app.logger, 'intake_overflow', "Intake ring full, queueing webhook in the job queue",
+                  level=logging.WARNING)
+        queue_jobs(kind, body, 'intake')
     return jsonify({"request_id": rid}), 200
 
 
-def find_passcode(lock_id, from_time, to_time):
-    page_no = 1
-    passcode_to_delete = None
+def queue_jobs(kind, body, reason):
+    try:
+        jobs = jobs_from(kind, body)
+    except ValueError as e:
+        # an unreadable body is dropped alone, the rest of a shutdown drain still gets queued
+        app.logger.error(f"Dropping unreadable {kind} webhook: {e}")
+        return 0
+    for handler, data in jobs:
+        job_queue.put(pipeline.PARKED_KINDS[handler], data.astuple(), reason=reason)
+    return len(jobs)
 
-    while True:
-        # API request to list passcodes
-        passcodes = list_passcodes(lock_id=lock_id, page_no=page_no)
 
-        # Check each passcode in the current page
-        for passcode in passcodes.get('list', []):
-            if passcode['startDate'] == int(
-                    datetime.strptime(from_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc).timestamp() * 1000) and \
-                    passcode['endDate'] == int(
-                    datetime.strptime(to_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc).timestamp() * 1000):
-                passcode_to_delete = passcode
-                break
+def consume_intake():
+    # Runs in each web worker; parses what the webhooks acked and hands it to dispatch()
+    while True:
+        kind, body, rid, waited = intake.take()
+        if upstream_http.shutting_down():
+            queue_jobs(kind, body, 'shutdown')
+            continue
+        trace_token = tracing.start_trace(rid)
+        try:
+            with tracing.span('intake', kind=kind, wait_ms=round(waited * 1000, 2)):
+                for handler, data in jobs_from(kind, body):
+                    if admitted(handler, data):
+                        dispatch(handler, data)
+        except Exception as e:
+            app.logger.error(f"Dispatching {kind} webhook {rid} failed: {e}")
+        finally:
+            tracing.end_trace(trace_token)
 
-        if passcode_to_delete or not passcodes.get('list'):
-            break
 
-        page_no += 1
 
-    return passcode_to_delete
+@app.route('/booking-webhook', methods=['POST'])
+def booking_webhook():
+    return accept_webhook('provision', 200)
 
 
 @app.route('/test', methods=['GET'])
@@ -631,96 +244,146 @@ def test():
     return jsonify({'message': 'API is working'}), 200
 
 
-@app.route('/booking-cancelled', methods=['POST'])
-def cancel_booking_webhook():
-    data = request.get_json()
+def admin_authorized():
+    # closed until ADMIN_TOKEN is set: these endpoints change door routing and breaker state
+    token = app.config['ADMIN_TOKEN']
+    return bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
 
-    if not data:
-        app.logger.warning("Invalid booking data")
-        return jsonify({'error': 'Invalid data'}), 400
 
-    rid = str(uuid.uuid4())[:12]
-    process = mp.Process(target=handle_cancel_request, args=(data,))
-    process.start()
+@app.route('/admin/gateway-health', methods=['GET'])
+def gateway_health_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'gateways': gateway_health.all_stats()}), 200
 
-    return jsonify({"request_id": rid}), 200
 
+@app.route('/admin/breakers', methods=['GET'])
+def breaker_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'breakers': circuit_breaker.all_states(), 'parked': job_queue.counts()}), 200
 
-@app.route('/add-resource', methods=['POST'])
-def add_resource():
-    data = request.get_json()
-    resource_id = data.get('resource_id')
-    lock_mac = data.get('lock_mac')
 
-    if not resource_id or not lock_mac:
-        return jsonify({'error': 'Missing resource_id or lock_mac'}), 400
+@app.route('/admin/breakers/reset', methods=['POST'])
+def reset_breakers():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    circuit_breaker.reset((request.get_json(silent=True) or {}).get('name'))
+    return jsonify({'breakers': circuit_breaker.all_states()}), 200
 
-    [resource_id] = lock_mac
-    return jsonify({'message': 'Resource added successfully'}), 200
 
+@app.route('/admin/hedging', methods=['GET'])
+def hedging_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'endpoints': sorted(hedging.HEDGE_ENDPOINTS), 'stats': hedging.stats()}), 200
 
-@app.route('/delete-resource', methods=['POST'])
-def delete_resource():
-    data = request.get_json()
-    resource_id = data.get('resource_id')
 
-    if not resource_id or resource_id not in resource_to_lock_mapping:
-        return jsonify({'error': 'Invalid or missing resource_id'}), 400
-
-    del [resource_id]
-    return jsonify({'message': 'Resource deleted successfully'}), 200
+@app.route('/admin/rate-limits', methods=['GET'])
+def rate_limit_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'buckets': rate_limiter.status()}), 200
 
-def get_nexudus_access_token():
-    if 'expires_in' in my_session and my_session['expires_in'].replace(tzinfo=pytz.utc) > datetime.now(tz=pytz.utc):
-        return my_session['access_nexudus_token']
-    elif 'nexudus_modified' in my_session and my_session['nexudus_modified'] == True:
-        return refresh_nexudus_token()
-    else:
-        return get_nexudus_token()
 
+@app.route('/admin/coordination', methods=['GET'])
+def coordination_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(coordination.status()), 200
 
-def get_nexudus_token():
-    url = 'https://spaces.nexudus.com/api/token'
-    data = {
-        'grant_type': 'password',
-        'username': app.config['NEXUDUS_USERNAME'],
-        'password': app.config['NEXUDUS_PASSWORD'],
-    }
 
-    response = requests.post(url, data=data)
-    token_data = response.json()
+@app.route('/admin/memory', methods=['GET'])
+def memory_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(dict(memory_guard.status(), execution=execution.status(), intake=intake.status(),
+                        admission=admission.status())), 200
 
-    if 'access_token' in token_data:
-        my_session['access_nexudus_token'] = token_data['access_token']
-        my_session['refresh_nexudus_token'] = token_data['refresh_token']
-        my_session['expires_in'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
 
-    return token_data['access_token']
+@app.route('/booking-cancelled', methods=['POST'])
+def cancel_booking_webhook():
+    return accept_webhook('cancel', 400)
 
 
-def refresh_nexudus_token():
-    url = 'https://spaces.nexudus.com/api/token'
+@app.route('/add-resource', methods=['POST'])
+def add_resource():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json() or {}
+    resource_id = data.get('resource_id')
+    lock_mac = data.get('lock_mac')
 
-    headers = {
-        'client_id': app.config["NEXUDUS_USERNAME"]
-    }
+    if not resource_id or not lock_mac:
+        return jsonify({'error': 'Missing resource_id or lock_mac'}), 400
 
-    data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': my_session['refresh_nexudus_token']
-    }
+    try:
+        registry = resource_registry.add_resource(int(resource_id), lock_mac.upper(), data.get('class', 'single'),
+                                                  data.get('name'), data.get('door_name'))
+    except (ValueError, resource_registry.RegistryError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Resource added successfully', 'version': registry.version}), 200
 
-    response = requests.post(url, data=data, headers=headers)
-    token_data = response.json()
 
-    if 'access_token' in token_data:
-        my_session['access_nexudus_token'] = token_data['access_token']
-        my_session['refresh_nexudus_token'] = token_data['refresh_token']
-        my_session['expires_in'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
-        my_session.nexudus_modified = True
+@app.route('/delete-resource', methods=['POST'])
+def delete_resource():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json() or {}
+    try:
+        resource_id = int(data['resource_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid or missing resource_id'}), 400
 
-    return my_session['access_token']
+    if resource_id not in resource_registry.current().resources:
+        return jsonify({'error': 'Invalid or missing resource_id'}), 400
 
+    try:
+        registry = resource_registry.remove_resource(resource_id)
+    except resource_registry.RegistryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Resource deleted successfully', 'version': registry.version}), 200
+
+
+@app.route('/admin/registry', methods=['GET'])
+def registry_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    registry = resource_registry.current()
+    return jsonify(dict(registry.to_dict(), version=registry.version)), 200
+
+
+@app.route('/admin/registry/reload', methods=['POST'])
+def reload_registry():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        registry = resource_registry.load()
+    except (OSError, ValueError) as e:
+        return jsonify({'error': f'Registry not reloaded: {e}'}), 400
+    return jsonify({'message': 'Registry reloaded', 'version': registry.version}), 200
+
+
+@app.route('/admin/registry/sync', methods=['POST'])
+def sync_registry():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        result = nexudus_sync.sync(pipeline.nexudus_base_url, pipeline.get_nexudus_access_token(),
+                                   app.config['NEXUDUS_CUSTOM_FIELD_NAME'], full=bool(data.get('full')))
+        result['locks_indexed'] = pipeline.refresh_lock_index()
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        app.logger.error(f"Registry sync failed: {e}")
+        return jsonify({'error': f'Registry sync failed: {e}'}), 502
+    return jsonify(result), 200
+
+
+@app.route('/admin/locks', methods=['GET'])
+def lock_index_status():
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'locks': lock_index.entries()}), 200
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+
+import proc_stats
+
+MEMORY_LIMIT_MB = float(os.environ.get('MEMORY_LIMIT_MB', '512'))
+# Stop taking new bookings above the high watermark, resume below the low one
+MEMORY_HIGH_WATERMARK = float(os.environ.get('MEMORY_HIGH_WATERMARK', '0.85'))
+MEMORY_LOW_WATERMARK = float(os.environ.get('MEMORY_LOW_WATERMARK', '0.75'))
+MEMORY_CHECK_INTERVAL = float(os.environ.get('MEMORY_CHECK_INTERVAL', '1'))
+
+CGROUP_PROCS = ('/sys/fs/cgroup/cgroup.procs', '/sys/fs/cgroup/memory/cgroup.procs')
+# (usage counter, stat file, reclaimable page cache field) for cgroup v2 and v1
+CGROUP_MEMORY = (('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory.stat', 'inactive_file'),
+                 ('/sys/fs/cgroup/memory/memory.usage_in_bytes', '/sys/fs/cgroup/memory/memory.stat',
+                  'total_inactive_file'))
+
+_lock = threading.Lock()
+_state = {'checked': 0.0, 'used': 0, 'accepting': True}
+
+
+def _dyno_pids():
+    for path in CGROUP_PROCS:
+        try:
+            with open(path) as f:
+                return [int(line) for line in f if line.strip()]
+        except OSError:
+            continue
+    # no cgroup view: count the gunicorn master and everything under it
+    root = os.getppid()
+    return [root] + proc_stats.descendants(root)
+
+
+def _cgroup_used():
+    # The dyno's own counter, less the page cache the kernel can drop; None without a cgroup view
+    for usage_path, stat_path, inactive_field in CGROUP_MEMORY:
+        try:
+            with open(usage_path) as f:
+                usage = int(f.read())
+        except (OSError, ValueError):
+            continue
+        inactive = 0
+        try:
+            with open(stat_path) as f:
+                for line in f:
+                    name, _, value = line.partition(' ')
+                    if name == inactive_field:
+                        inactive = int(value)
+                        break
+        except (OSError, ValueError):
+            pass
+        return max(usage - inactive, 0)
+    return None
+
+
+def used_bytes():
+    # Memory of every process on the dyno (web workers and their booking processes). Summed RSS would
+    # count the copy-on-write pages booking processes share with their parent once per process
+    used = _cgroup_used()
+    if used is not None:
+        return used
+    return sum(proc_stats.pss_bytes(pid) for pid in _dyno_pids())
+
+
+def limit_bytes():
+    return MEMORY_LIMIT_MB * 2 ** 20
+
+
+def accepting():
+    now = time.monotonic()
+    with _lock:
+        if now - _state['checked'] < MEMORY_CHECK_INTERVAL:
+            return _state['accepting']
+        _state['checked'] = now
+    used = used_bytes()
+    with _lock:
+        _state['used'] = used
+        if _state['accepting'] and used >= limit_bytes() * MEMORY_HIGH_WATERMARK:
+            _state['accepting'] = False
+        elif not _state['accepting'] and used <= limit_bytes() * MEMORY_LOW_WATERMARK:
+            _state['accepting'] = True
+        return _state['accepting']
+
+
+def status():
+    accepting()
+    return {
+        'used_mb': round(_state['used'] / 2 ** 20, 1),
+        'limit_mb': MEMORY_LIMIT_MB,
+        'high_watermark_mb': round(MEMORY_LIMIT_MB * MEMORY_HIGH_WATERMARK, 1),
+        'low_watermark_mb': round(MEMORY_LIMIT_MB * MEMORY_LOW_WATERMARK, 1),
+        'accepting': _state['accepting'],
+    }
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+import resource_registry
+import upstream_http
+
+# Pulls resources changed since the last run from Nexudus and routes each one to the lock
+# named in its custom field. Run from Heroku Scheduler:  python3 nexudus_sync.py
+SYNC_PAGE_SIZE = int(os.environ.get('NEXUDUS_SYNC_PAGE_SIZE', '100'))
+SYNC_DEFAULT_CLASS = os.environ.get('NEXUDUS_SYNC_DEFAULT_CLASS', 'single')
+SYNC_TIMEOUT = float(os.environ.get('NEXUDUS_SYNC_TIMEOUT', '30'))
+
+MAC_IN_TEXT = re.compile(r'([0-9A-Fa-f]{2}[:-]){5}[0-9A-Fa-f]{2}')
+
+
+def custom_field(resource, field_name):
+    # Nexudus returns custom fields either as {'Data': [{'Name', 'Value'}]} or as a plain list
+    fields = resource.get('CustomFields') or []
+    if isinstance(fields, dict):
+        fields = fields.get('Data', [fields])
+    for field in fields:
+        if isinstance(field, dict) and field.get('Name') == field_name:
+            return field.get('Value')
+        if isinstance(field, dict) and field_name in field and 'Name' not in field:
+            return field[field_name]
+    return None
+
+
+def lock_mac_from(value):
+    match = MAC_IN_TEXT.search(value or '')
+    return match.group(0).replace('-', ':').upper() if match else None
+
+
+def fetch_resources(base_url, access_token, updated_since=None):
+    # Oldest change first, so an interrupted run can resume from the last UpdatedOn it applied
+    page = 1
+    while True:
+        params = {'page': page, 'size': SYNC_PAGE_SIZE, 'orderby': 'UpdatedOn', 'dir': 'Ascending'}
+        if updated_since:
+            params['from_Resource_UpdatedOn'] = updated_since
+        response = upstream_http.get(upstream_http.NEXUDUS, 'api/billing/resources', f'{base_url}api/billing/resources', params=params,
+                                     headers={'Authorization': f'Bearer {access_token}'}, timeout=SYNC_TIMEOUT)
+        response.raise_for_status()
+        body = response.json()
+        yield from body.get('Records', [])
+        if not body.get('HasNextPage'):
+            return
+        page += 1
+
+
+def plan_changes(registry, records, field_name):
+    # (resource_id, name, lock_mac or None) for every resource whose routing differs from the registry
+    changes = []
+    for record in records:
+        resource_id = record['Id']
+        lock_mac = None if record.get('Archived') else lock_mac_from(custom_field(record, field_name))
+        entry = registry.resources.get(resource_id)
+        if entry is None and lock_mac is None:
+            continue
+        if entry is not None and entry.get('lock_mac') == lock_mac:
+            continue
+        if entry is not None and lock_mac is None and entry.get('source') != 'nexudus':
+            # hand-configured routes (main doors, rooftop) are not managed through Nexudus
+            continue
+        changes.append((resource_id, record.get('Name'), lock_mac))
+    return changes
+
+
+def apply_changes(data, changes, watermark):
+    resources = data.setdefault('resources', {})
+    doors = data.setdefault('doors', {})
+    for resource_id, name, lock_mac in changes:
+        key = str(resource_id)
+        entry = resources.get(key)
+        if lock_mac is None:
+            resources.pop(key, None)
+            continue
+        if entry is None:
+            entry = resources[key] = {'class': SYNC_DEFAULT_CLASS, 'source': 'nexudus'}
+        entry['lock_mac'] = lock_mac
+        if name:
+            entry['name'] = name
+            doors.setdefault(lock_mac, name)
+    data['sync'] = {'updated_on': watermark, 'synced_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+
+def sync(base_url, access_token, field_name, full=False):
+    if not field_name:
+        raise ValueError('NEXUDUS_CUSTOM_FIELD_NAME is not set')
+    registry = resource_registry.current()
+    since = None if full else registry.sync.get('updated_on')
+    records = list(fetch_resources(base_url, access_token, since))
+    watermark = max((r['UpdatedOn'] for r in records if r.get('UpdatedOn')), default=since)
+    changes = plan_changes(registry, records, field_name)
+    if changes or watermark != since:
+        registry = resource_registry.update(lambda data: apply_changes(data, changes, watermark))
+    return {'fetched': len(records), 'changed': [{'resource_id': rid, 'name': name, 'lock_mac': mac}
+                                                 for rid, name, mac in changes],
+            'updated_on': watermark, 'version': registry.version}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sync resource -> lock routing from Nexudus custom fields')
+    parser.add_argument('--full', action='store_true', help='ignore the UpdatedOn watermark and re-read every resource')
+    parser.add_argument('--skip-locks', action='store_true', help='do not rebuild the Sciener lock index')
+    args = parser.parse_args(argv)
+
+    from booking_worker import pipeline as service
+
+    result = sync(service.nexudus_base_url, service.get_nexudus_access_token(),
+                  service.config['NEXUDUS_CUSTOM_FIELD_NAME'], full=args.full)
+    if not args.skip_locks:
+        result['locks_indexed'] = service.refresh_lock_index()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
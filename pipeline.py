@@ -0,0 +1,734 @@
+import logging
+import os
+import pathlib
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+import requests
+
+import access_plan
+import booking_ledger
+import coordination
+import gateway_health
+import job_queue
+import lock_index
+import structured_logging
+import tracing
+import upstream_http
+from structured_logging import Truncated, log_event, log_verbose
+
+# The Sciener and Nexudus clients and the booking pipeline, without Flask: imported by the web app,
+# by booking processes (booking_worker.py) and by the pull, reconcile and sync jobs
+
+# Local runs keep their settings in .env; on Heroku they are config vars and dotenv is never imported
+ENV_FILE = pathlib.Path(os.path.abspath(__file__)).parent / '.env'
+if ENV_FILE.exists():
+    from dotenv import load_dotenv
+    load_dotenv(ENV_FILE)
+
+logger = logging.getLogger(__name__)
+
+# Resource -> lock routing, door names and resource classes live in resources.json
+# (see resource_registry.py); note: main doors do not have a resouce associated with them
+
+my_session = {'modified': None, 'nexudus_modified': False, 'access_token': '', 'refresh_token': ''}
+
+
+class Config:
+    CLIENT_ID = os.environ.get('CLIENT_ID')
+    CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
+    USERNAME = os.environ.get('SCIENER_USERNAME')
+    PASSWORD = os.environ.get('SCIENER_PASSWORD')
+    PASSCODE_LENGTH = os.environ.get('PASSCODE_LENGTH')
+    NEXUDUS_USERNAME = os.environ.get('NEXUDUS_USERNAME')
+    NEXUDUS_PASSWORD = os.environ.get('NEXUDUS_PASSWORD')
+    NEXUDUS_CUSTOM_FIELD_NAME = os.environ.get('NEXUDUS_CUSTOM_FIELD_NAME')
+    # Bookings starting further ahead than this are left to the off-peak pull job (preprovision.py); 0 disables
+    PREPROVISION_DEFER_HOURS = float(os.environ.get('PREPROVISION_DEFER_HOURS', '0'))
+    # Seconds a booking (token, lock lookups, every passcode add and the message) or a cancellation may take
+    BOOKING_DEADLINE = float(os.environ.get('BOOKING_DEADLINE', '300'))
+    CANCEL_DEADLINE = float(os.environ.get('CANCEL_DEADLINE', '180'))
+    DEADLINE_REQUEUE_DELAY = float(os.environ.get('DEADLINE_REQUEUE_DELAY', '120'))
+    # Tokens are shared through the coordination backend until this many seconds before they expire
+    TOKEN_REFRESH_MARGIN = float(os.environ.get('TOKEN_REFRESH_MARGIN', '300'))
+    TOKEN_LOCK_WAIT = float(os.environ.get('TOKEN_LOCK_WAIT', '30'))
+    # One passcode add/delete per gateway at a time, across every worker and dyno
+    GATEWAY_LOCK_TTL = float(os.environ.get('GATEWAY_LOCK_TTL', '60'))
+    GATEWAY_LOCK_WAIT = float(os.environ.get('GATEWAY_LOCK_WAIT', '60'))
+
+
+# The web app swaps in its app.config, which is built from the same class
+config = {name: value for name, value in vars(Config).items() if name.isupper()}
+
+# Overridable so the service can run against upstream_stub.py
+base_url = os.environ.get('SCIENER_BASE_URL', "https://euapi.sciener.com/")
+nexudus_base_url = os.environ.get('NEXUDUS_BASE_URL', "https://spaces.nexudus.com/")
+
+
+def get_access_token():
+    if 'expires_at' in my_session and my_session['expires_at'].replace(tzinfo=pytz.utc) > datetime.now(tz=pytz.utc):
+        return my_session['access_token']
+    # one worker fetches, the others pick its token up from the coordination backend
+    shared = coordination.single_flight('token:sciener', fetch_sciener_token, wait=config['TOKEN_LOCK_WAIT'],
+                                        sleep=upstream_http.sleep)
+    my_session.update(access_token=shared['access_token'], refresh_token=shared['refresh_token'],
+                      expires_at=datetime.fromtimestamp(shared['expires_at'], tz=pytz.utc))
+    return my_session['access_token']
+
+
+def fetch_sciener_token():
+    if my_session['modified']:
+        refresh_token()
+    else:
+        get_token()
+    return shared_token(my_session['access_token'], my_session.get('refresh_token'), my_session['expires_at'])
+
+
+def shared_token(access_token, refresh, expires_at):
+    ttl = (expires_at - datetime.now(tz=pytz.utc)).total_seconds() - config['TOKEN_REFRESH_MARGIN']
+    return {'access_token': access_token, 'refresh_token': refresh, 'expires_at': expires_at.timestamp()}, ttl
+
+
+@tracing.traced('sciener.token')
+def get_token():
+    url = f'{base_url}oauth2/token'
+    data = {
+        'clientId': config['CLIENT_ID'],
+        'clientSecret': config['CLIENT_SECRET'],
+        'username': config['USERNAME'],
+        'password': config['PASSWORD'],
+    }
+
+    response = upstream_http.post(upstream_http.SCIENER, 'oauth2/token', url, data=data)
+    token_data = response.json()
+
+    log_event(logger, 'token', errcode=token_data.get('errcode'))
+
+    if 'access_token' in token_data:
+        my_session['access_token'] = token_data['access_token']
+        my_session['refresh_token'] = token_data['refresh_token']
+        my_session['expires_at'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
+        my_session['uid'] = token_data['uid']
+
+    return token_data['access_token']
+
+
+@tracing.traced('sciener.token_refresh')
+def refresh_token():
+    url = f'{base_url}oauth2/token'
+
+    data = {
+        'clientId': config['CLIENT_ID'],
+        'clientSecret': config['CLIENT_SECRET'],
+        'grant_type': 'refresh_token',
+        'refresh_token': my_session.get('refresh_token')
+    }
+
+    response = upstream_http.post(upstream_http.SCIENER, 'oauth2/token', url, data=data)
+    token_data = response.json()
+
+    if 'access_token' in token_data:
+        my_session['access_token'] = token_data['access_token']
+        my_session['expires_at'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
+        my_session['modified'] = True
+
+    return my_session['access_token']
+
+
+@tracing.traced('lock_lookup')
+def get_lock_id_by_mac(lock_mac):
+    if not lock_mac:
+        return None
+    tracing.set_attribute('lock_mac', lock_mac)
+
+    lock_id = lock_index.lookup(lock_mac)
+    if lock_id:
+        log_event(logger, 'lock_lookup', "Lock index hit for lock_mac: %s, lock_id: %s", lock_mac, lock_id, lock=lock_id)
+        return lock_id
+
+    page_no = 1
+    found_lock = None
+    started = time.monotonic()
+
+    url = f'{base_url}v3/lock/list'
+
+    while True:
+        params = {
+            'clientId': config['CLIENT_ID'],
+            'accessToken': get_access_token(),
+            'pageNo': page_no,
+            'pageSize': 20,
+            'date': int(time.time() * 1000)
+        }
+        response = upstream_http.get(upstream_http.SCIENER, 'v3/lock/list', url, params=params)
+        response_data = response.json()
+
+        # Check each lock in the current page
+        if 'list' not in response_data or not response_data['list']:
+            logger.warning(f"No locks found on page {page_no}")
+            break
+        lock_index.store(response_data['list'])
+
+        for lock in response_data['list']:
+            log_verbose(logger, "Checking lock: %s", lock)
+            if lock.get('lockMac') == lock_mac:
+                found_lock = lock
+                break
+
+        if found_lock:
+            log_event(logger, 'lock_lookup', "Found lock with lock_mac: %s, lock_id: %s", lock_mac, found_lock['lockId'],
+                      lock=found_lock['lockId'], latency_ms=round((time.monotonic() - started) * 1000))
+            break
+
+        page_no += 1
+
+    if found_lock:
+        return found_lock['lockId']
+    else:
+        logger.warning(f"Can't get lockId, lockMac address is probably wrong: {lock_mac}")
+        return None
+
+
+@tracing.traced('lock_index_refresh')
+def refresh_lock_index():
+    # Page through every lock on the account and rebuild the MAC -> lockId index
+    url = f'{base_url}v3/lock/list'
+    locks = []
+    page_no = 1
+    while True:
+        params = {
+            'clientId': config['CLIENT_ID'],
+            'accessToken': get_access_token(),
+            'pageNo': page_no,
+            'pageSize': 100,
+            'date': int(time.time() * 1000)
+        }
+        response_data = upstream_http.get(upstream_http.SCIENER, 'v3/lock/list', url, params=params).json()
+        if 'list' not in response_data:
+            raise RuntimeError(f"Lock list failed on page {page_no}: {response_data}")
+        locks.extend(response_data['list'])
+        if page_no >= response_data.get('pages', 1) or not response_data['list']:
+            break
+        page_no += 1
+    lock_index.replace_all(locks)
+    log_event(logger, 'lock_index', "Indexed %d locks", len(locks))
+    return len(locks)
+
+
+@tracing.traced('sciener.listKeyboardPwd')
+def list_passcodes(lock_id, page_no):
+    url = f"{base_url}v3/lock/listKeyboardPwd"
+    params = {
+        'clientId': config['CLIENT_ID'],
+        'accessToken': get_access_token(),
+        'lockId': lock_id,
+        'date': int(time.time() * 1000),
+        'pageNo': page_no,
+        'pageSize': 20  # Adjust pageSize according to expected number of passcodes
+    }
+    response = upstream_http.get(upstream_http.SCIENER, 'v3/lock/listKeyboardPwd', url, params=params)
+    response_data = response.json()
+
+    return response_data
+
+
+@tracing.traced('sciener.keyboardPwd_delete')
+def delete_passcode(lock_id, keyboard_pwd_id):
+    current_time = int(time.time() * 1000)
+
+    # API request to delete a passcode
+    url = f"{base_url}v3/keyboardPwd/delete"
+    data = {
+        'clientId': config['CLIENT_ID'],
+        'accessToken': get_access_token(),
+        'lockId': lock_id,
+        'keyboardPwdId': keyboard_pwd_id,
+        'deleteType': 2,  # Assuming deletion via Wi-Fi or gateway
+        'date': current_time
+    }
+    with gateway_lock(lock_id):
+        response = upstream_http.post(upstream_http.SCIENER, 'v3/keyboardPwd/delete', url, data=data)
+    if response.status_code == 200:
+        return True
+    else:
+        return False
+
+def gateway_lock(lock_id):
+    # A gateway runs one command at a time and answers -3003 to the next, so workers queue here instead
+    return coordination.lock(f'gateway:{lock_id}', ttl=config['GATEWAY_LOCK_TTL'],
+                             wait=config['GATEWAY_LOCK_WAIT'], sleep=upstream_http.sleep)
+
+
+@tracing.traced('generate_passcode')
+def generate_passcode(lock_id, window, coworker_name, max_retries=5, retry_delay=10):
+    if not lock_id:
+        logger.warning(f"Missing parameters for passcode generation: lock_id={lock_id}, window={window}")
+        return None
+    attempt = 1
+    max_retries, current_retry_delay, backoff = gateway_health.retry_policy(lock_id, max_retries, retry_delay)
+    while attempt <= max_retries:
+        
+        try:
+            # another booking may have just found this gateway busy
+            hold = gateway_health.hold_off(lock_id)
+            if hold:
+                upstream_http.sleep(hold)
+            passcode = random.randint(100000, 999999)
+            url = f'{base_url}v3/keyboardPwd/add'
+            # the window, lead included, comes from the access plan and is the same on every attempt
+            reservation_date = datetime.now(tz=pytz.utc)
+            data = {
+                'clientId': config['CLIENT_ID'],
+                'accessToken': get_access_token(),
+                'lockId': lock_id,
+                'keyboardPwd': passcode,
+                'keyboardPwdName': coworker_name,
+                'startDate': window.starts_ms,
+                'endDate': window.ends_ms,
+                'addType': 2,
+                'date': round(reservation_date.timestamp() * 1000),
+            }
+            # the passcode and the token stay out of the logs
+            log_verbose(logger, "Data payload for passcode generation: %s",
+                        dict(data, keyboardPwd='***', accessToken='***'))
+            started = time.monotonic()
+            with tracing.span('sciener.keyboardPwd_add', lock_id=lock_id, attempt=attempt) as add_span, \
+                    gateway_lock(lock_id):
+                response = upstream_http.post(upstream_http.SCIENER, 'v3/keyboardPwd/add', url, data=data)
+                response_data = response.json()
+                add_span.set('errcode', response_data.get('errcode'))
+            latency_ms = round((time.monotonic() - started) * 1000)
+            log_event(logger, 'passcode_add', "generate_passcode response: %s", Truncated(response_data),
+                      lock=lock_id, errcode=response_data.get('errcode'), latency_ms=latency_ms)
+            if 'keyboardPwdId' in response_data:
+                gateway_health.record(lock_id, gateway_health.OK, latency_ms)
+                return passcode
+            #elif response_data.get('errmsg') == 'The gateway is busy. Please try again later.':
+            elif response_data.get('errcode') in [-3003, 1]:
+                gateway_health.record(lock_id, gateway_health.BUSY, latency_ms, backoff=current_retry_delay)
+                log_event(logger, 'passcode_retry', "Retry due to error code %s, Attempt %d/%d. Retrying in %s seconds...",
+                          response_data.get('errcode'), attempt, max_retries, current_retry_delay,
+                          level=logging.WARNING, lock=lock_id, errcode=response_data.get('errcode'))
+                upstream_http.sleep(current_retry_delay)
+                current_retry_delay *= backoff
+                attempt += 1
+            else:
+                gateway_health.record(lock_id, gateway_health.ERROR, latency_ms)
+                logger.warning(f"Failed generating passcode: {response_data}. Window: {window}, Reservation date: {reservation_date}")
+                return None
+        except (upstream_http.CircuitOpen, upstream_http.DeadlineExceeded):
+            # upstream is down or the booking's budget is spent: no point working through the retry ladder
+            raise
+        except coordination.LockBusy as e:
+            # GATEWAY_LOCK_WAIT spent queueing behind other workers' commands on this gateway
+            log_event(logger, 'passcode_retry', "%s, Attempt %d/%d", e, attempt, max_retries,
+                      level=logging.WARNING, lock=lock_id)
+            attempt += 1
+        except requests.RequestException as e:
+            # Handle network-related exceptions
+            logger.error(f"Network exception during passcode generation: {e}")
+            gateway_health.record(lock_id, gateway_health.ERROR)
+            upstream_http.sleep(current_retry_delay)
+            current_retry_delay *= backoff
+            attempt += 1    
+        except Exception as e:
+            logger.error(f"Exception during passcode generation: {e}")
+            return None
+    logger.error(f"Failed to generate passcode after {max_retries} attempts due to gateway being busy.")
+    return None
+
+
+
+@tracing.traced('nexudus.message')
+def send_message(coworker_id, passcodes, coworker_name, plan, resource_name, booking_number):
+    # Door names and local times come from the access plan; doors are listed last to first
+    # added a hashtag after passcode
+    passcode_info = ' \n '.join([f'{door_name}: {passcode} #'
+                                 for (_, door_name), passcode in reversed(list(zip(plan.doors, passcodes)))])
+
+    url = f'{nexudus_base_url}api/spaces/coworkermessages'
+
+    data = {
+        'CoworkerId': coworker_id,
+        'Subject': f'Passcode for your Booking for {resource_name} - #{booking_number}',
+        'Body': (f'<!DOCTYPE html>'
+                 f'<html>'
+                 f'<head>'
+                 f'<style>'
+                 f'body {{ font-family: Arial, sans-serif; }}'
+                 f'p {{ margin: 0; padding: 5px 0; }}'
+                 f'.passcode-info {{ font-weight: bold; white-space: pre-line; }}'
+                 f'</style>'
+                 f'</head>'
+                 f'<body>'
+                 f'<p>Hello {coworker_name},</p>'
+                 f'<p>Here are your access passcodes:</p>'
+                 f'<p class="passcode-info">{passcode_info} </p>'
+                 f'<p>Valid From: {plan.window.valid_from}</p>'
+                 f'<p>Valid To: {plan.window.valid_to}</p>'
+                 f'<p>Thank you,</p>'
+                 f'<p>Your ViOS Team</p>'
+                 f'<p><img src="https://cdn.shopify.com/s/files/1/0526/4670/7372/files/passcode-unlock_480x480.gif?v=1642520983" alt="Your GIF"></p>'
+                 f'</body>'
+                 f'</html>')
+    }
+
+    headers = {
+        'Authorization': 'Bearer ' + get_nexudus_access_token()
+    }
+
+    started = time.monotonic()
+    response = upstream_http.post(upstream_http.NEXUDUS, 'api/spaces/coworkermessages', url, headers=headers, data=data)
+    message_data = response.json()
+    latency_ms = round((time.monotonic() - started) * 1000)
+
+    if response.status_code == 200:
+        log_event(logger, 'message', latency_ms=latency_ms)
+        return True
+
+    log_event(logger, 'message', 'Failed adding coworker message to %s', coworker_name, level=logging.WARNING,
+              latency_ms=latency_ms, errcode=response.status_code)
+    return False
+
+
+def handle_request(job, trace_context=None, source='webhook'):
+    trace_token = tracing.attach(trace_context)
+    log_token = structured_logging.bind(booking_id=job.booking_id, resource=job.resource_id)
+    try:
+        with tracing.span('handle_request', booking_id=job.booking_id, resource_id=job.resource_id), \
+                upstream_http.deadline(config['BOOKING_DEADLINE']):
+            _handle_request(job, source)
+    finally:
+        structured_logging.unbind(log_token)
+        tracing.detach(trace_token)
+        tracing.flush()
+
+
+def _handle_request(job, source='webhook'):
+    resource_id = job.resource_id
+    from_time = job.from_time
+    log_event(logger, 'received', "Requested Resource id %s from %s (%s), job %s", resource_id, from_time, source, job)
+
+    if resource_id is None:
+        logger.warning("ResourceId missing")
+        return
+
+    contacts_booking = job.cancel_if_not_paid
+    tentative = job.tentative
+    online = job.online
+
+    log_verbose(logger, "handle_request data: %s", job)
+
+    if tentative:
+        logger.warning("Generating passcode is cancelled because the booking is not yet confirmed.")
+        return
+
+    if contacts_booking:
+        invoice_paid = job.invoice_paid
+        if not invoice_paid and online:
+            logger.warning("Generating passcode is cancelled because the booking from contacts is not yet paid.")
+            return
+
+    if source == 'webhook' and booking_ledger.is_cancelled(job):
+        # a delayed or parked job whose booking was cancelled while it waited
+        log_event(logger, 'dedupe', "Booking slot was cancelled, skipping")
+        return
+
+    # a booking the ledger already holds goes on to the claim below, which dedupes or resumes it
+    if source == 'webhook' and deferred_to_pull(from_time) and booking_ledger.defer(job, source):
+        log_event(logger, 'deferred', "Booking starts beyond the pre-provisioning cutoff, left to the pull job")
+        return
+
+    try:
+        # the ledger dedupes within the dyno, the booking lock and marker across dynos
+        with booking_lock(job, config['BOOKING_DEADLINE'], wait=0):
+            if coordination.cached(provisioned_key(job)) == slot_of(job) or not booking_ledger.claim(job, source):
+                log_event(logger, 'dedupe', "Booking slot already provisioned or in progress, skipping")
+                return
+            _provision_claimed(job, source)
+    except coordination.LockBusy:
+        log_event(logger, 'dedupe', "Booking is being handled by another worker, skipping")
+
+
+def _provision_claimed(job, source):
+    try:
+        passcodes = provision(job)
+    except upstream_http.UpstreamError as e:
+        # upstream down, failing or out of budget: requeue rather than retry in a loop
+        booking_ledger.suspend(job)
+        park('provision', job, e.breaker)
+        return
+    except Exception:
+        booking_ledger.release(job)
+        raise
+    if passcodes:
+        booking_ledger.provisioned(job, source, passcodes)
+        ends_in = (datetime.strptime(job.to_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc)
+                   - datetime.now(tz=pytz.utc)).total_seconds()
+        coordination.remember(provisioned_key(job), slot_of(job), max(ends_in, 60))
+    else:
+        booking_ledger.release(job)
+
+
+def booking_lock(job, budget, wait):
+    # outlives the work it guards: the deadline budget ends the work first
+    return coordination.lock(f"booking:{job.booking_id}", ttl=budget + 30, wait=wait, sleep=upstream_http.sleep)
+
+
+def provisioned_key(job):
+    return f"provisioned:{job.booking_id}"
+
+
+def slot_of(job):
+    return [job.resource_id, job.from_time, job.to_time]
+
+
+def deferred_to_pull(from_time):
+    defer_hours = config['PREPROVISION_DEFER_HOURS']
+    if not defer_hours:
+        return False
+    starts_in = datetime.strptime(from_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.utc) - datetime.now(tz=pytz.utc)
+    return starts_in > timedelta(hours=defer_hours)
+
+
+def door_passcode(job, done, lock_id, lock_mac, window, coworker_name):
+    # A door that got its passcode on an earlier, requeued attempt keeps it
+    if lock_mac in done:
+        log_event(logger, 'passcode_add', "Reusing passcode issued on an earlier attempt for %s", lock_mac, lock=lock_id)
+        return done[lock_mac]
+    passcode = generate_passcode(lock_id, window, coworker_name)
+    if passcode:
+        booking_ledger.checkpoint(job, lock_mac, passcode)
+    return passcode
+
+
+def lock_ids(plan):
+    return [get_lock_id_by_mac(lock_mac) for lock_mac in plan.lock_macs]
+
+
+def provision(job):
+    # Runs the booking's access plan; returns the passcodes when every door got one and the coworker was messaged
+    plan = access_plan.plan(job)
+    done = booking_ledger.progress(job)
+    if not plan.doors:
+        logger.warning(f"No doors planned for resource {job.resource_id}")
+        return None
+
+    locks = lock_ids(plan)
+    if not locks[0]:
+        logger.warning("No lock id")
+        return None
+
+    passcodes = []
+    for (lock_mac, door_name), lock_id in zip(plan.doors, locks):
+        passcode = door_passcode(job, done, lock_id, lock_mac, plan.window, job.coworker_name)
+        logger.info("%s passcode for %s", 'Generated' if passcode else 'No', door_name)
+        passcodes.append(passcode)
+
+    if send_message(job.coworker_id, passcodes, job.coworker_name, plan, job.resource_name, job.booking_number):
+        log_event(logger, 'provisioned', "Successfully added coworker message %s, %d passcodes",
+                  job.coworker_name, len(passcodes))
+        if None not in passcodes:
+            return passcodes
+    return None
+
+
+def provision_batch(jobs, source):
+    # Plans the whole batch first, then looks up each door's lock once for all of it; bookings with
+    # nothing planned never reach the upstreams
+    plans = [access_plan.plan(job) for job in jobs]
+    try:
+        for lock_mac in {lock_mac for plan in plans for lock_mac in plan.lock_macs}:
+            get_lock_id_by_mac(lock_mac)
+    except upstream_http.UpstreamError as e:
+        # each booking parks itself on the same error below
+        logger.warning(f"Lock lookup for the batch failed: {e}")
+    for job, plan in zip(jobs, plans):
+        if not plan.doors:
+            logger.warning(f"No doors planned for resource {job.resource_id}, skipping")
+            continue
+        handle_request(job, None, source)
+
+
+def handle_cancel_request(job, trace_context=None, source='webhook'):
+    trace_token = tracing.attach(trace_context)
+    log_token = structured_logging.bind(booking_id=job.booking_id, resource=job.resource_id)
+    try:
+        with tracing.span('handle_cancel_request', booking_id=job.booking_id, resource_id=job.resource_id), \
+                upstream_http.deadline(config['CANCEL_DEADLINE']):
+            try:
+                # waits for a provisioning of the same booking to finish, so its passcodes get deleted too
+                with booking_lock(job, config['CANCEL_DEADLINE'], wait=config['CANCEL_DEADLINE']):
+                    _handle_cancel_request(job, source)
+            except upstream_http.UpstreamError as e:
+                park('cancel', job, e.breaker)
+            except coordination.LockBusy:
+                park('cancel', job, 'deadline')
+    finally:
+        structured_logging.unbind(log_token)
+        tracing.detach(trace_token)
+        tracing.flush()
+
+
+def _handle_cancel_request(job, source='webhook'):
+    resource_id = job.resource_id
+    log_event(logger, 'cancel_received', "Cancel requested for resource %s (%s), job %s", resource_id, source, job)
+    recorded = booking_ledger.cancelling(job)
+
+    if resource_id is None:
+        logger.warning("ResourceId missing")
+        return
+
+    log_verbose(logger, "Cancel request data: %s", job)
+
+    # the same plan the booking ran, so the passcodes are looked up by the window they were added with
+    plan = access_plan.plan(job)
+    if not plan.doors:
+        logger.info(f"Invalid Resource ID")
+    lock_ids_to_cancel = lock_ids(plan)
+    logger.debug("lock ids to cancel %s", lock_ids_to_cancel)
+    # only this booking's passcodes go; without a record (an older row) the window alone has to do
+    recorded = booking_ledger.by_door(recorded, plan.lock_macs) if recorded else None
+
+    for lock_mac, lock_id_to_cancel in zip(plan.lock_macs, lock_ids_to_cancel):
+        if recorded is None:
+            passcode = find_passcode(lock_id_to_cancel, plan.window)
+        else:
+            passcode = recorded.get(lock_mac) and find_passcode(lock_id_to_cancel, plan.window, recorded[lock_mac])
+
+        if passcode:
+            if delete_passcode(lock_id=lock_id_to_cancel, keyboard_pwd_id=passcode['keyboardPwdId']):
+                log_event(logger, 'passcode_delete', 'Success deleting passcode on lock %s for resource %s.',
+                          lock_id_to_cancel, resource_id,
+                          lock=lock_id_to_cancel)
+            else:
+                log_event(logger, 'passcode_delete', 'Failed deleting passcode on lock %s for resource %s.',
+                          lock_id_to_cancel, resource_id,
+                          level=logging.WARNING, lock=lock_id_to_cancel)
+        else:
+            log_event(logger, 'passcode_delete', 'Passcode not found on lock %s for resource %s.',
+                      lock_id_to_cancel, resource_id,
+                      level=logging.WARNING, lock=lock_id_to_cancel)
+
+    booking_ledger.cancelled(job)
+    coordination.forget(provisioned_key(job))
+
+
+PARKED_HANDLERS = {'provision': handle_request, 'cancel': handle_cancel_request}
+PARKED_KINDS = {handler: kind for kind, handler in PARKED_HANDLERS.items()}
+
+
+def park(kind, job, breaker):
+    # Held in the job queue until the breaker lets calls through again, see drain_parked();
+    # work that ran out of budget just waits DEADLINE_REQUEUE_DELAY, work cut short by a
+    # shutdown is due at once for the next worker
+    delay = config['DEADLINE_REQUEUE_DELAY'] if breaker == 'deadline' else 0
+    job_queue.put(kind, job.astuple(), reason=breaker, delay=delay)
+    waits_for = 'the next worker' if breaker == 'shutdown' else f'{breaker} to let it through'
+    log_event(logger, 'parked', "%s parked until %s", kind, waits_for, level=logging.WARNING)
+
+
+@tracing.traced('issued_passcodes')
+def issued_passcodes(booking, passcodes):
+    # {lock_mac: passcode} for every planned door, with None where the lock no longer carries the
+    # passcode the ledger recorded for it; a shared main door can hold other bookings' passcodes for the same slot
+    plan = access_plan.plan(booking)
+    recorded = booking_ledger.by_door(passcodes, plan.lock_macs)
+    issued = {}
+    for lock_mac in plan.lock_macs:
+        passcode = recorded.get(lock_mac)
+        lock_id = get_lock_id_by_mac(lock_mac)
+        present = passcode is not None and lock_id and find_passcode(lock_id, plan.window, passcode) is not None
+        issued[lock_mac] = passcode if present else None
+    return issued
+
+
+@tracing.traced('find_passcode')
+def find_passcode(lock_id, window, keyboard_pwd=None):
+    # the passcode for the window, or the one with this value when the ledger recorded it
+    page_no = 1
+    passcode_to_delete = None
+
+    while True:
+        # API request to list passcodes
+        passcodes = list_passcodes(lock_id=lock_id, page_no=page_no)
+
+        # Check each passcode in the current page
+        for passcode in passcodes.get('list', []):
+            if passcode['startDate'] == window.starts_ms and passcode['endDate'] == window.ends_ms and \
+                    (keyboard_pwd is None or str(passcode.get('keyboardPwd')) == str(keyboard_pwd)):
+                passcode_to_delete = passcode
+                break
+
+        if passcode_to_delete or not passcodes.get('list'):
+            break
+
+        page_no += 1
+
+    return passcode_to_delete
+
+
+def get_nexudus_access_token():
+    if 'expires_in' in my_session and my_session['expires_in'].replace(tzinfo=pytz.utc) > datetime.now(tz=pytz.utc):
+        return my_session['access_nexudus_token']
+    shared = coordination.single_flight('token:nexudus', fetch_nexudus_token, wait=config['TOKEN_LOCK_WAIT'],
+                                        sleep=upstream_http.sleep)
+    my_session.update(access_nexudus_token=shared['access_token'], refresh_nexudus_token=shared['refresh_token'],
+                      expires_in=datetime.fromtimestamp(shared['expires_at'], tz=pytz.utc))
+    return my_session['access_nexudus_token']
+
+
+def fetch_nexudus_token():
+    if 'nexudus_modified' in my_session and my_session['nexudus_modified'] == True:
+        refresh_nexudus_token()
+    else:
+        get_nexudus_token()
+    return shared_token(my_session['access_nexudus_token'], my_session.get('refresh_nexudus_token'),
+                        my_session['expires_in'])
+
+
+@tracing.traced('nexudus.token')
+def get_nexudus_token():
+    url = f'{nexudus_base_url}api/token'
+    data = {
+        'grant_type': 'password',
+        'username': config['NEXUDUS_USERNAME'],
+        'password': config['NEXUDUS_PASSWORD'],
+    }
+
+    response = upstream_http.post(upstream_http.NEXUDUS, 'api/token', url, data=data)
+    token_data = response.json()
+
+    if 'access_token' in token_data:
+        my_session['access_nexudus_token'] = token_data['access_token']
+        my_session['refresh_nexudus_token'] = token_data['refresh_token']
+        my_session['expires_in'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
+
+    return token_data['access_token']
+
+
+@tracing.traced('nexudus.token_refresh')
+def refresh_nexudus_token():
+    url = f'{nexudus_base_url}api/token'
+
+    headers = {
+        'client_id': config["NEXUDUS_USERNAME"]
+    }
+
+    data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': my_session['refresh_nexudus_token']
+    }
+
+    response = upstream_http.post(upstream_http.NEXUDUS, 'api/token', url, data=data, headers=headers)
+    token_data = response.json()
+
+    if 'access_token' in token_data:
+        my_session['access_nexudus_token'] = token_data['access_token']
+        my_session['refresh_nexudus_token'] = token_data['refresh_token']
+        my_session['expires_in'] = datetime.now(tz=pytz.utc) + timedelta(seconds=token_data['expires_in'])
+        my_session.nexudus_modified = True
+
+    return my_session['access_token']
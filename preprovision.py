@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+import booking_ledger
+import upstream_http
+from booking_job import BookingJob
+
+# Pulls confirmed bookings starting within the horizon from Nexudus and provisions the ones the
+# ledger has not seen, paced so the gateways are never flooded. Run from Heroku Scheduler
+# during quiet hours:  python3 preprovision.py
+PREPROVISION_HORIZON_HOURS = float(os.environ.get('PREPROVISION_HORIZON_HOURS', '48'))
+PREPROVISION_QUIET_HOURS = os.environ.get('PREPROVISION_QUIET_HOURS', '22-6')
+PREPROVISION_TIMEZONE = os.environ.get('PREPROVISION_TIMEZONE', 'Europe/Helsinki')
+PREPROVISION_BATCH_SIZE = int(os.environ.get('PREPROVISION_BATCH_SIZE', '5'))
+PREPROVISION_BATCH_PAUSE = float(os.environ.get('PREPROVISION_BATCH_PAUSE', '60'))
+PREPROVISION_MAX_BOOKINGS = int(os.environ.get('PREPROVISION_MAX_BOOKINGS', '500'))
+PREPROVISION_PAGE_SIZE = int(os.environ.get('PREPROVISION_PAGE_SIZE', '100'))
+PREPROVISION_TIMEOUT = float(os.environ.get('PREPROVISION_TIMEOUT', '30'))
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def in_quiet_hours(now=None, spec=PREPROVISION_QUIET_HOURS):
+    # "22-6" wraps midnight; hours are local to PREPROVISION_TIMEZONE
+    start, _, end = spec.partition('-')
+    hour = (now or datetime.now(tz=pytz.utc)).astimezone(pytz.timezone(PREPROVISION_TIMEZONE)).hour
+    start, end = int(start), int(end)
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def fetch_upcoming(base_url, access_token, start, end):
+    page = 1
+    while True:
+        params = {'page': page, 'size': PREPROVISION_PAGE_SIZE, 'orderby': 'FromTime', 'dir': 'Ascending',
+                  'from_Booking_FromTime': start.strftime(TIME_FORMAT), 'to_Booking_FromTime': end.strftime(TIME_FORMAT)}
+        response = upstream_http.get(upstream_http.NEXUDUS, 'api/spaces/bookings', f'{base_url}api/spaces/bookings', params=params,
+                                     headers={'Authorization': f'Bearer {access_token}'}, timeout=PREPROVISION_TIMEOUT)
+        response.raise_for_status()
+        body = response.json()
+        yield from (BookingJob.from_nexudus(record) for record in body.get('Records', []))
+        if not body.get('HasNextPage'):
+            return
+        page += 1
+
+
+def pending(bookings):
+    # Confirmed bookings whose current slot is not provisioned yet
+    for booking in bookings:
+        if booking.tentative:
+            continue
+        if booking_ledger.is_provisioned(booking):
+            continue
+        yield booking
+
+
+def run(service, horizon_hours, batch_size, batch_pause, max_bookings, respect_quiet_hours=True):
+    now = datetime.now(tz=pytz.utc)
+    bookings = list(fetch_upcoming(service.nexudus_base_url, service.get_nexudus_access_token(),
+                                   now, now + timedelta(hours=horizon_hours)))
+    todo = list(pending(bookings))[:max_bookings]
+    summary = {'fetched': len(bookings), 'pending': len(todo), 'provisioned': 0, 'failed': 0, 'stopped_early': False}
+
+    for n in range(0, len(todo), batch_size):
+        if n:
+            time.sleep(batch_pause)
+        if respect_quiet_hours and not in_quiet_hours():
+            # leave the rest to the webhooks rather than compete with daytime traffic
+            summary['stopped_early'] = True
+            break
+        batch = todo[n:n + batch_size]
+        service.provision_batch(batch, 'pull')
+        for booking in batch:
+            if booking_ledger.is_provisioned(booking):
+                summary['provisioned'] += 1
+            else:
+                summary['failed'] += 1
+
+    summary['pruned'] = booking_ledger.prune()
+    summary['ledger'] = booking_ledger.counts()
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Provision passcodes for upcoming Nexudus bookings off-peak')
+    parser.add_argument('--horizon-hours', type=float, default=PREPROVISION_HORIZON_HOURS)
+    parser.add_argument('--batch-size', type=int, default=PREPROVISION_BATCH_SIZE)
+    parser.add_argument('--batch-pause', type=float, default=PREPROVISION_BATCH_PAUSE, help='seconds between batches')
+    parser.add_argument('--max-bookings', type=int, default=PREPROVISION_MAX_BOOKINGS)
+    parser.add_argument('--force', action='store_true', help='run outside PREPROVISION_QUIET_HOURS')
+    args = parser.parse_args(argv)
+
+    if not args.force and not in_quiet_hours():
+        print(json.dumps({'skipped': f'outside quiet hours {PREPROVISION_QUIET_HOURS} {PREPROVISION_TIMEZONE}'}))
+        return
+
+    from booking_worker import pipeline as service
+
+    summary = run(service, args.horizon_hours, max(args.batch_size, 1), args.batch_pause, args.max_bookings,
+                  respect_quiet_hours=not args.force)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _parent_map():
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name may contain spaces; fields after ')' are fixed
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        parents.setdefault(ppid, []).append(int(entry))
+    return parents
+
+
+def descendants(pid):
+    parents = _parent_map()
+    found = []
+    stack = [pid]
+    while stack:
+        for child in parents.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def pss_bytes(pid):
+    # Proportional set size: pages shared with forked children count once across all of them
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    # kernels before 4.14 have no smaps_rollup
+    return rss_bytes(pid)
+
+
+def tree_rss(pid):
+    # (total RSS of pid and all descendants, number of descendants, {pid: rss})
+    per_process = {p: rss_bytes(p) for p in [pid] + descendants(pid)}
+    return sum(per_process.values()), len(per_process) - 1, per_process
@@ -0,0 +1,118 @@
+import os
+import time
+
+import state_db
+
+# Token buckets shared by every process on the dyno, one per upstream and per endpoint class.
+# "name=rate/burst" with rate in calls per second; buckets not listed are unlimited
+RATE_LIMITS = os.environ.get('UPSTREAM_RATE_LIMITS',
+                             'sciener=10/20,sciener:write=2/5,nexudus=5/10,nexudus:write=1/5')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    waited REAL NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    queued INTEGER NOT NULL DEFAULT 0,
+    throttled INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def parse_limits(spec):
+    limits = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.strip().partition('=')
+        rate, _, burst = value.partition('/')
+        limits[name] = (float(rate), float(burst or rate))
+    return limits
+
+
+LIMITS = parse_limits(RATE_LIMITS)
+
+
+def _db():
+    return state_db.connect('rate_limiter', SCHEMA)
+
+
+def _refill(row, name, now):
+    rate, burst = LIMITS[name]
+    if row is None:
+        return burst
+    return min(burst, row['tokens'] + (now - row['updated']) * rate)
+
+
+def try_acquire(names):
+    # Takes a token from every limited bucket in names, or from none; returns the seconds to wait
+    # before trying again (0 when the tokens were taken)
+    names = [name for name in names if name in LIMITS]
+    if not names:
+        return 0
+    now = time.time()
+    db = _db()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        levels = {}
+        for name in names:
+            row = db.execute('SELECT * FROM buckets WHERE name = ?', (name,)).fetchone()
+            levels[name] = _refill(row, name, now)
+        wait = max((1 - tokens) / LIMITS[name][0] for name, tokens in levels.items())
+        if wait <= 0:
+            for name, tokens in levels.items():
+                db.execute('INSERT INTO buckets (name, tokens, updated, calls) VALUES (?, ?, ?, 1) '
+                           'ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, '
+                           'calls = calls + 1', (name, tokens - 1, now))
+        db.execute('COMMIT')
+        return max(wait, 0)
+    except Exception:
+        db.execute('ROLLBACK')
+        raise
+
+
+def acquire(names, sleep=time.sleep):
+    # Queues the caller until every bucket has a token; sleep may refuse (deadline) by raising
+    waited = 0.0
+    while True:
+        wait = try_acquire(names)
+        if not wait:
+            if waited:
+                _note_wait(names, waited)
+            return waited
+        sleep(wait)
+        waited += wait
+
+
+def _note_wait(names, waited):
+    _db().executemany('UPDATE buckets SET waited = waited + ?, queued = queued + 1 WHERE name = ?',
+                      [(waited, name) for name in names if name in LIMITS])
+
+
+def penalize(names, seconds):
+    # The upstream answered 429: empty the buckets so nobody calls before Retry-After has passed
+    now = time.time()
+    db = _db()
+    for name in names:
+        if name in LIMITS:
+            rate, _ = LIMITS[name]
+            db.execute('INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) '
+                       'ON CONFLICT(name) DO UPDATE SET tokens = MIN(tokens, excluded.tokens), updated = excluded.updated, '
+                       'throttled = throttled + 1',
+                       (name, -seconds * rate, now))
+
+
+def status():
+    now = time.time()
+    rows = {row['name']: row for row in _db().execute('SELECT * FROM buckets')}
+    out = {}
+    for name, (rate, burst) in sorted(LIMITS.items()):
+        row = rows.get(name)
+        out[name] = {'rate': rate, 'burst': burst, 'tokens': round(_refill(row, name, now), 2),
+                     'calls': row['calls'] if row else 0, 'queued': row['queued'] if row else 0,
+                     'waited_s': round(row['waited'], 1) if row else 0,
+                     # 429s that still got through, i.e. the configured rate is above the real quota
+                     'throttled': row['throttled'] if row else 0}
+    return out
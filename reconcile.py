@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytz
+
+import booking_ledger
+import coordination
+import upstream_http
+from booking_job import BookingJob
+
+# Repairs bookings whose webhook process died or never ran. Only Nexudus bookings changed since
+# the last run and ledger entries left half-done are looked at, so a run costs what changed,
+# not what exists. Run from Heroku Scheduler:  python3 reconcile.py
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', '20'))
+RECONCILE_BATCH_PAUSE = float(os.environ.get('RECONCILE_BATCH_PAUSE', '10'))
+RECONCILE_MAX_CHANGES = int(os.environ.get('RECONCILE_MAX_CHANGES', '1000'))
+RECONCILE_FIRST_LOOKBACK_HOURS = float(os.environ.get('RECONCILE_FIRST_LOOKBACK_HOURS', '24'))
+RECONCILE_PAGE_SIZE = int(os.environ.get('RECONCILE_PAGE_SIZE', '100'))
+RECONCILE_TIMEOUT = float(os.environ.get('RECONCILE_TIMEOUT', '30'))
+
+WATERMARK = 'nexudus_bookings_updated_on'
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+SKIP, PROVISION, MOVE, VERIFY = 'skip', 'provision', 'move', 'verify'
+
+
+def fetch_changed(base_url, access_token, updated_since):
+    # Oldest change first, so the watermark can advance batch by batch
+    page = 1
+    while True:
+        params = {'page': page, 'size': RECONCILE_PAGE_SIZE, 'orderby': 'UpdatedOn', 'dir': 'Ascending',
+                  'from_Booking_UpdatedOn': updated_since}
+        response = upstream_http.get(upstream_http.NEXUDUS, 'api/spaces/bookings', f'{base_url}api/spaces/bookings', params=params,
+                                     headers={'Authorization': f'Bearer {access_token}'}, timeout=RECONCILE_TIMEOUT)
+        response.raise_for_status()
+        body = response.json()
+        yield from body.get('Records', [])
+        if not body.get('HasNextPage'):
+            return
+        page += 1
+
+
+def diagnose(booking, row, now):
+    if booking.tentative:
+        return SKIP
+    if datetime.strptime(booking.to_time, TIME_FORMAT).replace(tzinfo=pytz.utc) <= now:
+        return SKIP
+    if row is None:
+        # webhook lost, or its process died before claiming the booking
+        return PROVISION
+    if row['state'] == booking_ledger.PROVISIONED:
+        same_slot = (row['resource_id'] == booking.resource_id and row['from_time'] == booking.from_time
+                     and row['to_time'] == booking.to_time)
+        return VERIFY if same_slot else MOVE
+    # deferred bookings belong to preprovision.py; half-done ones are picked up by repair_stuck()
+    return SKIP
+
+
+def old_slot(booking, row):
+    return booking.moved(row['resource_id'], row['from_time'], row['to_time'])
+
+
+def repair(service, action, booking, row):
+    if action == MOVE:
+        # the passcodes issued for the previous slot would otherwise stay valid
+        service.handle_cancel_request(old_slot(booking, row), None, 'reconcile')
+    elif action == VERIFY:
+        issued = service.issued_passcodes(booking, json.loads(row['passcodes'] or '[]'))
+        if not issued or None not in issued.values():
+            return False
+        # re-adding every door would leave the passcodes still on the other locks live beside new ones
+        booking_ledger.reissue(booking, {mac: passcode for mac, passcode in issued.items() if passcode is not None})
+        coordination.forget(service.provisioned_key(booking))
+    service.handle_request(booking, None, 'reconcile')
+    return True
+
+
+def repair_stuck(service, summary):
+    for row in booking_ledger.stuck():
+        booking = row['payload']
+        # clear whatever the dead process managed to issue before finishing the job
+        service.handle_cancel_request(booking, None, 'reconcile')
+        if row['state'] == booking_ledger.PROVISIONING:
+            service.handle_request(booking, None, 'reconcile')
+            summary['stuck_provisioning'] += 1
+        else:
+            summary['stuck_cancelling'] += 1
+
+
+def run(service, batch_size, batch_pause, max_changes):
+    now = datetime.now(tz=pytz.utc)
+    since = booking_ledger.watermark(WATERMARK) or \
+        (now - timedelta(hours=RECONCILE_FIRST_LOOKBACK_HOURS)).strftime(TIME_FORMAT)
+    summary = Counter()
+
+    repair_stuck(service, summary)
+
+    processed = 0
+    batch = []
+    for booking in fetch_changed(service.nexudus_base_url, service.get_nexudus_access_token(), since):
+        batch.append(booking)
+        if len(batch) >= batch_size:
+            processed += reconcile_batch(service, batch, now, summary)
+            batch = []
+            if processed >= max_changes:
+                break
+            time.sleep(batch_pause)
+    else:
+        if batch:
+            processed += reconcile_batch(service, batch, now, summary)
+
+    summary['changes'] = processed
+    result = dict(summary)
+    result['watermark'] = booking_ledger.watermark(WATERMARK)
+    return result
+
+
+def reconcile_batch(service, batch, now, summary):
+    for record in batch:
+        booking = BookingJob.from_nexudus(record)
+        action = diagnose(booking, booking_ledger.get(booking.booking_id), now)
+        summary[action] += 1
+        if action != SKIP and repair(service, action, booking, booking_ledger.get(booking.booking_id)):
+            summary['repaired'] += 1
+    # everything up to here is settled; a crash later resumes from this batch's last change
+    booking_ledger.set_watermark(WATERMARK, batch[-1]['UpdatedOn'])
+    return len(batch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile Nexudus bookings with the ledger and lock passcodes')
+    parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+    parser.add_argument('--batch-pause', type=float, default=RECONCILE_BATCH_PAUSE, help='seconds between batches')
+    parser.add_argument('--max-changes', type=int, default=RECONCILE_MAX_CHANGES)
+    parser.add_argument('--since', help='UpdatedOn to restart from, overriding the stored watermark')
+    args = parser.parse_args(argv)
+
+    from booking_worker import pipeline as service
+
+    if args.since:
+        booking_ledger.set_watermark(WATERMARK, args.since)
+    summary = run(service, max(args.batch_size, 1), args.batch_pause, args.max_changes)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import ast
+import json
+import re
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+import proc_stats
+from booking_job import BookingJob
+
+LINE_RE = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?[+-]\d\d:\d\d) app\[[^\]]+\]: ?(.*)')
+# The 'received' events carry the job as the queue stores it; webhook jobs only, not pull or reconcile runs
+JOB_STAGES = {'received': '/booking-webhook', 'cancel_received': '/booking-cancelled'}
+JOB_MARKER = '(webhook), job '
+STAGE_RE = re.compile(r' stage=(\w+)')
+# Dumps from before the job record: sampled payload dicts, replayed when complete
+BOOKING_MARKER = 'handle_request data: '
+CANCEL_MARKER = 'Cancel request data: '
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def job_event(message):
+    # (webhook path, job) from a JSON or text 'received' record, else None
+    if message.startswith('{'):
+        try:
+            record = json.loads(message)
+        except ValueError:
+            return None
+        stage, text = record.get('stage'), record.get('msg', '')
+    else:
+        stage = STAGE_RE.search(message)
+        stage, text = stage and stage.group(1), message
+    index = text.find(JOB_MARKER)
+    if stage not in JOB_STAGES or index == -1:
+        return None
+    try:
+        fields, _ = json.JSONDecoder().raw_decode(text, index + len(JOB_MARKER))
+    except ValueError:
+        return None
+    return JOB_STAGES[stage], BookingJob(*fields)
+
+
+def events_from_log(path):
+    # Yields {'at': epoch seconds, 'path': webhook path, 'payload': booking(s)} from a Heroku dump
+    seen = set()
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = LINE_RE.search(line.rstrip('\n').rstrip('\\'))
+            if not match:
+                continue
+            ts_text, message = match.groups()
+            event = job_event(message)
+            if event:
+                webhook, job = event
+                # a parked or deadline-requeued job logs 'received' again on every attempt
+                if (webhook, job.astuple()) not in seen:
+                    seen.add((webhook, job.astuple()))
+                    yield {'at': datetime.fromisoformat(ts_text).timestamp(), 'path': webhook,
+                           'payload': [job.as_nexudus()]}
+                continue
+            message = message.replace('\\{', '{').replace('\\}', '}')
+            for marker, webhook in ((BOOKING_MARKER, '/booking-webhook'), (CANCEL_MARKER, '/booking-cancelled')):
+                index = message.find(marker)
+                if index == -1:
+                    continue
+                try:
+                    payload = ast.literal_eval(message[index + len(marker):])
+                except (ValueError, SyntaxError):
+                    # truncated or sampled record, nothing to replay
+                    continue
+                yield {'at': datetime.fromisoformat(ts_text).timestamp(), 'path': webhook, 'payload': payload}
+
+
+def events_from_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def load_events(path):
+    if path == '-':
+        return events_from_jsonl(sys.stdin)
+    if path.endswith('.jsonl'):
+        return events_from_jsonl(open(path))
+    return events_from_log(path)
+
+
+def shift_booking(booking, delta):
+    # Moves the booking window so it keeps the same distance from "now" as when captured
+    shifted = dict(booking)
+    for key in ('FromTime', 'ToTime'):
+        if isinstance(shifted.get(key), str):
+            moved = datetime.strptime(shifted[key], TIME_FORMAT) + delta
+            shifted[key] = moved.strftime(TIME_FORMAT)
+    return shifted
+
+
+class ProcessSampler(threading.Thread):
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_children = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            total, children, _ = proc_stats.tree_rss(self.pid)
+            self.peak_rss = max(self.peak_rss, total)
+            self.peak_children = max(self.peak_children, children)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def stub_stats(stub_url):
+    return requests.get(f'{stub_url}/_stats', timeout=5).json()
+
+
+def wait_for_provisioning(stub_url, expected, idle_timeout):
+    # Waits until the stand-in has seen `expected` messages or nothing changed for idle_timeout
+    last_count, last_change = -1, time.monotonic()
+    while True:
+        stats = stub_stats(stub_url)
+        if stats['messages'] >= expected:
+            return stats
+        if stats['messages'] != last_count:
+            last_count, last_change = stats['messages'], time.monotonic()
+        elif time.monotonic() - last_change > idle_timeout:
+            return stats
+        time.sleep(0.5)
+
+
+def replay(events, target, speedup=1.0, shift_times=True, concurrency=32, limit=None):
+    session = requests.Session()
+    acks = []
+    errors = []
+    sent = {'/booking-webhook': 0, '/booking-cancelled': 0}
+    lock = threading.Lock()
+
+    def fire(event):
+        started = time.perf_counter()
+        try:
+            response = session.post(f'{target}{event["path"]}', json=event['payload'], timeout=30)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                acks.append(elapsed)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+        except requests.RequestException as e:
+            with lock:
+                errors.append(type(e).__name__)
+
+    first_at = None
+    wall_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for n, event in enumerate(events):
+            if limit is not None and n >= limit:
+                break
+            if first_at is None:
+                first_at = event['at']
+            if speedup:
+                due = wall_start + (event['at'] - first_at) / speedup
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if shift_times:
+                delta = timedelta(seconds=time.time() - event['at'])
+                payload = event['payload']
+                if isinstance(payload, list):
+                    event = dict(event, payload=[shift_booking(b, delta) for b in payload])
+                else:
+                    event = dict(event, payload=shift_booking(payload, delta))
+            sent[event['path']] += 1
+            pool.submit(fire, event)
+    return {'sent': sent, 'acks': acks, 'errors': errors, 'send_seconds': time.monotonic() - wall_start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured or generated webhooks against the service')
+    parser.add_argument('source', help="Heroku log dump, generator .jsonl file or '-' for JSON lines on stdin")
+    parser.add_argument('--target', default='http://127.0.0.1:5000', help='service base URL')
+    parser.add_argument('--stub', default='http://127.0.0.1:5055', help='upstream_stub.py base URL')
+    parser.add_argument('--speedup', type=float, default=1.0, help='replay pace multiplier, 0 = as fast as possible')
+    parser.add_argument('--pid', type=int, help='service (gunicorn master) pid for RSS and child-process sampling')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--no-shift-times', action='store_true', help='keep the captured FromTime/ToTime values')
+    parser.add_argument('--idle-timeout', type=float, default=60, help='stop waiting for provisioning after this much quiet')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    requests.post(f'{args.stub}/_reset', timeout=5)
+    sampler = ProcessSampler(args.pid) if args.pid else None
+    if sampler:
+        sampler.start()
+
+    started = time.monotonic()
+    result = replay(load_events(args.source), args.target, args.speedup, not args.no_shift_times,
+                    args.concurrency, args.limit)
+    bookings = result['sent']['/booking-webhook']
+    stats = wait_for_provisioning(args.stub, bookings, args.idle_timeout)
+    elapsed = time.monotonic() - started
+    if sampler:
+        sampler.stop()
+
+    acks = result['acks']
+    report = {
+        'sent': result['sent'],
+        'errors': len(result['errors']),
+        'ack_p50_ms': percentile(acks, 0.5),
+        'ack_p99_ms': percentile(acks, 0.99),
+        'ack_max_ms': max(acks) if acks else None,
+        'ack_mean_ms': statistics.fmean(acks) if acks else None,
+        'provisioned': stats['messages'],
+        'passcodes_added': stats['counters'].get('sciener.passcodes_added', 0),
+        'busy_replies': stats['counters'].get('sciener.busy', 0),
+        'provisioning_per_min': round(stats['messages'] / elapsed * 60, 2) if elapsed else None,
+        'elapsed_s': round(elapsed, 2),
+        'peak_rss_mb': round(sampler.peak_rss / 2 ** 20, 1) if sampler else None,
+        'peak_child_processes': sampler.peak_children if sampler else None,
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f'{key:22} {round(value, 2) if isinstance(value, float) else value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import fcntl
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+from types import MappingProxyType
+
+# Resource -> lock routing, door names and resource classes. Readers take a snapshot with
+# current() and never block; writers build a new snapshot and swap the reference.
+REGISTRY_PATH = pathlib.Path(os.environ.get('RESOURCE_REGISTRY_PATH', pathlib.Path(__file__).parent / 'resources.json'))
+REGISTRY_RELOAD_INTERVAL = float(os.environ.get('RESOURCE_REGISTRY_RELOAD_INTERVAL', '5'))
+
+RESOURCE_CLASSES = ('single', 'case1', 'case2')
+MAC_RE = re.compile(r'^([0-9A-F]{2}:){5}[0-9A-F]{2}$')
+
+
+class RegistryError(ValueError):
+    pass
+
+
+class Registry:
+    __slots__ = ('resources', 'resource_to_lock', 'door_names', 'classes', 'main_doors', 'sync', 'version')
+
+    def __init__(self, data, version=0):
+        resources = {}
+        for key, entry in data.get('resources', {}).items():
+            resource_class = entry.get('class')
+            if resource_class not in RESOURCE_CLASSES:
+                raise RegistryError(f'Resource {key} has unknown class {resource_class!r}')
+            lock_mac = entry.get('lock_mac')
+            if lock_mac is not None and not MAC_RE.match(lock_mac):
+                raise RegistryError(f'Resource {key} has malformed lock_mac {lock_mac!r}')
+            resources[int(key)] = MappingProxyType(dict(entry))
+        self.resources = MappingProxyType(resources)
+        self.resource_to_lock = MappingProxyType({rid: e['lock_mac'] for rid, e in resources.items() if e.get('lock_mac')})
+        self.door_names = MappingProxyType(dict(data.get('doors', {})))
+        self.classes = MappingProxyType({name: frozenset(rid for rid, e in resources.items() if e['class'] == name)
+                                         for name in RESOURCE_CLASSES})
+        self.main_doors = MappingProxyType({name: tuple(data.get('main_doors', {}).get(name, ()))
+                                            for name in RESOURCE_CLASSES})
+        # UpdatedOn watermark of the last Nexudus sync (nexudus_sync.py)
+        self.sync = MappingProxyType(dict(data.get('sync', {})))
+        self.version = version
+
+    def resource_class(self, resource_id):
+        entry = self.resources.get(resource_id)
+        return entry['class'] if entry else None
+
+    def door_name(self, lock_mac):
+        return self.door_names.get(lock_mac, "Unknown Door")
+
+    def to_dict(self):
+        return {
+            'resources': {str(rid): dict(entry) for rid, entry in self.resources.items()},
+            'doors': dict(self.door_names),
+            'main_doors': {name: list(macs) for name, macs in self.main_doors.items() if macs},
+            'sync': dict(self.sync),
+        }
+
+
+_current = None
+_loaded_mtime = None
+_checked = 0.0
+_write_lock = threading.Lock()
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load(path=None):
+    global _current, _loaded_mtime
+    path = path or REGISTRY_PATH
+    mtime = os.stat(path).st_mtime_ns
+    registry = Registry(_read(path), version=mtime)
+    # single reference assignment: readers see either the old or the new snapshot
+    _current, _loaded_mtime = registry, mtime
+    return registry
+
+
+def current():
+    global _checked
+    if _current is None:
+        return load()
+    now = time.monotonic()
+    if now - _checked >= REGISTRY_RELOAD_INTERVAL:
+        _checked = now
+        try:
+            if os.stat(REGISTRY_PATH).st_mtime_ns != _loaded_mtime:
+                load()
+        except (OSError, ValueError):
+            # keep serving the last good snapshot
+            pass
+    return _current
+
+
+def _write(data):
+    tmp = REGISTRY_PATH.with_suffix('.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, REGISTRY_PATH)
+
+
+def update(change):
+    # change(data) edits a plain-dict copy of the file; validated, persisted, then swapped in
+    with _write_lock, open(REGISTRY_PATH.with_suffix('.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = _read(REGISTRY_PATH)
+        change(data)
+        Registry(data)
+        _write(data)
+        return load()
+
+
+def add_resource(resource_id, lock_mac, resource_class='single', name=None, door_name=None):
+    if resource_class not in RESOURCE_CLASSES:
+        raise RegistryError(f'Unknown class {resource_class!r}, expected one of {", ".join(RESOURCE_CLASSES)}')
+
+    def change(data):
+        entry = data.setdefault('resources', {}).get(str(resource_id), {})
+        entry.update({'lock_mac': lock_mac, 'class': resource_class})
+        if name:
+            entry['name'] = name
+        data['resources'][str(resource_id)] = entry
+        if door_name:
+            data.setdefault('doors', {})[lock_mac] = door_name
+
+    return update(change)
+
+
+def remove_resource(resource_id):
+    def change(data):
+        if data.get('resources', {}).pop(str(resource_id), None) is None:
+            raise RegistryError(f'Unknown resource {resource_id}')
+
+    return update(change)
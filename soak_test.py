@@ -0,0 +1,93 @@
+import argparse
+import csv
+import json
+import threading
+import time
+
+import requests
+
+import proc_stats
+import replay_bench
+from booking_generator import BookingGenerator, parse_mix
+
+
+def leak_slope_mb_per_hour(samples):
+    # Least-squares slope of total RSS over time; a steady climb means a leak
+    if len(samples) < 2:
+        return None
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_m = sum(m for _, m in samples) / n
+    var = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not var:
+        return None
+    slope = sum((t - mean_t) * (m - mean_m) for t, m in samples) / var
+    return round(slope * 3600 / 2 ** 20, 2)
+
+
+def sample_memory(pid, out_path, interval, stop, summary):
+    started = time.monotonic()
+    totals = []
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['elapsed_s', 'pid', 'rss_mb', 'total_rss_mb', 'child_processes'])
+        while not stop.is_set():
+            elapsed = round(time.monotonic() - started, 1)
+            total, children, per_process = proc_stats.tree_rss(pid)
+            for process_id, rss in sorted(per_process.items()):
+                writer.writerow([elapsed, process_id, round(rss / 2 ** 20, 1), round(total / 2 ** 20, 1), children])
+            f.flush()
+            totals.append((elapsed, total))
+            summary['peak_total_rss_mb'] = max(summary.get('peak_total_rss_mb', 0), round(total / 2 ** 20, 1))
+            summary['peak_child_processes'] = max(summary.get('peak_child_processes', 0), children)
+            summary['rss_slope_mb_per_hour'] = leak_slope_mb_per_hour(totals)
+            stop.wait(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sustained synthetic webhook load with RSS recording')
+    parser.add_argument('--pid', type=int, required=True, help='service (gunicorn master) pid')
+    parser.add_argument('--target', default='http://127.0.0.1:5000')
+    parser.add_argument('--stub', default='http://127.0.0.1:5055')
+    parser.add_argument('--hours', type=float, default=4)
+    parser.add_argument('--rate', type=float, default=6.0, help='booking webhooks per minute')
+    parser.add_argument('--mix', default='single=0.5,case1=0.2,case2=0.3')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between RSS samples')
+    parser.add_argument('--out', default='soak_rss.csv')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    requests.post(f'{args.stub}/_reset', timeout=5)
+    generator = BookingGenerator(parse_mix(args.mix), args.rate, seed=args.seed)
+    deadline = time.time() + args.hours * 3600
+
+    def events():
+        for event in generator.arrivals(time.time()):
+            if event['at'] > deadline:
+                return
+            yield event
+
+    summary = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_memory, args=(args.pid, args.out, args.interval, stop, summary),
+                               daemon=True)
+    sampler.start()
+    result = replay_bench.replay(events(), args.target, speedup=1.0, shift_times=False)
+    stats = replay_bench.stub_stats(args.stub)
+    stop.set()
+    sampler.join()
+
+    acks = result['acks']
+    summary.update({
+        'sent': result['sent'],
+        'rejected': sum(1 for e in result['errors'] if e == 503),
+        'errors': len(result['errors']),
+        'ack_p99_ms': replay_bench.percentile(acks, 0.99),
+        'provisioned': stats['messages'],
+        'rss_csv': args.out,
+    })
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
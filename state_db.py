@@ -0,0 +1,28 @@
+import os
+import pathlib
+import sqlite3
+import threading
+
+# Small sqlite files shared by the web worker and its forked booking processes
+STATE_DIR = pathlib.Path(os.environ.get('STATE_DIR', pathlib.Path(__file__).parent / 'state'))
+
+_local = threading.local()
+
+
+def connect(name, schema=''):
+    # One connection per process and thread; a forked child must not reuse its parent's
+    key = (name, os.getpid())
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(key)
+    if conn is None:
+        STATE_DIR.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(STATE_DIR / f'{name}.db', timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if schema:
+            conn.executescript(schema)
+        conns[key] = conn
+    return conn
@@ -0,0 +1,131 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+# Fixed field set carried by every booking log record
+BOOKING_FIELDS = ('booking_id', 'resource', 'lock', 'stage', 'latency_ms', 'errcode', 'reason')
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+# Share of verbose (payload / per-lock) records that are actually emitted
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_MAX_FIELD_CHARS = int(os.environ.get('LOG_MAX_FIELD_CHARS', '300'))
+LOG_MAX_RECORD_CHARS = int(os.environ.get('LOG_MAX_RECORD_CHARS', '2000'))
+
+_bound_fields = contextvars.ContextVar('bound_log_fields', default={})
+# Callables returning extra correlation fields (request/trace ids) for each record
+_context_providers = []
+
+
+class Truncated:
+    # Defers repr() of large values until a handler actually formats the record
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or LOG_MAX_FIELD_CHARS
+
+    def __str__(self):
+        text = repr(self.value)
+        if len(text) > self.limit:
+            return f'{text[:self.limit]}...(+{len(text) - self.limit} chars)'
+        return text
+
+    __repr__ = __str__
+
+
+def bind(**fields):
+    # Attach booking fields to every record logged from the current context
+    merged = dict(_bound_fields.get())
+    merged.update({k: v for k, v in fields.items() if k in BOOKING_FIELDS and v is not None})
+    return _bound_fields.set(merged)
+
+
+def unbind(token):
+    _bound_fields.reset(token)
+
+
+def bound_fields():
+    return _bound_fields.get()
+
+
+def add_context_provider(provider):
+    _context_providers.append(provider)
+
+
+def sampled(rate=None):
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_event(logger, stage, msg=None, *args, level=logging.INFO, **fields):
+    # msg is a %-format string; args are only formatted if a handler emits the record
+    if not logger.isEnabledFor(level):
+        return
+    extra = {k: v for k, v in fields.items() if k in BOOKING_FIELDS and v is not None}
+    extra['stage'] = stage
+    logger.log(level, msg or stage, *args, extra=extra)
+
+
+def log_verbose(logger, msg, *args, rate=None):
+    # Debug-level detail (payload dumps, per-page scans), sampled and lazily formatted
+    if not logger.isEnabledFor(logging.DEBUG) or not sampled(rate):
+        return
+    logger.debug(msg, *(Truncated(arg) if isinstance(arg, (dict, list)) else arg for arg in args))
+
+
+def _record_fields(record):
+    fields = {}
+    for provider in _context_providers:
+        fields.update((k, v) for k, v in provider().items() if v is not None)
+    fields.update(_bound_fields.get())
+    for field in BOOKING_FIELDS:
+        value = getattr(record, field, None)
+        if value is not None:
+            fields[field] = value
+    return fields
+
+
+def _cap(text, limit):
+    if len(text) > limit:
+        return f'{text[:limit]}...(truncated)'
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': _cap(record.getMessage(), LOG_MAX_RECORD_CHARS),
+        }
+        entry.update(_record_fields(record))
+        if record.exc_info:
+            entry['exc'] = _cap(self.formatException(record.exc_info), LOG_MAX_RECORD_CHARS)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    # Same prefix as logging.basicConfig so existing log searches keep working
+    def format(self, record):
+        text = f'{record.levelname}:{record.name}:{_cap(record.getMessage(), LOG_MAX_RECORD_CHARS)}'
+        fields = _record_fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{k}={v}' for k, v in fields.items())
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+def configure(level=None, fmt=None):
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == 'json' else TextFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or LOG_LEVEL)
+    return root
@@ -0,0 +1,337 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import structured_logging
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'smartlock-integration')
+# '' disables export, 'file:/path/spans.jsonl' or 'otlp:http://localhost:4318/v1/traces'
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', '')
+TRACE_BATCH_SIZE = int(os.environ.get('TRACE_BATCH_SIZE', '64'))
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'request_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, trace_id, parent_id=None, request_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.request_id = request_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'request_id': self.request_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _RemoteParent:
+    # Stand-in for a span that lives in another process
+    __slots__ = ('trace_id', 'span_id', 'request_id')
+
+    def __init__(self, trace_id, span_id, request_id):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.request_id = request_id
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict()) + '\n' for span in spans)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpExporter:
+    # OTLP/HTTP JSON encoding, good enough for a collector or the stand-in below
+    def __init__(self, url, timeout=2):
+        self.url = url
+        self.timeout = timeout
+
+    def export(self, spans):
+        otlp_spans = []
+        for span in spans:
+            attributes = dict(span.attributes, request_id=span.request_id)
+            otlp_spans.append({
+                'traceId': span.trace_id,
+                'spanId': span.span_id,
+                'parentSpanId': span.parent_id or '',
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in attributes.items() if v is not None],
+                'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+            })
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': otlp_spans}],
+        }]}
+        try:
+            requests.post(self.url, json=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.warning("Failed exporting %d spans to %s: %s", len(spans), self.url, e)
+
+
+def _make_exporter(spec):
+    if spec.startswith('file:'):
+        return FileExporter(spec[len('file:'):])
+    if spec.startswith('otlp:'):
+        return OtlpExporter(spec[len('otlp:'):])
+    return None
+
+
+_exporter = _make_exporter(TRACE_EXPORTER)
+_pending = []
+_pending_lock = threading.Lock()
+
+
+def _record(span):
+    if _exporter is None:
+        return
+    with _pending_lock:
+        _pending.append(span)
+        full = len(_pending) >= TRACE_BATCH_SIZE
+    if full:
+        flush()
+
+
+def flush():
+    global _pending
+    if _exporter is None:
+        return
+    with _pending_lock:
+        batch, _pending = _pending, []
+    if batch:
+        _exporter.export(batch)
+
+
+def _reset_after_fork():
+    global _pending
+    # the parent's unexported spans are not ours to send
+    _pending = []
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_request_id():
+    return str(uuid.uuid4())
+
+
+def start_trace(request_id=None):
+    # Roots a new trace for an incoming webhook; returns a token for end_trace()
+    request_id = request_id or new_request_id()
+    return _current.set(_RemoteParent(uuid.uuid4().hex, None, request_id))
+
+
+def end_trace(token):
+    _current.reset(token)
+
+
+def current_context():
+    # Picklable trace context handed to worker processes
+    parent = _current.get()
+    if parent is None:
+        return None
+    return {'trace_id': parent.trace_id, 'span_id': parent.span_id, 'request_id': parent.request_id}
+
+
+def attach(context):
+    if not context:
+        return _current.set(_RemoteParent(uuid.uuid4().hex, None, None))
+    return _current.set(_RemoteParent(context['trace_id'], context.get('span_id'), context.get('request_id')))
+
+
+def detach(token):
+    _current.reset(token)
+
+
+def current_span():
+    span = _current.get()
+    return span if isinstance(span, Span) else None
+
+
+def set_attribute(key, value):
+    span = current_span()
+    if span is not None:
+        span.set(key, value)
+
+
+class span:
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+
+    def __enter__(self):
+        parent = _current.get()
+        if parent is None:
+            self._span = Span(self.name, uuid.uuid4().hex, attributes=self.attributes)
+        else:
+            self._span = Span(self.name, parent.trace_id, parent.span_id, parent.request_id, self.attributes)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.end_ns = time.time_ns()
+        if exc_type is not None:
+            self._span.error = f'{exc_type.__name__}: {exc}'
+        _current.reset(self._token)
+        _record(self._span)
+        return False
+
+
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _log_context():
+    current = _current.get()
+    if current is None:
+        return {}
+    return {'request_id': current.request_id, 'trace_id': current.trace_id, 'span_id': current.span_id}
+
+
+structured_logging.add_context_provider(_log_context)
+
+
+# --- collector stand-in and span inspection -------------------------------------------
+
+def _flatten_otlp(body):
+    for resource_spans in body.get('resourceSpans', []):
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for otlp in scope_spans.get('spans', []):
+                attributes = {a['key']: next(iter(a['value'].values())) for a in otlp.get('attributes', [])}
+                start_ns, end_ns = int(otlp['startTimeUnixNano']), int(otlp['endTimeUnixNano'])
+                yield {
+                    'trace_id': otlp['traceId'],
+                    'span_id': otlp['spanId'],
+                    'parent_id': otlp.get('parentSpanId') or None,
+                    'request_id': attributes.pop('request_id', None),
+                    'name': otlp['name'],
+                    'start_ns': start_ns,
+                    'end_ns': end_ns,
+                    'duration_ms': round((end_ns - start_ns) / 1e6, 3),
+                    'attributes': attributes,
+                    'error': otlp.get('status', {}).get('message'),
+                }
+
+
+def serve_collector(port, out_path):
+    file_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with file_lock, open(out_path, 'a') as f:
+                for record in _flatten_otlp(body):
+                    f.write(json.dumps(record) + '\n')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f'OTLP collector stand-in on http://127.0.0.1:{port}/v1/traces -> {out_path}')
+    server.serve_forever()
+
+
+def show_trace(path, request_id):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('request_id') == request_id:
+                spans.append(record)
+    if not spans:
+        print(f'No spans for request_id {request_id}')
+        return
+    children = {}
+    for record in spans:
+        children.setdefault(record['parent_id'], []).append(record)
+    known = {record['span_id'] for record in spans}
+    roots = [record for record in spans if record['parent_id'] not in known]
+    t0 = min(record['start_ns'] for record in spans)
+
+    def walk(record, depth):
+        offset = (record['start_ns'] - t0) / 1e6
+        attrs = ' '.join(f'{k}={v}' for k, v in record['attributes'].items())
+        error = f" ERROR {record['error']}" if record.get('error') else ''
+        print(f"{offset:10.1f}ms {'  ' * depth}{record['name']} {record['duration_ms']:.1f}ms {attrs}{error}")
+        for child in sorted(children.get(record['span_id'], []), key=lambda r: r['start_ns']):
+            walk(child, depth + 1)
+
+    for root in sorted(roots, key=lambda r: r['start_ns']):
+        walk(root, 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Trace collector stand-in and span viewer')
+    sub = parser.add_subparsers(dest='command', required=True)
+    collect = sub.add_parser('collect', help='accept OTLP/HTTP JSON spans and append them to a file')
+    collect.add_argument('--port', type=int, default=4318)
+    collect.add_argument('--out', default='spans.jsonl')
+    show = sub.add_parser('show', help='print the span tree of one booking request')
+    show.add_argument('path')
+    show.add_argument('request_id')
+    args = parser.parse_args()
+    if args.command == 'collect':
+        serve_collector(args.port, args.out)
+    else:
+        show_trace(args.path, args.request_id)
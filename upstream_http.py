@@ -0,0 +1,217 @@
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import requests
+
+import circuit_breaker
+import hedging
+import rate_limiter
+
+# Every Sciener and Nexudus call goes through call(), which checks the upstream-wide and the
+# per-endpoint breaker before sending and reports the outcome to both afterwards, and takes a
+# token from the shared rate limiter for the upstream and the endpoint's class
+SCIENER, NEXUDUS = 'sciener', 'nexudus'
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '15'))
+# Passcode add/delete wait for the lock's gateway to answer
+UPSTREAM_GATEWAY_READ_TIMEOUT = float(os.environ.get('UPSTREAM_GATEWAY_READ_TIMEOUT', '30'))
+# Below this much budget a call is not started at all
+UPSTREAM_MIN_BUDGET = float(os.environ.get('UPSTREAM_MIN_BUDGET', '1'))
+# A 429 is waited out through the rate limiter this many times before it counts as a failure
+UPSTREAM_THROTTLE_RETRIES = int(os.environ.get('UPSTREAM_THROTTLE_RETRIES', '2'))
+# Used when a 429 carries no Retry-After
+UPSTREAM_THROTTLE_BACKOFF = float(os.environ.get('UPSTREAM_THROTTLE_BACKOFF', '5'))
+
+READ_TIMEOUTS = {
+    'v3/keyboardPwd/add': UPSTREAM_GATEWAY_READ_TIMEOUT,
+    'v3/keyboardPwd/delete': UPSTREAM_GATEWAY_READ_TIMEOUT,
+}
+# Never sent with a timeout cut down to the budget: an add that completes after we stopped
+# waiting leaves a passcode on the lock that no ledger knows about
+UNTRIMMED = frozenset({'v3/keyboardPwd/add'})
+
+# Rate-limit class per endpoint; anything not listed is 'read'
+ENDPOINT_CLASSES = {
+    'oauth2/token': 'token',
+    'api/token': 'token',
+    'v3/keyboardPwd/add': 'write',
+    'v3/keyboardPwd/delete': 'write',
+    'api/spaces/coworkermessages': 'write',
+}
+
+_deadline = contextvars.ContextVar('upstream_deadline', default=None)
+# Set once the process is being stopped: caps every budget and wakes every sleep()
+_shutdown = {'at': None}
+_shutdown_event = threading.Event()
+
+
+class UpstreamError(requests.RequestException):
+    # breaker names the circuit the failed work should wait on before it is tried again
+    def __init__(self, message, breaker=None, **kwargs):
+        super().__init__(message, **kwargs)
+        self.breaker = breaker
+
+
+class CircuitOpen(UpstreamError):
+    def __init__(self, breaker):
+        super().__init__(f'Circuit open for {breaker}', breaker)
+
+
+class DeadlineExceeded(UpstreamError):
+    # The work ran out of budget; not the upstream's fault, so no breaker is charged
+    def __init__(self, message):
+        super().__init__(message, 'deadline')
+
+
+class ShuttingDown(DeadlineExceeded):
+    # The process is stopping; the work is handed back to be picked up again straight away
+    def __init__(self, message):
+        super().__init__(message)
+        self.breaker = 'shutdown'
+
+
+def begin_shutdown(grace):
+    # Work in flight gets at most grace seconds more, then stops at its next call or wait
+    ends = time.monotonic() + grace
+    if _shutdown['at'] is None or ends < _shutdown['at']:
+        _shutdown['at'] = ends
+    _shutdown_event.set()
+
+
+def shutting_down():
+    return _shutdown['at'] is not None
+
+
+def _out_of_budget(message):
+    ends = _deadline.get()
+    if _shutdown['at'] is not None and (ends is None or _shutdown['at'] <= ends):
+        return ShuttingDown(message)
+    return DeadlineExceeded(message)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    # Budget for everything inside the block; a nested budget can only shorten the outer one
+    outer = _deadline.get()
+    ends = time.monotonic() + seconds
+    token = _deadline.set(min(ends, outer) if outer is not None else ends)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    ends = _deadline.get()
+    if _shutdown['at'] is not None:
+        ends = _shutdown['at'] if ends is None else min(ends, _shutdown['at'])
+    return None if ends is None else ends - time.monotonic()
+
+
+def sleep(seconds):
+    # time.sleep() that refuses to outlive the budget, and is cut short by a shutdown
+    left = remaining()
+    if left is not None and seconds > left - UPSTREAM_MIN_BUDGET:
+        raise _out_of_budget(f'{seconds:.1f}s wait does not fit the {max(left, 0):.1f}s left')
+    if _shutdown_event.wait(seconds):
+        raise ShuttingDown(f'{seconds:.1f}s wait interrupted by shutdown')
+
+
+def timeouts(endpoint, timeout=None):
+    # (connect, read) for one call: the endpoint's defaults, cut down to what the budget has left
+    connect = UPSTREAM_CONNECT_TIMEOUT
+    read = READ_TIMEOUTS.get(endpoint, UPSTREAM_READ_TIMEOUT)
+    if timeout is not None:
+        connect, read = (timeout if isinstance(timeout, tuple) else (min(connect, timeout), timeout))
+    left = remaining()
+    if left is None:
+        return connect, read
+    if left < UPSTREAM_MIN_BUDGET:
+        raise _out_of_budget(f'{endpoint} not started, {max(left, 0):.1f}s of budget left')
+    if endpoint in UNTRIMMED:
+        if left < connect + read:
+            raise _out_of_budget(f'{endpoint} not started, needs {connect + read:.0f}s, {left:.1f}s left')
+        return connect, read
+    return min(connect, left), min(read, left)
+
+
+def breakers(upstream, endpoint):
+    return upstream, f'{upstream}:{endpoint}'
+
+
+def buckets(upstream, endpoint):
+    return upstream, f'{upstream}:{ENDPOINT_CLASSES.get(endpoint, "read")}'
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', UPSTREAM_THROTTLE_BACKOFF))
+    except ValueError:
+        return UPSTREAM_THROTTLE_BACKOFF
+
+
+def _failed(names, error):
+    for name in names:
+        circuit_breaker.failure(name)
+    return error
+
+
+def call(upstream, endpoint, method, url, timeout=None, **kwargs):
+    timeouts(endpoint, timeout)
+    names = breakers(upstream, endpoint)
+    for name in names:
+        if not circuit_breaker.allow(name):
+            raise CircuitOpen(name)
+    limits = buckets(upstream, endpoint)
+    for _ in range(UPSTREAM_THROTTLE_RETRIES + 1):
+        # queue for a token instead of finding the quota with a 429; the wait is part of the budget
+        rate_limiter.acquire(limits, sleep=sleep)
+        response = _send(upstream, endpoint, method, url, names, limits, timeouts(endpoint, timeout), **kwargs)
+        if response.status_code != 429:
+            break
+        # throttled is not broken: hold everyone back for Retry-After and queue up again
+        rate_limiter.penalize(limits, retry_after(response))
+    else:
+        raise UpstreamError(f'{upstream} {endpoint} still throttled after {UPSTREAM_THROTTLE_RETRIES} retries',
+                            upstream, response=response)
+    if response.status_code >= 500:
+        raise _failed(names, UpstreamError(f'{upstream} {endpoint} answered HTTP {response.status_code}',
+                                           upstream, response=response))
+    try:
+        # outage pages come back as HTML with a 200 now and then
+        response.json()
+    except ValueError:
+        raise _failed(names, UpstreamError(f'{upstream} {endpoint} answered a non-JSON body', upstream,
+                                           response=response))
+    for name in names:
+        circuit_breaker.success(name)
+    return response
+
+
+def _send(upstream, endpoint, method, url, names, limits, timeout, **kwargs):
+    try:
+        if hedging.enabled(method, endpoint):
+            # the hedge is a call like any other and needs a token of its own
+            return hedging.request(endpoint, method, url, may_hedge=lambda: not rate_limiter.try_acquire(limits),
+                                   timeout=timeout, **kwargs)
+        return requests.request(method, url, timeout=timeout, **kwargs)
+    except requests.Timeout as e:
+        left = remaining()
+        if left is not None and left < UPSTREAM_MIN_BUDGET:
+            # cut short by the budget, which says nothing about the upstream's health
+            raise _out_of_budget(f'{upstream} {endpoint} timed out with the budget spent') from e
+        raise _failed(names, UpstreamError(f'{upstream} {endpoint} timed out: {e}', upstream)) from e
+    except requests.RequestException as e:
+        raise _failed(names, UpstreamError(f'{upstream} {endpoint} failed: {e}', upstream)) from e
+
+
+def get(upstream, endpoint, url, **kwargs):
+    return call(upstream, endpoint, 'GET', url, **kwargs)
+
+
+def post(upstream, endpoint, url, **kwargs):
+    return call(upstream, endpoint, 'POST', url, **kwargs)
@@ -0,0 +1,311 @@
+import argparse
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Flask, request, jsonify
+
+import resource_registry
+
+# Local stand-in for the Sciener (euapi.sciener.com) and Nexudus endpoints used by
+# main_updated_Final.py. Point the service at it with
+#   SCIENER_BASE_URL=http://127.0.0.1:5055/ NEXUDUS_BASE_URL=http://127.0.0.1:5055/
+
+stub = Flask(__name__)
+
+
+def parse_distribution(spec):
+    # "const:ms", "uniform:lo,hi", "normal:mean,sd" or "lognormal:median,sigma" (all in ms)
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'const':
+        return lambda: values[0] / 1000
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == 'normal':
+        return lambda: max(random.gauss(values[0], values[1]), 0) / 1000
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+class StubState:
+    def __init__(self, lock_macs, extra_locks=0, locks_per_gateway=1, busy_rate=0.0, errcode1_rate=0.0,
+                 latency=None, add_latency=None, list_latency=None, message_latency=None, token_expires_in=7200,
+                 quota=0):
+        self.busy_rate = busy_rate
+        self.quota = quota
+        self.recent = {}
+        self.errcode1_rate = errcode1_rate
+        self.token_expires_in = token_expires_in
+        self.latency = latency or parse_distribution('const:0')
+        self.add_latency = add_latency or self.latency
+        self.list_latency = list_latency or self.latency
+        self.message_latency = message_latency or self.latency
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.locks = []
+        macs = list(dict.fromkeys(lock_macs))
+        for i in range(extra_locks):
+            macs.append(':'.join(f'{b:02X}' for b in (0xAA, 0xBB, i // 256 % 256, i % 256, 0x00, 0x01)))
+        for i, mac in enumerate(macs):
+            self.locks.append({'lockId': 9000000 + i, 'lockMac': mac, 'lockAlias': f'Stub lock {i}',
+                               'date': int(time.time() * 1000), 'electricQuantity': 80})
+        # Several locks can share one gateway; a gateway runs one command at a time
+        self.gateway_of = {lock['lockId']: i // max(locks_per_gateway, 1) for i, lock in enumerate(self.locks)}
+        self.gateways = {gateway: threading.Lock() for gateway in set(self.gateway_of.values())}
+        self.passcodes = {lock['lockId']: [] for lock in self.locks}
+        self.messages = []
+        self.next_pwd_id = 1
+        self.resources = []
+        self.bookings = []
+
+    def add_bookings(self, count, seed=None):
+        # Upcoming bookings for the pull job, as the generator would have sent them by webhook
+        if count <= 0:
+            return
+        from booking_generator import BookingGenerator, parse_mix
+        generator = BookingGenerator(parse_mix('single=0.5,case1=0.2,case2=0.3'), 60, cancel_share=0,
+                                     duplicate_rate=0, seed=seed)
+        for event in generator.arrivals(time.time()):
+            self.bookings.extend(event['payload'])
+            if len(self.bookings) >= count:
+                break
+        self.bookings.sort(key=lambda b: b['FromTime'])
+
+    def add_resources(self, resources, field_name):
+        updated = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        for resource_id, entry in resources.items():
+            self.resources.append({'Id': resource_id, 'Name': entry.get('name'), 'UpdatedOn': updated,
+                                   'Archived': False,
+                                   'CustomFields': {'Data': [{'Name': field_name, 'Value': entry.get('lock_mac')}]}})
+
+    def over_quota(self, upstream):
+        # Requests per upstream over the last second, like the real APIs' per-app limit
+        if not self.quota:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            recent = [t for t in self.recent.get(upstream, []) if now - t < 1]
+            if len(recent) >= self.quota:
+                self.recent[upstream] = recent
+                self.counters[f'{upstream}.throttled'] += 1
+                return True
+            recent.append(now)
+            self.recent[upstream] = recent
+            return False
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def gateway_command(self, lock_id, latency):
+        # Returns an errcode (0 on success), holding the lock's gateway for the command's duration
+        gateway = self.gateways.get(self.gateway_of.get(lock_id))
+        if gateway is None:
+            return -1
+        if random.random() < self.busy_rate or not gateway.acquire(blocking=False):
+            return -3003
+        try:
+            time.sleep(latency())
+            if random.random() < self.errcode1_rate:
+                return 1
+            return 0
+        finally:
+            gateway.release()
+
+
+state = None
+
+
+@stub.before_request
+def enforce_quota():
+    if request.path.startswith('/_'):
+        return None
+    if state.over_quota('nexudus' if request.path.startswith('/api/') else 'sciener'):
+        return jsonify({'errcode': 429, 'errmsg': 'Too many requests'}), 429, {'Retry-After': '1'}
+    return None
+
+
+def params():
+    return request.values
+
+
+def page(items, page_no, page_size):
+    start = (page_no - 1) * page_size
+    return {'list': items[start:start + page_size], 'pageNo': page_no, 'pageSize': page_size,
+            'pages': max(math.ceil(len(items) / page_size), 1), 'total': len(items)}
+
+
+@stub.route('/oauth2/token', methods=['POST'])
+def sciener_token():
+    state.count('sciener.token')
+    time.sleep(state.latency())
+    return jsonify({'access_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex, 'uid': 1,
+                    'openid': 1, 'scope': 'user,key,room', 'token_type': 'Bearer',
+                    'expires_in': state.token_expires_in})
+
+
+@stub.route('/v3/lock/list', methods=['GET'])
+def lock_list():
+    state.count('sciener.lock_list')
+    time.sleep(state.list_latency())
+    return jsonify(page(state.locks, int(params().get('pageNo', 1)), int(params().get('pageSize', 20))))
+
+
+@stub.route('/v3/keyboardPwd/add', methods=['POST'])
+def keyboard_pwd_add():
+    state.count('sciener.keyboardPwd_add')
+    lock_id = int(params().get('lockId', 0))
+    errcode = state.gateway_command(lock_id, state.add_latency)
+    if errcode == -3003:
+        state.count('sciener.busy')
+        return jsonify({'errcode': -3003, 'errmsg': 'The gateway is busy. Please try again later.'})
+    if errcode:
+        state.count(f'sciener.errcode_{errcode}')
+        return jsonify({'errcode': errcode, 'errmsg': 'failed or means no', 'description': 'Stub failure'})
+    with state.lock:
+        pwd_id = state.next_pwd_id
+        state.next_pwd_id += 1
+        state.passcodes[lock_id].append({
+            'keyboardPwdId': pwd_id,
+            'lockId': lock_id,
+            'keyboardPwd': params().get('keyboardPwd'),
+            'keyboardPwdName': params().get('keyboardPwdName'),
+            'startDate': int(params().get('startDate', 0)),
+            'endDate': int(params().get('endDate', 0)),
+            'keyboardPwdType': 3,
+            'sendDate': int(time.time() * 1000),
+        })
+    state.count('sciener.passcodes_added')
+    return jsonify({'keyboardPwdId': pwd_id})
+
+
+@stub.route('/v3/keyboardPwd/delete', methods=['POST'])
+def keyboard_pwd_delete():
+    state.count('sciener.keyboardPwd_delete')
+    lock_id = int(params().get('lockId', 0))
+    pwd_id = int(params().get('keyboardPwdId', 0))
+    errcode = state.gateway_command(lock_id, state.add_latency)
+    if errcode:
+        return jsonify({'errcode': errcode, 'errmsg': 'Stub failure'})
+    with state.lock:
+        state.passcodes[lock_id] = [p for p in state.passcodes[lock_id] if p['keyboardPwdId'] != pwd_id]
+    return jsonify({'errcode': 0, 'errmsg': 'none error message'})
+
+
+@stub.route('/v3/lock/listKeyboardPwd', methods=['GET'])
+def list_keyboard_pwd():
+    state.count('sciener.listKeyboardPwd')
+    time.sleep(state.list_latency())
+    lock_id = int(params().get('lockId', 0))
+    with state.lock:
+        items = list(reversed(state.passcodes.get(lock_id, [])))
+    return jsonify(page(items, int(params().get('pageNo', 1)), int(params().get('pageSize', 20))))
+
+
+@stub.route('/api/token', methods=['POST'])
+def nexudus_token():
+    state.count('nexudus.token')
+    time.sleep(state.latency())
+    return jsonify({'access_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex,
+                    'expires_in': state.token_expires_in, 'token_type': 'bearer'})
+
+
+@stub.route('/api/spaces/coworkermessages', methods=['POST'])
+def coworker_messages():
+    state.count('nexudus.coworkermessages')
+    time.sleep(state.message_latency())
+    with state.lock:
+        state.messages.append({'CoworkerId': params().get('CoworkerId'), 'Subject': params().get('Subject'),
+                               'at': time.time()})
+    return jsonify({'Status': 200, 'Message': 'Coworker message was successfully created.', 'WasSuccessful': True})
+
+
+@stub.route('/api/billing/resources', methods=['GET'])
+def billing_resources():
+    # Nexudus resource list with the lock MAC in a custom field, filtered and ordered by UpdatedOn
+    state.count('nexudus.resources')
+    time.sleep(state.list_latency())
+    since = params().get('from_Resource_UpdatedOn')
+    records = sorted((r for r in state.resources if not since or r['UpdatedOn'] >= since), key=lambda r: r['UpdatedOn'])
+    page_no, size = int(params().get('page', 1)), int(params().get('size', 25))
+    start = (page_no - 1) * size
+    return jsonify({'Records': records[start:start + size], 'CurrentPage': page_no, 'PageSize': size,
+                    'TotalItems': len(records), 'HasNextPage': start + size < len(records)})
+
+
+@stub.route('/api/spaces/bookings', methods=['GET'])
+def spaces_bookings():
+    state.count('nexudus.bookings')
+    time.sleep(state.list_latency())
+    start, end = params().get('from_Booking_FromTime', ''), params().get('to_Booking_FromTime', '9999')
+    updated_since = params().get('from_Booking_UpdatedOn', '')
+    records = [b for b in state.bookings if start <= b['FromTime'] <= end and b['UpdatedOn'] >= updated_since]
+    if params().get('orderby') == 'UpdatedOn':
+        records.sort(key=lambda b: b['UpdatedOn'])
+    page_no, size = int(params().get('page', 1)), int(params().get('size', 25))
+    offset = (page_no - 1) * size
+    return jsonify({'Records': records[offset:offset + size], 'CurrentPage': page_no, 'PageSize': size,
+                    'TotalItems': len(records), 'HasNextPage': offset + size < len(records)})
+
+
+@stub.route('/_stats', methods=['GET'])
+def stats():
+    with state.lock:
+        return jsonify({'counters': dict(state.counters), 'messages': len(state.messages),
+                        'passcodes': sum(len(v) for v in state.passcodes.values()),
+                        'last_message_at': state.messages[-1]['at'] if state.messages else None})
+
+
+@stub.route('/_reset', methods=['POST'])
+def reset():
+    with state.lock:
+        state.counters.clear()
+        state.messages.clear()
+        for lock_id in state.passcodes:
+            state.passcodes[lock_id] = []
+    return jsonify({'ok': True})
+
+
+def default_lock_macs():
+    registry = resource_registry.current()
+    return list(dict.fromkeys(list(registry.resource_to_lock.values()) + list(registry.door_names)))
+
+
+def main(argv=None):
+    global state
+    parser = argparse.ArgumentParser(description='Local Sciener / Nexudus stand-in for load and latency tests')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--extra-locks', type=int, default=60, help='filler locks so lock/list paginates like production')
+    parser.add_argument('--locks-per-gateway', type=int, default=1)
+    parser.add_argument('--busy-rate', type=float, default=0.0, help='share of add/delete calls answered with -3003')
+    parser.add_argument('--errcode1-rate', type=float, default=0.0)
+    parser.add_argument('--latency', default='lognormal:150,0.4', help='default latency distribution (ms)')
+    parser.add_argument('--add-latency', help='keyboardPwd/add and delete latency, holds the gateway')
+    parser.add_argument('--list-latency', help='lock/list and listKeyboardPwd latency')
+    parser.add_argument('--message-latency', help='Nexudus coworkermessages latency')
+    parser.add_argument('--bookings', type=int, default=0, help='upcoming bookings served by api/spaces/bookings')
+    parser.add_argument('--custom-field', default='Lock MAC', help='Nexudus custom field carrying the lock MAC')
+    parser.add_argument('--quota', type=int, default=0, help='requests per second per upstream before answering 429')
+    args = parser.parse_args(argv)
+
+    state = StubState(
+        default_lock_macs(), extra_locks=args.extra_locks, locks_per_gateway=args.locks_per_gateway,
+        busy_rate=args.busy_rate, errcode1_rate=args.errcode1_rate,
+        latency=parse_distribution(args.latency),
+        add_latency=parse_distribution(args.add_latency) if args.add_latency else None,
+        list_latency=parse_distribution(args.list_latency) if args.list_latency else None,
+        message_latency=parse_distribution(args.message_latency) if args.message_latency else None,
+        quota=args.quota,
+    )
+    state.add_resources(resource_registry.current().resources, args.custom_field)
+    state.add_bookings(args.bookings)
+    stub.run(port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()